@@ -0,0 +1,4 @@
+"""
+Makes the `environment` and `models` packages importable by the tests in
+`tests/`, which run on any platform against the simulated backends.
+"""
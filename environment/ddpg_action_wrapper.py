@@ -3,6 +3,13 @@ import numpy as np
 
 
 class DiscretizeActionWrapper(gym.ActionWrapper):
+    """
+    Continuous actions for DDPG, rounded down to the discrete actions of the
+    env. When the env has `repeat_choices`, the action is 2-dimensional: the
+    move and slow mode in [0, 10], and the index of the repeat choice in
+    [0, len(repeat_choices)].
+    """
+
     def __init__(self, env: gym.Env):
         super(DiscretizeActionWrapper, self).__init__(env)
         if not isinstance(env.action_space, gym.spaces.Discrete):
@@ -10,12 +17,26 @@ class DiscretizeActionWrapper(gym.ActionWrapper):
                 "The wrapped environment must have a Discrete action space"
             )
         self.n = env.action_space.n
-        self.action_space = gym.spaces.Box(
-            low=0.0, high=float(self.n), dtype=np.float32
-        )
+        repeat_choices = getattr(env.unwrapped, "repeat_choices", None)
+        self.n_repeats = 1 if repeat_choices is None else len(repeat_choices)
+        if self.n_repeats == 1:
+            self.action_space = gym.spaces.Box(
+                low=0.0, high=float(self.n), dtype=np.float32
+            )
+        else:
+            self.n_moves = self.n // self.n_repeats
+            self.action_space = gym.spaces.Box(
+                low=np.zeros(2, dtype=np.float32),
+                high=np.array((self.n_moves, self.n_repeats), dtype=np.float32),
+                dtype=np.float32,
+            )
 
     def action(self, action: np.ndarray) -> int:
-        if action.item() == self.n:
-            return self.n - 1
-        else:
-            return int(action.item())
+        if self.n_repeats == 1:
+            if action.item() == self.n:
+                return self.n - 1
+            else:
+                return int(action.item())
+        move = min(int(action[0]), self.n_moves - 1)
+        repeat_index = min(int(action[1]), self.n_repeats - 1)
+        return repeat_index * self.n_moves + move
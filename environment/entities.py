@@ -0,0 +1,229 @@
+"""
+Structured enemy and bullet observations read from the game's entity pools.
+
+The bullet pool is a fixed-size array inside the bullet manager, so it is read
+with a single bulk read and decoded at once through a numpy structured dtype.
+Enemies live in a linked list owned by the enemy manager, so the list nodes are
+walked, each node being read in one go, and then each enemy's data block.
+
+Each entity is described by (x, y, vx, vy, type). The type column is 0 for
+padding rows, 1 for enemies and `2 + sprite id` for bullets.
+"""
+
+from typing import NamedTuple
+
+import numpy as np
+
+ENTITY_FIELDS = ("x", "y", "vx", "vy", "type")
+ENEMY_TYPE = 1
+BULLET_TYPE_BASE = 2
+
+
+class EnemyLayout(NamedTuple):
+    # the same chain as the `boss_*` offsets in the interface:
+    # enemy manager -> list head -> nodes (.val = 0x0, .next = 0x4)
+    manager_ptr: int = 0xDB544
+    list_head: int = 0xD0
+    node_val: int = 0x0
+    node_next: int = 0x4
+    # enemy data block, which starts with the previous final position and is
+    # followed by the current final position
+    data: int = 0x11F0
+    prev_pos: int = 0x0
+    pos: int = 0x44
+    max_nodes: int = 256
+
+
+class BulletLayout(NamedTuple):
+    # offsets of ver 1.00b, the version `interface.py` attaches to, from
+    # community research of the game, other versions lay the pool out
+    # differently
+    manager_ptr: int = 0xDB530
+    array: int = 0x8C
+    stride: int = 0x7F0
+    capacity: int = 2000
+    pos: int = 0x3D0
+    vel: int = 0x3DC
+    sprite: int = 0x7A0
+    state: int = 0x7D8
+
+
+def bullet_dtype(layout: BulletLayout) -> np.dtype:
+    """
+    A structured dtype viewing one element of the bullet pool.
+    """
+    return np.dtype(
+        {
+            "names": ["x", "y", "vx", "vy", "sprite", "state"],
+            "formats": ["<f4", "<f4", "<f4", "<f4", "<u2", "<u2"],
+            "offsets": [
+                layout.pos,
+                layout.pos + 4,
+                layout.vel,
+                layout.vel + 4,
+                layout.sprite,
+                layout.state,
+            ],
+            "itemsize": layout.stride,
+        }
+    )
+
+
+def node_dtype(layout: EnemyLayout) -> np.dtype:
+    """
+    A structured dtype viewing the pointers of one node of the enemy list.
+    """
+    return np.dtype(
+        {
+            "names": ["val", "next"],
+            "formats": ["<u4", "<u4"],
+            "offsets": [layout.node_val, layout.node_next],
+            "itemsize": max(layout.node_val, layout.node_next) + 4,
+        }
+    )
+
+
+def enemy_dtype(layout: EnemyLayout) -> np.dtype:
+    """
+    A structured dtype viewing the position fields of one enemy data block.
+    """
+    return np.dtype(
+        {
+            "names": ["prev_x", "prev_y", "x", "y"],
+            "formats": ["<f4", "<f4", "<f4", "<f4"],
+            "offsets": [
+                layout.prev_pos,
+                layout.prev_pos + 4,
+                layout.pos,
+                layout.pos + 4,
+            ],
+            "itemsize": max(layout.prev_pos, layout.pos) + 8,
+        }
+    )
+
+
+class EntityReader:
+    """
+    Reads enemies and bullets from a memory backend (see `environment.memory`)
+    into a fixed-capacity, padded float32 array of shape
+    `(max_enemies + max_bullets, 5)`.
+
+    Enemies come first. When there are more entities than the capacity, the
+    ones closest to `origin` (usually the player position) are kept.
+    """
+
+    def __init__(
+        self,
+        memory,
+        max_enemies: int = 8,
+        max_bullets: int = 64,
+        enemy_layout: EnemyLayout = EnemyLayout(),
+        bullet_layout: BulletLayout = BulletLayout(),
+    ):
+        if max_enemies < 0 or max_bullets < 0:
+            raise ValueError("Entity capacities should be non-negative")
+        self.memory = memory
+        self.max_enemies = max_enemies
+        self.max_bullets = max_bullets
+        self.enemy_layout = enemy_layout
+        self.bullet_layout = bullet_layout
+        self._bullet_dtype = bullet_dtype(bullet_layout)
+        self._enemy_dtype = enemy_dtype(enemy_layout)
+        self._node_dtype = node_dtype(enemy_layout)
+        # reused across reads so that a bulk read doesn't allocate
+        self._bullet_pool = np.zeros(
+            bullet_layout.capacity * bullet_layout.stride, dtype=np.uint8
+        )
+        self._enemy_blocks = np.zeros(
+            enemy_layout.max_nodes * self._enemy_dtype.itemsize, dtype=np.uint8
+        )
+        self._node = np.zeros(self._node_dtype.itemsize, dtype=np.uint8)
+
+    @property
+    def capacity(self) -> int:
+        return self.max_enemies + self.max_bullets
+
+    def read(self, origin=None) -> np.ndarray:
+        out = np.zeros((self.capacity, len(ENTITY_FIELDS)), dtype=np.float32)
+        if self.max_enemies > 0:
+            _fill_nearest(out[: self.max_enemies], self.read_enemies(), origin)
+        if self.max_bullets > 0:
+            _fill_nearest(out[self.max_enemies :], self.read_bullets(), origin)
+        return out
+
+    def read_bullets(self) -> np.ndarray:
+        """
+        Return all active bullets as an (n, 5) float32 array.
+        """
+        layout = self.bullet_layout
+        manager = self.memory.read_ptr(self.memory.base_address + layout.manager_ptr)
+        if manager == 0:
+            return np.zeros((0, len(ENTITY_FIELDS)), dtype=np.float32)
+        self.memory.read_into(
+            manager + layout.array, self._bullet_pool, self._bullet_pool.nbytes
+        )
+        pool = self._bullet_pool.view(self._bullet_dtype)
+        active = pool[pool["state"] != 0]
+        bullets = np.empty((len(active), len(ENTITY_FIELDS)), dtype=np.float32)
+        bullets[:, 0] = active["x"]
+        bullets[:, 1] = active["y"]
+        bullets[:, 2] = active["vx"]
+        bullets[:, 3] = active["vy"]
+        bullets[:, 4] = active["sprite"] + BULLET_TYPE_BASE
+        return bullets
+
+    def read_enemies(self) -> np.ndarray:
+        """
+        Return all enemies in the enemy list as an (n, 5) float32 array.
+
+        The velocity is the displacement of the enemy during the last frame.
+        """
+        layout = self.enemy_layout
+        manager = self.memory.read_ptr(self.memory.base_address + layout.manager_ptr)
+        if manager == 0:
+            return np.zeros((0, len(ENTITY_FIELDS)), dtype=np.float32)
+
+        block_size = self._enemy_dtype.itemsize
+        node = self.memory.read_ptr(manager + layout.list_head)
+        # the value and next pointers of the node, read together
+        fields = self._node.view(self._node_dtype)[0]
+        n = 0
+        # bounded by the nodes walked, so that a cycle of empty nodes ends too
+        for _ in range(layout.max_nodes):
+            if node == 0:
+                break
+            self.memory.read_into(node, self._node, self._node.nbytes)
+            enemy = int(fields["val"])
+            if enemy != 0:
+                self.memory.read_into(
+                    enemy + layout.data,
+                    self._enemy_blocks[n * block_size :],
+                    block_size,
+                )
+                n += 1
+            node = int(fields["next"])
+
+        blocks = self._enemy_blocks[: n * block_size].view(self._enemy_dtype)
+        enemies = np.empty((n, len(ENTITY_FIELDS)), dtype=np.float32)
+        enemies[:, 0] = blocks["x"]
+        enemies[:, 1] = blocks["y"]
+        enemies[:, 2] = blocks["x"] - blocks["prev_x"]
+        enemies[:, 3] = blocks["y"] - blocks["prev_y"]
+        enemies[:, 4] = ENEMY_TYPE
+        return enemies
+
+
+def _fill_nearest(out: np.ndarray, entities: np.ndarray, origin) -> None:
+    """
+    Copy `entities` into `out`, keeping the ones closest to `origin` when they
+    don't fit. Rows of `out` that are not filled are left as zero padding.
+    """
+    capacity = len(out)
+    if len(entities) > capacity:
+        if origin is None:
+            entities = entities[:capacity]
+        else:
+            dist = np.sum((entities[:, :2] - np.asarray(origin)) ** 2, axis=1)
+            nearest = np.argpartition(dist, capacity - 1)[:capacity]
+            entities = entities[nearest[np.argsort(dist[nearest])]]
+    out[: len(entities)] = entities
@@ -1,11 +1,24 @@
 import gymnasium as gym
 import numpy as np
 import environment.interface as I
+from environment.entities import EntityReader
+from environment.fingerprint import FreezeDetector
+from environment.reward import compute_reward
+from environment.tracing import traced
+from environment.spaces import (
+    FRAME_HEIGHT,
+    FRAME_WIDTH,
+    check_repeat_choices,
+    decode_action,
+    make_action_space,
+    make_observation_space,
+)
 from collections import deque
 from typing import Any
 import cv2
 import logging
 import sys
+import time
 
 
 class Touhou14Env(gym.Env):
@@ -14,58 +27,137 @@ class Touhou14Env(gym.Env):
 
     Notice that frame stack is already included in this env, so don't wrap it
     with FrameStack again.
+
+    Each step repeats the action for `action_repeat` frames (defaults to
+    `n_frame_stack`). The stacked frames are `capture_stride` frames apart and
+    aligned to the end of the step, and only the frames that end up in the
+    stack are captured. The action repeat, and each of the repeat choices,
+    should be a multiple of the capture stride, so that the frames stay
+    evenly spaced across steps, including steps shorter than the stack. With
+    `max_pool_frames`, each stacked frame is the pixel-wise maximum of the
+    captured frame and the one before it, which removes the flickering of
+    bullets.
+
+    With `repeat_choices`, e.g., `(4, 8, 16)`, the agent also picks the number
+    of frames of each step: action `a` is the move and slow mode `a % 10`,
+    repeated for `repeat_choices[a // 10]` frames. The stacked frames are
+    still captured at the end of the step, and the step info reports the
+    frames of the step as `action_repeat`. The reward terms given at every
+    step are scaled by the length of the step relative to `action_repeat`
+    (see `reward.py`), so that holding an action longer isn't rewarded
+    differently per frame.
+
+    Every capture is fingerprinted to count the captures repeating the
+    previous one, i.e., lagging behind the game. After `freeze_captures`
+    repeated captures in a row, the game window is considered frozen, which is
+    reported as `frozen` in the step info and truncates the episode with
+    `truncate_on_freeze`.
+
+    The frames are converted to grayscale and resized once, when captured.
+    With `channels_first`, the stacked frames are `(n_frame_stack, H, W)`
+    instead of `(H, W, n_frame_stack)`, which SB3 uses as is instead of
+    transposing every observation.
     """
 
     def __init__(
         self,
         n_frame_stack: int = 4,
+        action_repeat: int | None = None,
+        repeat_choices: tuple[int, ...] | None = None,
+        capture_stride: int = 1,
+        max_pool_frames: bool = False,
         frame_downsize_ratio: float = 1.0,
+        channels_first: bool = False,
         max_lost_lives: int = 0,
+        max_enemies: int = 0,
+        max_bullets: int = 0,
+        use_savestate: bool = False,
+        freeze_captures: int = 30,
+        truncate_on_freeze: bool = False,
         debug: bool = False,
     ):
         if n_frame_stack < 1:
             raise ValueError("Number of stacked frames should be positive")
+        if action_repeat is None:
+            action_repeat = n_frame_stack
+        if action_repeat < 1:
+            raise ValueError("Action repeat should be positive")
+        if capture_stride < 1:
+            raise ValueError("Capture stride should be positive")
         if frame_downsize_ratio <= 0.0 or frame_downsize_ratio > 1.0:
             raise ValueError("Invalid frame downsize ratio, should be 0-1")
         if max_lost_lives < 0:
             raise ValueError(
                 "Maximum number of lost lives allowed should be non-negative"
             )
+        if max_enemies < 0 or max_bullets < 0:
+            raise ValueError("Maximum numbers of entities should be non-negative")
         if debug:
             self.logger = logging.getLogger("Touhou14Env")
             self.logger.setLevel(logging.DEBUG)
             self.logger.addHandler(logging.StreamHandler(sys.stdout))
         else:
             self.logger = None
+        repeat_choices = check_repeat_choices(repeat_choices)
+        # steps of whole strides, so that the capture phase carries over
+        for n_frames in (action_repeat, *(repeat_choices or ())):
+            if n_frames % capture_stride != 0:
+                raise ValueError(
+                    f"Action repeat {n_frames} should be a multiple of the "
+                    f"capture stride {capture_stride}"
+                )
         self.n_frame_stack = n_frame_stack
+        self.action_repeat = action_repeat
+        self.repeat_choices = repeat_choices
+        self.capture_stride = capture_stride
+        self.max_pool_frames = max_pool_frames
         self.frame_downsize_ratio = frame_downsize_ratio
+        # (width, height) as expected by cv2
+        self.frame_size = (
+            int(FRAME_WIDTH * frame_downsize_ratio),
+            int(FRAME_HEIGHT * frame_downsize_ratio),
+        )
+        self.channels_first = channels_first
+        # preprocessed frames
         self.frame_buffer = deque(maxlen=self.n_frame_stack)
-        self.observation_space = gym.spaces.Dict(
-            {
-                "frames": gym.spaces.Box(
-                    low=0,
-                    high=255,
-                    shape=(
-                        int(I.FRAME_HEIGHT * self.frame_downsize_ratio),
-                        int(I.FRAME_WIDTH * self.frame_downsize_ratio),
-                        self.n_frame_stack,
-                    ),
-                    dtype=np.uint8,
-                ),
-                "player_position": gym.spaces.Box(
-                    low=np.array((-184.0, 32.0), dtype=np.float32),
-                    high=np.array((184.0, 432.0), dtype=np.float32),
-                    shape=(2,),
-                ),
-                "boss_position": gym.spaces.Box(
-                    low=np.array((-184.0, 32.0), dtype=np.float32),
-                    high=np.array((184.0, 432.0), dtype=np.float32),
-                    shape=(2,),
-                ),
-            }
+        # the last raw capture, pooled with the first capture of the next step
+        self.last_raw_frame = None
+        # frames the game ran past the targets of `I.act` before being
+        # suspended, i.e., frames not seen by the agent
+        self.step_overshoot = 0
+        self.lockstep_stats = dict.fromkeys(
+            (
+                "steps",
+                "overshot_steps",
+                "advances",
+                "overshot_advances",
+                "frames",
+                "lost_frames",
+                "max_overshoot",
+                "captures",
+                "repeated_captures",
+                "max_repeat_streak",
+            ),
+            0,
         )
-        self.action_space = gym.spaces.Discrete(10)
+        self.freeze_detector = FreezeDetector(freeze_captures=freeze_captures)
+        self.truncate_on_freeze = truncate_on_freeze
+        if max_enemies + max_bullets > 0:
+            self.entity_reader = EntityReader(I.game_memory, max_enemies, max_bullets)
+        else:
+            self.entity_reader = None
+        self.observation_space = make_observation_space(
+            n_frame_stack,
+            frame_downsize_ratio,
+            max_enemies + max_bullets,
+            channels_first,
+        )
+        self.action_space = make_action_space(self.repeat_choices)
         self.max_lost_lives = max_lost_lives
+        # reset by restoring a savestate captured at the start of the spell
+        # card, falling back to the menus when it's not available
+        self.use_savestate = use_savestate
+        self.reset_latency = None
 
         # Initialize the game interface
         I.init()
@@ -77,59 +169,150 @@ class Touhou14Env(gym.Env):
         self.prev_pos = None
         self.prev_boss_pos = None
 
+    @traced("env")
     def step(self, action: int | np.integer[Any]):
-        self.episode_time += 1
-        move, slow = int(action % 5), int(action // 5)
-
-        for _ in range(self.n_frame_stack):
-            I.resume_game_process()
-            I.act(move, slow)
-            I.suspend_game_process()
-
-            if I.read_game_val("game_state") != 2:  # end of run
-                break
-
-            if I.read_game_val("in_dialog") == -1:  # in dialog
-                I.resume_game_process()
-                I.skip_dialog()
-                I.suspend_game_process()
+        move, slow, n_frames = decode_action(
+            action, self.action_repeat, self.repeat_choices
+        )
+        # in default steps
+        step_scale = n_frames / self.action_repeat
+        self.episode_time += step_scale
 
-            frame = I.capture_frame()
-            self.frame_buffer.append(np.array(frame))
+        self.step_overshoot = 0
+        self._advance_and_capture(move, slow, n_frames)
+        self.lockstep_stats["steps"] += 1
+        if self.step_overshoot > 0:
+            self.lockstep_stats["overshot_steps"] += 1
 
         next_state = self._get_state()
         curr_info = self._get_game_info()
 
         terminated = curr_info["game_state"] != 2
         truncated = curr_info["lives"] < self.initial_lives - self.max_lost_lives
+        frozen = self.freeze_detector.frozen
+        if frozen:
+            if self.logger:
+                self.logger.debug({"frozen": self.freeze_detector.repeat_streak})
+            truncated = truncated or self.truncate_on_freeze
         prev_info = self.info
         self.info = curr_info
 
-        diff_life = (curr_info["lives"] - prev_info["lives"]) * 3 + (
-            curr_info["life_fragments"] - prev_info["life_fragments"]
+        reward = compute_reward(
+            prev_info,
+            curr_info,
+            next_state["player_position"],
+            self.prev_pos,
+            move,
+            self.episode_time,
+            step_scale,
         )
-        diff_boss_hp = min(0, curr_info["boss_hp"] - prev_info["boss_hp"])
-        if diff_boss_hp < -100:
-            diff_boss_hp = 0
-        reward = diff_life * 500 - diff_boss_hp + 1
-        # clear bonus
-        if curr_info["boss_hp"] == 9999 and prev_info["boss_hp"] == 0:
-            reward += 1500 * max(0, 500 - self.episode_time) / 500
-
-        # penalize useless movement
-        if np.all(next_state["player_position"] == self.prev_pos) and move != 0:
-            reward -= 10
         self.prev_pos = next_state["player_position"]
         self.prev_boss_pos = next_state["boss_position"]
 
-        # penalize risky y positions
-        reward -= (432.0 - next_state["player_position"][1]) / 10
-
         if self.logger:
             self.logger.debug({"action": action.tolist(), "reward": reward})
 
+        curr_info["action_repeat"] = n_frames
+        curr_info["overshoot"] = self.step_overshoot
+        curr_info["frozen"] = frozen
         return next_state, reward, terminated, truncated, curr_info
 
+    def _capture_ticks(self, n_frames: int) -> list[int]:
+        """
+        Frames (1-based, within the next `n_frames` frames) at which a frame
+        for the stack should be captured.
+        """
+        ticks = range(n_frames, 0, -self.capture_stride)
+        return sorted(ticks[: self.n_frame_stack])
+
+    def _advance_and_capture(self, move: int, slow: int, n_frames: int) -> None:
+        """
+        Keep the action for `n_frames` frames, capturing the stacked frames.
+        """
+        elapsed = 0
+        for tick in self._capture_ticks(n_frames):
+            pooled = None
+            if self.max_pool_frames:
+                if tick - 1 > elapsed:
+                    if not self._advance(move, slow, tick - 1 - elapsed):
+                        return
+                    elapsed = tick - 1
+                    pooled = self._capture()
+                elif tick - 1 == elapsed:
+                    pooled = self.last_raw_frame
+            if not self._advance(move, slow, tick - elapsed):
+                return
+            elapsed = tick
+            frame = self._capture()
+            self.last_raw_frame = frame
+            if pooled is not None:
+                frame = np.maximum(frame, pooled)
+            self.frame_buffer.append(self._preprocess(frame))
+        if elapsed < n_frames:
+            self._advance(move, slow, n_frames - elapsed)
+
+    def _preprocess(self, frame: np.ndarray) -> np.ndarray:
+        """
+        Convert a captured RGB frame to grayscale and resize it.
+        """
+        gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
+        if self.frame_downsize_ratio == 1.0:
+            return gray
+        return cv2.resize(gray, self.frame_size, interpolation=cv2.INTER_AREA)
+
+    def _capture(self) -> np.ndarray:
+        """
+        Capture a frame, counting it when it repeats the previous one.
+        """
+        frame = np.array(I.capture_frame())
+        self.lockstep_stats["captures"] += 1
+        if self.freeze_detector.update(frame):
+            self.lockstep_stats["repeated_captures"] += 1
+            self.lockstep_stats["max_repeat_streak"] = max(
+                self.lockstep_stats["max_repeat_streak"],
+                self.freeze_detector.repeat_streak,
+            )
+        return frame
+
+    def _advance(self, move: int, slow: int, k: int) -> bool:
+        """
+        Keep the action for k frames. Return False when the run has ended.
+        """
+        overshoot = I.act(move, slow, k)
+        self.step_overshoot += overshoot
+        self.lockstep_stats["advances"] += 1
+        self.lockstep_stats["frames"] += k
+        if overshoot > 0:
+            self.lockstep_stats["overshot_advances"] += 1
+            self.lockstep_stats["lost_frames"] += overshoot
+            self.lockstep_stats["max_overshoot"] = max(
+                self.lockstep_stats["max_overshoot"], overshoot
+            )
+
+        if I.read_game_val("game_state") != 2:  # end of run
+            return False
+
+        if I.read_game_val("in_dialog") == -1:  # in dialog
+            I.resume_game_process()
+            I.skip_dialog()
+            I.suspend_game_process()
+        return True
+
+    def get_lockstep_stats(self) -> dict[str, float]:
+        """
+        Aggregate statistics of frames lost to overshooting, and of repeated
+        captures, since the env was created.
+        """
+        stats = self.lockstep_stats
+        return {
+            **stats,
+            "overshot_step_rate": stats["overshot_steps"] / max(1, stats["steps"]),
+            "lost_frame_rate": stats["lost_frames"]
+            / max(1, stats["frames"] + stats["lost_frames"]),
+            "repeated_capture_rate": stats["repeated_captures"]
+            / max(1, stats["captures"]),
+        }
+
     def _is_inactive(self, action: np.ndarray):
         """
         Detect inactivity based on repeated actions or unchanged observations.
@@ -158,42 +341,44 @@ class Touhou14Env(gym.Env):
 
     def _is_inactive_observation(self):
         """
-        Detect inactivity based on lack of changes in recent observations.
+        Detect inactivity based on the game window being frozen.
         """
-        if len(self.frame_buffer) < self.n_frame_stack:
-            return False  # Not enough frames to compare
-
-        # Compare the most recent frames in the buffer
-        recent_frames = list(self.frame_buffer)
-        frame_differences = [
-            np.sum(np.abs(recent_frames[i] - recent_frames[i + 1]))
-            for i in range(len(recent_frames) - 1)
-        ]
-
-        # If differences are below a small threshold for all comparisons, consider inactive
-        inactivity_threshold = 1e-3  # Adjust as needed
-        return all(diff < inactivity_threshold for diff in frame_differences)
+        return self.freeze_detector.frozen
 
+    @traced("env")
     def reset(self, seed: int | None = None, options: dict | None = None):
         super().reset(seed=seed)
 
         # Reset the game state
-        I.resume_game_process()
-        I.release_all_keys()
-        if I.read_game_val("game_state") == 1:  # end of run
-            I.reset_from_end_of_run()
+        t0 = time.perf_counter()
+        if self.use_savestate and I.restore_savestate():
+            I.suspend_game_process()
         else:
-            I.force_reset()
-        I.suspend_game_process()
+            I.resume_game_process()
+            I.release_all_keys()
+            if I.read_game_val("game_state") == 1:  # end of run
+                I.reset_from_end_of_run()
+            else:
+                I.force_reset()
+            I.suspend_game_process()
+            if self.use_savestate:
+                I.capture_savestate()
+        self.reset_latency = time.perf_counter() - t0
+        if self.logger:
+            self.logger.debug({"reset_latency": self.reset_latency})
 
         # Initialize the frame buffer
-        frame = I.capture_frame()
+        self.freeze_detector.reset()
+        frame = self._capture()
+        self.last_raw_frame = frame
         self.frame_buffer.clear()
+        frame = self._preprocess(frame)
         for _ in range(self.n_frame_stack):
-            self.frame_buffer.append(np.array(frame))
+            self.frame_buffer.append(frame)
         state = self._get_state()
         info = self._get_game_info()
         self.info = info
+        info["reset_latency"] = self.reset_latency
         self.initial_lives = info["lives"]
         self.episode_time = 0
         self.prev_pos = None
@@ -204,26 +389,7 @@ class Touhou14Env(gym.Env):
         I.clean_up()
 
     def _get_state(self) -> dict:
-        frames_gray_stacked = np.clip(
-            np.stack(
-                np.dot(np.stack(self.frame_buffer, axis=0), [0.2989, 0.5870, 0.1140]),
-                axis=-1,
-            ),
-            0,
-            255,
-        ).astype(np.uint8)
-        if self.frame_downsize_ratio == 1.0:
-            resized_frames = frames_gray_stacked
-        else:
-            # note the new size param passed to cv2 is (width, hight)
-            resized_frames = cv2.resize(
-                frames_gray_stacked,
-                (
-                    int(I.FRAME_WIDTH * self.frame_downsize_ratio),
-                    int(I.FRAME_HEIGHT * self.frame_downsize_ratio),
-                ),
-                interpolation=cv2.INTER_AREA,
-            )
+        frames = np.stack(self.frame_buffer, axis=0 if self.channels_first else -1)
 
         pos_x = I.read_game_val("f_player_pos_x")
         pos_y = I.read_game_val("f_player_pos_y")
@@ -234,11 +400,21 @@ class Touhou14Env(gym.Env):
         else:
             boss_position = self.prev_boss_pos
 
-        return {
-            "frames": resized_frames,
+        state = {
+            "frames": frames,
             "player_position": np.array((pos_x, pos_y), dtype=np.float32),
             "boss_position": boss_position,
         }
+        if self.entity_reader is not None:
+            state["entities"] = self._get_entities(state["player_position"])
+        return state
+
+    def _get_entities(self, player_position: np.ndarray) -> np.ndarray:
+        try:
+            return self.entity_reader.read(origin=player_position)
+        except RuntimeError:
+            # entity pools are (re)allocated between runs
+            return np.zeros(self.observation_space["entities"].shape, dtype=np.float32)
 
     def _get_game_info(self) -> dict[str, int]:
         info = {}
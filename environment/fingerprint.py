@@ -0,0 +1,73 @@
+"""
+Cheap frame fingerprints for detecting repeated captures.
+
+A fingerprint is a small grid of block means of the captured frame, so that
+comparing two captures costs the same whatever the frame size. Since the game
+is advanced by at least one frame between two captures, and the background
+keeps scrolling, a capture identical to the previous one means that the
+screenshot lagged behind the game (e.g., the window is not being redrawn),
+and a long run of them means that the window is hung or hidden.
+"""
+
+import cv2
+import numpy as np
+
+
+def fingerprint(frame: np.ndarray, grid: int = 16) -> np.ndarray:
+    """
+    `grid` x `grid` block means of an (H, W, 3) RGB frame, averaged over the
+    color channels.
+    """
+    blocks = cv2.resize(frame, (grid, grid), interpolation=cv2.INTER_AREA)
+    return blocks.mean(axis=-1, dtype=np.float32)
+
+
+class FreezeDetector:
+    """
+    Track captures whose fingerprint matches the previous one.
+
+    :param grid: Size of the fingerprint grid
+    :param tolerance: Largest difference of block means (0-255) for two
+        captures to be considered the same
+    :param freeze_captures: Number of consecutive repeated captures after which
+        the game is considered frozen
+    """
+
+    def __init__(
+        self, grid: int = 16, tolerance: float = 0.5, freeze_captures: int = 30
+    ):
+        if grid < 1:
+            raise ValueError("Fingerprint grid size should be positive")
+        if tolerance < 0:
+            raise ValueError("Tolerance should be non-negative")
+        if freeze_captures < 1:
+            raise ValueError("Number of captures for freezing should be positive")
+        self.grid = grid
+        self.tolerance = tolerance
+        self.freeze_captures = freeze_captures
+        self.last_fingerprint = None
+        # number of consecutive repeated captures, up to the last one
+        self.repeat_streak = 0
+
+    @property
+    def frozen(self) -> bool:
+        return self.repeat_streak >= self.freeze_captures
+
+    def reset(self) -> None:
+        """
+        Forget the previous capture, e.g., after the game has been reset.
+        """
+        self.last_fingerprint = None
+        self.repeat_streak = 0
+
+    def update(self, frame: np.ndarray) -> bool:
+        """
+        Fingerprint a new capture. Return whether it repeats the previous one.
+        """
+        fp = fingerprint(frame, self.grid)
+        repeated = self.last_fingerprint is not None and bool(
+            np.abs(fp - self.last_fingerprint).max() <= self.tolerance
+        )
+        self.repeat_streak = self.repeat_streak + 1 if repeated else 0
+        self.last_fingerprint = fp
+        return repeated
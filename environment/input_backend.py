@@ -0,0 +1,189 @@
+"""
+Keyboard input backends for the game interface.
+
+A backend holds the desired state of the game keys. Setting a key only
+updates the desired state, and `flush` sends the difference from the state
+the game last received as a single batch, so that an action costs at most one
+input injection per frame however many keys change, and none when they don't.
+
+`SendInputBackend` injects the batch with one `SendInput` call using hardware
+scancodes, which the game reads through DirectInput. `RecordingBackend` keeps
+the batches instead, for checking and benchmarking the input logic without
+Windows.
+"""
+
+import ctypes
+import time
+from abc import ABC, abstractmethod
+from ctypes import wintypes
+
+
+# set 1 scancodes of the keys used by the interface, and whether they are
+# extended keys (sent with an 0xE0 prefix)
+SCANCODES = {
+    "esc": (0x01, False),
+    "q": (0x10, False),
+    "r": (0x13, False),
+    "ctrl": (0x1D, False),
+    "shift": (0x2A, False),
+    "z": (0x2C, False),
+    "x": (0x2D, False),
+    "up": (0x48, True),
+    "left": (0x4B, True),
+    "right": (0x4D, True),
+    "down": (0x50, True),
+}
+
+_INPUT_KEYBOARD = 1
+_KEYEVENTF_EXTENDEDKEY = 0x0001
+_KEYEVENTF_KEYUP = 0x0002
+_KEYEVENTF_SCANCODE = 0x0008
+
+
+class InputBackend(ABC):
+    """
+    Desired and sent key states, with the sending left to the subclasses.
+    """
+
+    def __init__(self):
+        self._desired = {}
+        self._sent = {}
+        # counters for benchmarks and diagnostics
+        self.n_flushes = 0
+        self.n_batches = 0
+        self.n_events = 0
+
+    def set_key(self, key: str, pressed: bool) -> None:
+        if key not in SCANCODES:
+            raise ValueError(f"Invalid key: {key}")
+        self._desired[key] = pressed
+
+    def press(self, key: str) -> None:
+        self.set_key(key, True)
+
+    def release(self, key: str) -> None:
+        self.set_key(key, False)
+
+    def is_pressed(self, key: str) -> bool:
+        """
+        Whether the key is pressed as of the last flush.
+        """
+        return self._sent.get(key, False)
+
+    def flush(self, force: bool = False) -> int:
+        """
+        Send the keys whose desired state differs from the sent one, or all
+        the keys set so far with `force`, and return the number of events.
+        Releases are sent before presses, so that switching directions never
+        holds both keys.
+        """
+        self.n_flushes += 1
+        events = [
+            (key, pressed)
+            for key, pressed in self._desired.items()
+            if force or self._sent.get(key, False) != pressed
+        ]
+        if not events:
+            return 0
+        events.sort(key=lambda event: event[1])
+        self._send(events)
+        self._sent.update(events)
+        self.n_batches += 1
+        self.n_events += len(events)
+        return len(events)
+
+    def release_all(self) -> int:
+        """
+        Release every known key, whatever state it is believed to be in.
+        """
+        for key in SCANCODES:
+            self._desired[key] = False
+        return self.flush(force=True)
+
+    @abstractmethod
+    def _send(self, events: list[tuple[str, bool]]) -> None:
+        """
+        Send a batch of (key, pressed) events to the game.
+        """
+
+
+class _KeyboardInput(ctypes.Structure):
+    _fields_ = (
+        ("wVk", wintypes.WORD),
+        ("wScan", wintypes.WORD),
+        ("dwFlags", wintypes.DWORD),
+        ("time", wintypes.DWORD),
+        ("dwExtraInfo", ctypes.c_size_t),
+    )
+
+
+class _MouseInput(ctypes.Structure):
+    # only part of the union so that `_Input` has the size SendInput expects
+    _fields_ = (
+        ("dx", wintypes.LONG),
+        ("dy", wintypes.LONG),
+        ("mouseData", wintypes.DWORD),
+        ("dwFlags", wintypes.DWORD),
+        ("time", wintypes.DWORD),
+        ("dwExtraInfo", ctypes.c_size_t),
+    )
+
+
+class _InputUnion(ctypes.Union):
+    _fields_ = (("mi", _MouseInput), ("ki", _KeyboardInput))
+
+
+class _Input(ctypes.Structure):
+    _fields_ = (("type", wintypes.DWORD), ("u", _InputUnion))
+
+
+class SendInputBackend(InputBackend):
+    """
+    Sends each batch with a single `SendInput` call of scancode events.
+    """
+
+    def __init__(self):
+        super().__init__()
+        user32 = ctypes.WinDLL("user32", use_last_error=True)
+        self._send_input = user32.SendInput
+        self._send_input.argtypes = (
+            wintypes.UINT,
+            ctypes.POINTER(_Input),
+            ctypes.c_int,
+        )
+        self._send_input.restype = wintypes.UINT
+        # reused for batches of up to all the keys
+        self._inputs = (_Input * len(SCANCODES))()
+        for i in self._inputs:
+            i.type = _INPUT_KEYBOARD
+
+    def _send(self, events: list[tuple[str, bool]]) -> None:
+        for i, (key, pressed) in enumerate(events):
+            scancode, extended = SCANCODES[key]
+            flags = _KEYEVENTF_SCANCODE
+            if extended:
+                flags |= _KEYEVENTF_EXTENDEDKEY
+            if not pressed:
+                flags |= _KEYEVENTF_KEYUP
+            ki = self._inputs[i].u.ki
+            ki.wScan = scancode
+            ki.dwFlags = flags
+        n = self._send_input(len(events), self._inputs, ctypes.sizeof(_Input))
+        if n != len(events):
+            raise RuntimeError(
+                f"SendInput sent {n} of {len(events)} events, "
+                f"error code: {ctypes.get_last_error()}"
+            )
+
+
+class RecordingBackend(InputBackend):
+    """
+    Keeps the sent batches as (perf_counter timestamp, events) in `batches`.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.batches = []
+
+    def _send(self, events: list[tuple[str, bool]]) -> None:
+        self.batches.append((time.perf_counter(), list(events)))
@@ -13,10 +13,15 @@ import logging
 import time
 import os
 import pygetwindow as gw
-import keyboard
 import pyscreeze
-from collections import deque
-import struct
+import numpy as np
+from environment.memory import Field, ProcessMemory, compile_fields
+from environment.entities import BulletLayout
+from environment import macros
+from environment.input_backend import SendInputBackend
+from environment.savestate import Region, Savestate
+from environment.spaces import FRAME_HEIGHT, FRAME_WIDTH
+from environment.tracing import traced
 
 
 logging.basicConfig(
@@ -29,38 +34,73 @@ logger = logging.getLogger("interface")
 _MODULE_NAME = "th14.exe"
 _GAME_TITLE = "Double Dealing Character. ver 1.00b"
 
-_OFFSETS = dict(
-    score=0xF5830,
-    lives=0xF5864,
-    life_fragments=0xF5868,  # 3 life fragments = 1 life
-    bombs=0xF5870,
-    bomb_fragments=0xF5874,  # 8 bomb fragments = 1 bomb
-    bonus_count=0xF5894,
-    power=0xF5858,
-    piv=0xF584C,
-    graze=0xF5840,
-    game_state=0xF7AC8,  # 0 = pausing, 1 = end of run, 2 = playing
-    in_dialog=0xF7BA8,  # -1 = in dialog, otherwise = not
-    global_timer=(0xDB520, 0x191E0),
-    f_player_pos_x=(0xDB67C, 0x5E0),
-    f_player_pos_y=(0xDB67C, 0x5E4),
+_FIELDS = {
+    "score": Field((0xF5830,), "int32"),
+    "lives": Field((0xF5864,), "int32"),
+    "life_fragments": Field((0xF5868,), "int32"),  # 3 life fragments = 1 life
+    "bombs": Field((0xF5870,), "int32"),
+    "bomb_fragments": Field((0xF5874,), "int32"),  # 8 bomb fragments = 1 bomb
+    "bonus_count": Field((0xF5894,), "int32"),
+    "power": Field((0xF5858,), "int32"),
+    "piv": Field((0xF584C,), "int32"),
+    "graze": Field((0xF5840,), "int32"),
+    # 0 = pausing, 1 = end of run, 2 = playing
+    "game_state": Field((0xF7AC8,), "int32"),
+    "in_dialog": Field((0xF7BA8,), "int32"),  # -1 = in dialog, otherwise = not
+    "global_timer": Field((0xDB520, 0x191E0), "int32"),
+    "f_player_pos_x": Field((0xDB67C, 0x5E0), "float32"),
+    "f_player_pos_y": Field((0xDB67C, 0x5E4), "float32"),
     # enemies seems to be stored in a linked list
     # .next = 0x4, .val = 0x0
     # should set this based on specific game level
     # only applicable for Spell Card mode (boss fight only)
     # below is for stage 1, spell card 2, No. 4
-    boss_hp=(((((0xDB544, 0xD0), 0x4), 0x4), 0x0), 0x11F0 + 0x3F74),
-    f_boss_pos_x=(((((0xDB544, 0xD0), 0x4), 0x4), 0x0), 0x11F0 + 0x44),
-    f_boss_pos_y=(((((0xDB544, 0xD0), 0x4), 0x4), 0x0), 0x11F0 + 0x48),
-)
+    "boss_hp": Field((0xDB544, 0xD0, 0x4, 0x4, 0x0, 0x11F0 + 0x3F74), "int32"),
+    "f_boss_pos_x": Field((0xDB544, 0xD0, 0x4, 0x4, 0x0, 0x11F0 + 0x44), "float32"),
+    "f_boss_pos_y": Field((0xDB544, 0xD0, 0x4, 0x4, 0x0, 0x11F0 + 0x48), "float32"),
+}
+
+_BULLET_LAYOUT = BulletLayout()
+
+
+def _bullet_fields(offset: int, size: int) -> Region:
+    """
+    A field of every element of the bullet pool, as a savestate region.
+    """
+    layout = _BULLET_LAYOUT
+    return Region(
+        (layout.manager_ptr, layout.array + offset),
+        size,
+        layout.stride,
+        layout.capacity,
+    )
+
+
+# memory regions making up a savestate, see `savestate.py`
+# only the scalar fields of the scene are saved, never the pointers to heap
+# objects such as the manager and list fields, which the game rebuilds
+# the random number generator and the attack script of the boss are not
+# saved, their offsets being unknown
+_SAVESTATE_REGIONS = [
+    # run stats, from score to bonus_count
+    Region((0xF5830,), 0xF5898 - 0xF5830),
+    Region((0xF7AC8,), 0x4),  # game_state
+    Region((0xF7BA8,), 0x4),  # in_dialog
+    Region((0xDB520, 0x191E0), 0x20),  # timers
+    Region((0xDB67C, 0x5E0), 0x8),  # player position
+    Region((0xDB544, 0xD0, 0x4, 0x4, 0x0, 0x11F0 + 0x44), 0x8),  # boss position
+    Region((0xDB544, 0xD0, 0x4, 0x4, 0x0, 0x11F0 + 0x3F74), 0x4),  # boss hp
+    # bullets, the slots inactive at capture being cleared on restore
+    _bullet_fields(_BULLET_LAYOUT.pos, _BULLET_LAYOUT.vel + 8 - _BULLET_LAYOUT.pos),
+    _bullet_fields(_BULLET_LAYOUT.sprite, 2),
+    _bullet_fields(_BULLET_LAYOUT.state, 2),
+]
 
 # the Windows borders are included in _WINDOW_WIDTH and _WINDOW_HEIGHT
 # tested on Win11 with 2560x1440 screen with 100% scale
 # TODO: programmatically get the "inner" window dimensions
 _WINDOW_WIDTH = 646
 _WINDOW_HEIGHT = 509
-FRAME_WIDTH = 384
-FRAME_HEIGHT = 448
 _FRAME_LEFT = 35
 _FRAME_TOP = 42
 
@@ -119,90 +159,37 @@ _process_handle = ctypes.windll.kernel32.OpenProcess(
     _PROCESS_VM_READ | _PROCESS_QUERY_INFORMATION, False, _game_pid
 )
 
+# memory backend for readers doing bulk reads, e.g., `environment.entities`
+game_memory = ProcessMemory(_process_handle, _base_address)
+# compiled once here so that reading a field doesn't allocate
+_game_fields = compile_fields(game_memory, _FIELDS)
+
+# a write-capable process handle is only opened when savestates are used
+_PROCESS_VM_OPERATION = 0x0008
+_PROCESS_VM_WRITE = 0x0020
+_writable_process_handle = None
+_savestate = None
+
+# desired key states, flushed to the game as one batch per frame
+input_backend = SendInputBackend()
+
 
+@traced("interface")
 def suspend_game_process():
     ctypes.windll.kernel32.DebugActiveProcess(_game_pid)
 
 
+@traced("interface")
 def resume_game_process():
     ctypes.windll.kernel32.DebugActiveProcessStop(_game_pid)
 
 
-def _read_game_memory(offset, size, rel=True):
-    buffer = ctypes.create_string_buffer(size)
-    bytesRead = ctypes.c_int()
-    ok = ctypes.windll.kernel32.ReadProcessMemory(
-        _process_handle,
-        ctypes.c_uint64((_base_address + offset) if rel else offset),
-        buffer,
-        size,
-        ctypes.byref(bytesRead),
-    )
-    if not ok:
-        raise RuntimeError(
-            f"Failed to read memory at offset {hex(offset)}. Process may have exitted."
-        )
-    return buffer.raw
-
-
-def _parse_ptr_addr(ptr: tuple):
-    """
-    Parse a pointer (with an attribute) to get its absolute address.
-
-    The pointer is assumed to be in the form of (base_addr, relative_offset),
-    where base_addr should be an integer or a tuple (nested).
-
-    When base_addr is an integer, it's treated as the relative base address.
-
-    When base_addr is a tuple, it will be recursively parsed.
-
-    Example
-    -------
-    foo.bar: (rel_base_addr_foo, rel_offset_bar)
-    foo.bar.bar1: ((rel_base_addr_foo, rel_offset_bar), rel_offset_bar1)
-    """
-    if len(ptr) != 2:
-        raise ValueError(
-            "Pointer must be given in the form of (base_addr, relative_offset)"
-        )
-    if isinstance(ptr[0], tuple):
-        base_addr = int.from_bytes(
-            _read_game_memory(_parse_ptr_addr(ptr[0]), 4, rel=False),
-            byteorder="little",
-            signed=False,
-        )
-    else:
-        if not isinstance(ptr[0], int):
-            raise ValueError("Base relative addr must be an integer")
-        base_addr = int.from_bytes(
-            _read_game_memory(ptr[0], 4, rel=True), byteorder="little", signed=False
-        )
-    if not isinstance(ptr[1], int):
-        raise ValueError("Offset must be an integer")
-    return base_addr + ptr[1]
-
-
 def read_game_val(key: str):
+    field = _game_fields.get(key)
+    if field is None:
+        raise ValueError(f"Invalid field key: {key}")
     try:
-        if key not in _OFFSETS:
-            raise ValueError(f"Invalid offset key: {key}")
-
-        offset = _OFFSETS[key]
-        if isinstance(offset, int):
-            data = _read_game_memory(offset, 4, rel=True)
-        elif isinstance(offset, tuple):
-            addr = _parse_ptr_addr(offset)
-            data = _read_game_memory(addr, 4, rel=False)
-        else:
-            raise ValueError("Invalid offset received, should be an integer or a tuple")
-
-        if key.startswith("f_"):  # float
-            return struct.unpack("f", data)[0]
-        return int.from_bytes(
-            data,
-            byteorder="little",
-            signed=True,
-        )
+        return field()
     except RuntimeError:
         return None
 
@@ -211,6 +198,7 @@ def _time():
     return read_game_val("global_timer")
 
 
+@traced("interface")
 def _sleep(k: int = 0):
     """
     Wait for k ticks for the in-game timer.
@@ -223,11 +211,73 @@ def _sleep(k: int = 0):
         pass
 
 
-def _press_and_release(key):
-    keyboard.press(key)
-    _sleep(1)
-    keyboard.release(key)
+def _read_macro_val(key: str):
+    """
+    `read_game_val`, plus the "screen" the macros wait to stay still.
+    """
+    if key == "screen":
+        return np.asarray(capture_frame())
+    return read_game_val(key)
+
+
+# menu macros, see `macros.py`
+macro_engine = macros.MacroEngine(_read_macro_val, _time, _sleep, input_backend)
+
+
+def _get_writable_memory() -> ProcessMemory:
+    global _writable_process_handle
+    if _writable_process_handle is None:
+        _writable_process_handle = ctypes.windll.kernel32.OpenProcess(
+            _PROCESS_VM_READ
+            | _PROCESS_VM_WRITE
+            | _PROCESS_VM_OPERATION
+            | _PROCESS_QUERY_INFORMATION,
+            False,
+            _game_pid,
+        )
+        if not _writable_process_handle:
+            _writable_process_handle = None
+            raise RuntimeError("Failed to open the game process for writing")
+    return ProcessMemory(_writable_process_handle, _base_address)
+
+
+@traced("interface")
+def capture_savestate() -> None:
+    """
+    Capture a savestate of the current game scene for `restore_savestate`.
+    The game process should be suspended.
+    """
+    global _savestate
+    _savestate = Savestate.capture(game_memory, _SAVESTATE_REGIONS)
+    logger.info(f"Captured savestate of {_savestate.nbytes} bytes")
+
+
+@traced("interface")
+def restore_savestate() -> bool:
+    """
+    Reset the game by restoring the captured savestate.
+
+    Return False if there's no valid savestate, in which case the game should
+    be reset through the menus instead.
+    """
+    global _savestate
+    if _savestate is None:
+        return False
+    suspend_game_process()
+    try:
+        if not _savestate.restore(_get_writable_memory()):
+            logger.info("Savestate is stale, discarding it")
+            _savestate = None
+            return False
+    except RuntimeError as e:
+        logger.error(f"Failed to restore savestate: {e}")
+        return False
+    release_all_keys()
+    # render the restored scene before returning
     _sleep(1)
+    input_backend.press("z")
+    input_backend.flush()
+    return read_game_val("game_state") == 2
 
 
 def _get_focus():
@@ -236,9 +286,11 @@ def _get_focus():
 
 
 def _resume_shooting():
-    keyboard.release("z")
+    input_backend.release("z")
+    input_backend.flush()
     _sleep(1)
-    keyboard.press("z")
+    input_backend.press("z")
+    input_backend.flush()
 
 
 def init():
@@ -247,42 +299,13 @@ def init():
     """
     _get_focus()
     release_all_keys()
-
-    # after some time of inactivity, the game will enter a demo play phase
-    # and we quit from that
-    _press_and_release("down")
-    _press_and_release("esc")
-    _sleep(180)
-
-    # now we are on the title screen
-    _press_and_release("down")
-    _press_and_release("esc")
-
-    # now the cursor is at the last line in the menu
-    _press_and_release("down")
-    _press_and_release("down")
-    _press_and_release("down")
-    _press_and_release("z")
-    _sleep(60)
-
-    # stage 1, spell card 2, reimu A
-    _press_and_release("z")
-    _sleep(60)
-    _press_and_release("down")
-    _sleep(60)
-    # _press_and_release("down")
-    # _sleep(60)
-    # _press_and_release("right")
-    # _sleep(60)
-    _press_and_release("z")
-    _sleep(60)
-    _press_and_release("z")
-    _sleep(150)
+    macro_engine.run("init", macros.INIT)
 
     # always fire
     _resume_shooting()
 
 
+@traced("interface")
 def capture_frame():
     """
     Capture and return the current game scene as a Pillow image.
@@ -297,47 +320,21 @@ def capture_frame():
     )
 
 
+@traced("interface")
 def skip_dialog():
     """
     Skip the dialog phases
     """
-    # a rough estimate of the duration of the dialog to prevent infinite loop
-    max_retry = 180
-    tries = 0
-    q = deque(maxlen=3)
-
-    def dialog_end():
-        return len(q) == 3 and sum([int(x != -1) for x in q]) == 3
-
     release_all_keys()
-    _sleep(5)
-    keyboard.press("ctrl")
-    while tries < max_retry:
-        t0 = _time()
-
-        if dialog_end():
-            break
-        tries += 1
-        q.append(read_game_val("in_dialog"))
-        _sleep(max(0, 5 - _time() + t0))
-    else:
-        raise Exception("Failed to skip dialog!")
-    keyboard.release("ctrl")
+    macro_engine.run("skip_dialog", macros.SKIP_DIALOG)
     _resume_shooting()
 
 
-_pressed_keys = {
-    "left": False,
-    "right": False,
-    "up": False,
-    "down": False,
-    "shift": False,
-}
-
-
-def act(move: int, slow: int, k: int = 1) -> None:
+@traced("interface")
+def act(move: int, slow: int, k: int = 1) -> int:
     """
-    Perform one action and advance k frames.
+    Perform one action and advance exactly k frames, then suspend the game
+    process.
 
     Args
     ----
@@ -352,100 +349,72 @@ def act(move: int, slow: int, k: int = 1) -> None:
         1 - slow mode.
     k : int
         Number of frames to advance. The provided action is kept for the k frames.
+
+    Returns
+    -------
+    int
+        Number of frames the game advanced past the target frame before it
+        could be suspended, which is 0 unless the game overran it.
     """
     if k < 1:
         raise ValueError(f"Invalid k {k}, should be positive")
+    # set the keys before resuming, so that they are held from the first frame
+    # only the keys that changed since the last action are sent, in one batch
     t0 = _time()
-    keyboard.press("z")
+    input_backend.press("z")
     _maintain_keyboard_move(move)
     _maintain_keyboard_slow(slow)
-    _sleep(max(0, k - _time() + t0))
+    input_backend.flush()
+    return _advance_to(t0 + k)
+
+
+@traced("interface")
+def _advance_to(target: int) -> int:
+    """
+    Resume the game and suspend it as soon as the in-game timer reaches
+    `target`. Return how many frames the timer overshot the target.
+    """
+    resume_game_process()
+    while _time() < target:
+        pass
+    suspend_game_process()
+    return _time() - target
 
 
 def _maintain_keyboard_move(move: int):
-    if move == 0:
-        for k in ("left", "right", "up", "down"):
-            if _pressed_keys[k]:
-                keyboard.release(k)
-                _pressed_keys[k] = False
-    elif 1 <= move <= 4:
-        for i, x in enumerate(("left", "right", "up", "down")):
-            if i == move - 1:
-                if not _pressed_keys[x]:
-                    keyboard.press(x)
-                    _pressed_keys[x] = True
-            else:
-                if _pressed_keys[x]:
-                    keyboard.release(x)
-                    _pressed_keys[x] = False
-    else:
+    if not 0 <= move <= 4:
         raise ValueError(f"Invalid move flag {move}, should be 0 - 4")
+    for i, k in enumerate(("left", "right", "up", "down")):
+        input_backend.set_key(k, i == move - 1)
 
 
 def _maintain_keyboard_slow(slow: int):
-    if slow == 0:
-        if _pressed_keys["shift"]:
-            keyboard.release("shift")
-            _pressed_keys["shift"] = False
-    elif slow == 1:
-        if not _pressed_keys["shift"]:
-            keyboard.press("shift")
-            _pressed_keys["shift"] = True
-    else:
+    if slow not in (0, 1):
         raise ValueError(f"Invalid slow flag {slow}, should be 0 or 1")
+    input_backend.set_key("shift", slow == 1)
 
 
 def release_all_keys() -> None:
-    for k in _pressed_keys:
-        if _pressed_keys[k]:
-            keyboard.release(k)
-            _pressed_keys[k] = False
-    keyboard.release("z")
-    keyboard.release("r")
-    keyboard.release("esc")
-    keyboard.release("ctrl")
+    input_backend.release_all()
 
 
+@traced("interface")
 def reset_from_end_of_run() -> None:
     """
     Reset when the game is cleared or all lives are lost.
     """
     release_all_keys()
-    _press_and_release("esc")
-    _sleep(30)
-    _press_and_release("up")
-    _sleep(30)
-    _press_and_release("z")
-    _sleep(30)
-    count = 0
-    max_retry = 60
-    while count < max_retry:
-        t0 = _time()
-        if read_game_val("game_state") == 2:
-            break
-        count += 1
-        _sleep(max(0, 5 - _time() + t0))
+    macro_engine.run("reset_from_end_of_run", macros.RESET_FROM_END_OF_RUN)
     _resume_shooting()
 
 
+@traced("interface")
 def force_reset() -> None:
     """
     Reset when the game is still running.
     """
     release_all_keys()
-    _press_and_release("esc")
-    _sleep(30)
-    _press_and_release("r")
-    _sleep(30)
-    count = 0
-    max_retry = 60
-    while count < max_retry:
-        t0 = _time()
-        if read_game_val("game_state") == 2:
-            break
-        count += 1
-        _sleep(max(0, 5 - _time() + t0))
-
+    macro_engine.run("force_reset", macros.FORCE_RESET)
     _resume_shooting()
 
 
@@ -454,22 +423,11 @@ def clean_up():
     resume_game_process()
     release_all_keys()
     _sleep(60)
-    game_state = read_game_val("game_state")
-    if game_state == 0:  # pausing
-        _press_and_release("q")
-    elif game_state == 1:
-        _press_and_release("esc")
-        _sleep(30)
-        _press_and_release("z")
-    else:
-        _press_and_release("esc")
-        _sleep(30)
-        _press_and_release("q")
-    _sleep(120)
-    for _ in range(3):
-        _press_and_release("esc")
-        _sleep(60)
+    macro_engine.run("clean_up", macros.quit_to_title(read_game_val("game_state")))
+    logger.info(f"Macro step timings: {macro_engine.get_stats()}")
     win32api.CloseHandle(_process_handle)
+    if _writable_process_handle is not None:
+        win32api.CloseHandle(_writable_process_handle)
     logger.info("Interface successfully exited")
 
 
@@ -479,7 +437,7 @@ if __name__ == "__main__":
         while True:
             t0 = _time()
             info = {}
-            for k in _OFFSETS:
+            for k in _FIELDS:
                 info[k] = read_game_val(k)
             logger.info(info)
             _sleep(max(0, 30 - _time() + t0))
@@ -0,0 +1,275 @@
+"""
+Menu macros of the interface, e.g., to start a spell card practice or to
+restart it.
+
+A macro is a sequence of `Step`s, each tapping some keys and then waiting
+until a condition on the game memory holds, e.g., the game being paused after
+pressing escape, checked every `poll` frames up to a timeout. The steps thus
+take as long as the game needs instead of a fixed worst case wait. The menus
+ignore input while they slide in, and no memory field is known for the title
+and practice menus, so a step can also wait for the screen to stay still
+(`still`), i.e., for the menu animations to end. The timeouts are the fixed
+waits the macros replace, so a screen that never stays still only costs as
+much as before.
+
+`MacroEngine` runs the macros against any game backend given as functions
+reading a field (the "screen" field being a capture of the screen), reading
+the in-game timer and waiting for some frames, plus an input backend (see
+`input_backend.py`), so that the macros can be run against `SimulatedMenus`
+(see `simulated.py`) as well as the game. It keeps timing statistics of each
+step.
+"""
+
+import logging
+import time
+from typing import Any, Callable, NamedTuple
+
+from environment import tracing
+from environment.fingerprint import FreezeDetector
+from environment.input_backend import InputBackend
+
+
+logger = logging.getLogger("macros")
+
+# called with a function reading a game field by name
+Condition = Callable[[Callable[[str], Any]], bool]
+
+
+class Step(NamedTuple):
+    """
+    One step of a macro: tap `keys` one after the other, then wait until
+    `until` holds for `settle` consecutive checks `poll` frames apart, for at
+    most `timeout` frames, holding the `hold` keys meanwhile. With `still`,
+    the screen should also be the same as at the previous check. Without a
+    condition, the step waits for `timeout` frames.
+    """
+
+    name: str
+    keys: tuple[str, ...] = ()
+    until: Condition | None = None
+    timeout: int = 0
+    poll: int = 1
+    settle: int = 1
+    hold: tuple[str, ...] = ()
+    # raise instead of going on when the condition doesn't hold in time
+    required: bool = False
+    still: bool = False
+
+
+def field_is(key: str, *values) -> Condition:
+    def condition(read) -> bool:
+        return read(key) in values
+
+    condition.__name__ = f"{key} in {values}"
+    return condition
+
+
+def field_is_not(key: str, *values) -> Condition:
+    def condition(read) -> bool:
+        value = read(key)
+        return value is not None and value not in values
+
+    condition.__name__ = f"{key} not in {values}"
+    return condition
+
+
+def playing(read) -> bool:
+    """
+    The run has started: the game is playing and the boss is loaded.
+    """
+    if read("game_state") != 2:
+        return False
+    boss_hp = read("boss_hp")
+    return boss_hp is not None and boss_hp > 0
+
+
+# from the demo play the game enters after some time of inactivity, or the
+# title screen, to stage 1, spell card 2, reimu A
+# the menu steps wait for the screen to stay still for 3 checks 2 frames apart
+INIT = (
+    Step("quit demo", ("down", "esc"), timeout=180, poll=2, settle=3, still=True),
+    Step("title", ("down", "esc")),
+    # the cursor is now at the last line of the title menu
+    Step(
+        "spell practice",
+        ("down", "down", "down", "z"),
+        timeout=60,
+        poll=2,
+        settle=3,
+        still=True,
+    ),
+    Step("stage", ("z",), timeout=60, poll=2, settle=3, still=True),
+    Step("spell card", ("down",), timeout=60, poll=2, settle=3, still=True),
+    Step("character", ("z",), timeout=60, poll=2, settle=3, still=True),
+    Step("start", ("z",), until=playing, timeout=150, settle=2),
+)
+
+# game_state reads as paused before the pause menu has slid in
+_PAUSE = Step(
+    "pause",
+    ("esc",),
+    until=field_is("game_state", 0),
+    timeout=30,
+    poll=2,
+    settle=3,
+    still=True,
+)
+
+# restart while the game is running
+FORCE_RESET = (
+    _PAUSE,
+    Step("restart", ("r",), until=playing, timeout=330),
+)
+
+# restart when the spell card is cleared or all lives are lost
+RESET_FROM_END_OF_RUN = (
+    Step("menu", ("esc",), timeout=30, poll=2, settle=3, still=True),
+    Step("retry", ("up",), timeout=30, poll=2, settle=3, still=True),
+    Step("restart", ("z",), until=playing, timeout=330),
+)
+
+SKIP_DIALOG = (
+    Step("settle", timeout=5),
+    Step(
+        "skip",
+        hold=("ctrl",),
+        until=field_is_not("in_dialog", -1),
+        timeout=900,
+        poll=5,
+        settle=3,
+        required=True,
+    ),
+)
+
+
+def quit_to_title(game_state: int | None) -> tuple[Step, ...]:
+    """
+    Quit to the title screen and exit the menus, given the game state.
+    """
+    if game_state == 0:  # pausing
+        steps = (Step("quit", ("q",), timeout=120),)
+    elif game_state == 1:  # end of run
+        steps = (
+            Step("menu", ("esc",), timeout=30, poll=2, settle=3, still=True),
+            Step("quit", ("z",), timeout=120),
+        )
+    else:
+        steps = (_PAUSE, Step("quit", ("q",), timeout=120))
+    return steps + tuple(Step("back", ("esc",), timeout=60) for _ in range(3))
+
+
+class MacroEngine:
+    """
+    Runs macros against a game backend.
+
+    :param read: Read a game field by name, None if it can't be read
+    :param clock: Read the in-game timer in frames
+    :param sleep: Let the game run for some frames
+    :param input_backend: Where the keys are sent
+    """
+
+    def __init__(
+        self,
+        read: Callable[[str], Any],
+        clock: Callable[[], int],
+        sleep: Callable[[int], None],
+        input_backend: InputBackend,
+    ):
+        self.read = read
+        self.clock = clock
+        self.sleep = sleep
+        self.input_backend = input_backend
+        # compares the screen with the one of the previous check
+        self.screen = FreezeDetector()
+        # "macro/step" -> runs, frames, max_frames, timeouts, seconds
+        self.stats = {}
+
+    def _tap(self, key: str) -> None:
+        self.input_backend.press(key)
+        self.input_backend.flush()
+        self.sleep(1)
+        self.input_backend.release(key)
+        self.input_backend.flush()
+        self.sleep(1)
+
+    def _wait(self, step: Step) -> bool:
+        if step.until is None and not step.still:
+            self.sleep(step.timeout)
+            return True
+        start = self.clock()
+        streak = 0
+        self.screen.reset()
+        while True:
+            holds = step.until is None or step.until(self.read)
+            if step.still:
+                # captured at every check, so that the next one compares to it
+                holds = self.screen.update(self.read("screen")) and holds
+            streak = streak + 1 if holds else 0
+            if streak >= step.settle:
+                return True
+            if self.clock() - start >= step.timeout:
+                return False
+            self.sleep(step.poll)
+
+    def run(self, name: str, steps: tuple[Step, ...]) -> int:
+        """
+        Run a macro and return the frames it took.
+        """
+        macro_start = self.clock()
+        for step in steps:
+            key = f"{name}/{step.name}"
+            t0 = time.perf_counter()
+            start = self.clock()
+            with tracing.span(key, "macro"):
+                for k in step.keys:
+                    self._tap(k)
+                for k in step.hold:
+                    self.input_backend.press(k)
+                self.input_backend.flush()
+                try:
+                    satisfied = self._wait(step)
+                finally:
+                    for k in step.hold:
+                        self.input_backend.release(k)
+                    self.input_backend.flush()
+            self._record(key, self.clock() - start, time.perf_counter() - t0, satisfied)
+            if not satisfied:
+                conditions = [step.until.__name__] if step.until is not None else []
+                if step.still:
+                    conditions.append("a still screen")
+                message = (
+                    f"Macro step {key} timed out after {step.timeout} frames "
+                    f"waiting for {' and '.join(conditions)}"
+                )
+                if step.required:
+                    raise RuntimeError(message)
+                logger.warning(message)
+        frames = self.clock() - macro_start
+        logger.debug(f"Macro {name} took {frames} frames")
+        return frames
+
+    def _record(self, key: str, frames: int, seconds: float, satisfied: bool) -> None:
+        stats = self.stats.setdefault(
+            key,
+            {"runs": 0, "frames": 0, "max_frames": 0, "timeouts": 0, "seconds": 0.0},
+        )
+        stats["runs"] += 1
+        stats["frames"] += frames
+        stats["max_frames"] = max(stats["max_frames"], frames)
+        stats["timeouts"] += int(not satisfied)
+        stats["seconds"] += seconds
+
+    def get_stats(self) -> dict[str, dict[str, float]]:
+        """
+        Mean and max frames, mean seconds and timeouts of each step.
+        """
+        return {
+            key: {
+                "runs": stats["runs"],
+                "mean_frames": stats["frames"] / stats["runs"],
+                "max_frames": stats["max_frames"],
+                "mean_seconds": stats["seconds"] / stats["runs"],
+                "timeouts": stats["timeouts"],
+            }
+            for key, stats in self.stats.items()
+        }
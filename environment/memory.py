@@ -0,0 +1,280 @@
+"""
+Memory backends for reading the game process.
+
+`ProcessMemory` wraps `ReadProcessMemory` on a live game process, while
+`SimulatedMemory` serves the same reads from an in-memory image, so that the
+readers built on top of a backend can be exercised without the game.
+
+Both backends use absolute addresses. Addresses relative to the main module are
+resolved with `base_address`. Both list their readable regions with `regions`,
+for scanning the memory (see `scanner.py`).
+
+Named game variables are declared as `Field`s and compiled once against a
+backend with `compile_fields`, so that reading one is a read into a reused
+buffer plus an `unpack_from`.
+"""
+
+import ctypes
+import struct
+from ctypes import wintypes
+from typing import NamedTuple
+
+
+_PTR = struct.Struct("<I")
+
+_MEM_COMMIT = 0x1000
+_PAGE_NOACCESS = 0x01
+_PAGE_GUARD = 0x100
+_PAGE_READABLE = 0x02 | 0x04 | 0x08 | 0x20 | 0x40 | 0x80
+
+FIELD_TYPES = {
+    "int8": "<b",
+    "uint8": "<B",
+    "int16": "<h",
+    "uint16": "<H",
+    "int32": "<i",
+    "uint32": "<I",
+    "float32": "<f",
+    "float64": "<d",
+}
+
+
+class _MemoryBasicInformation(ctypes.Structure):
+    # the padding of the 64-bit layout is added by ctypes
+    _fields_ = (
+        ("BaseAddress", ctypes.c_void_p),
+        ("AllocationBase", ctypes.c_void_p),
+        ("AllocationProtect", wintypes.DWORD),
+        ("RegionSize", ctypes.c_size_t),
+        ("State", wintypes.DWORD),
+        ("Protect", wintypes.DWORD),
+        ("Type", wintypes.DWORD),
+    )
+
+
+class ProcessMemory:
+    """
+    Reads the memory of the game process through a Windows process handle.
+
+    Writing additionally requires the handle to be opened with
+    `PROCESS_VM_WRITE | PROCESS_VM_OPERATION` access, and listing the regions
+    with `PROCESS_QUERY_INFORMATION` access.
+    """
+
+    def __init__(self, process_handle, base_address: int):
+        self.process_handle = process_handle
+        self.base_address = base_address
+        # a private function object, so that setting argtypes doesn't affect
+        # other users of `ctypes.windll.kernel32`
+        kernel32 = ctypes.WinDLL("kernel32")
+        self._read_process_memory = kernel32.ReadProcessMemory
+        self._write_process_memory = kernel32.WriteProcessMemory
+        for f in (self._read_process_memory, self._write_process_memory):
+            f.argtypes = (
+                wintypes.HANDLE,
+                ctypes.c_void_p,
+                ctypes.c_void_p,
+                ctypes.c_size_t,
+                ctypes.POINTER(ctypes.c_size_t),
+            )
+            f.restype = wintypes.BOOL
+        self._virtual_query_ex = kernel32.VirtualQueryEx
+        self._virtual_query_ex.argtypes = (
+            wintypes.HANDLE,
+            ctypes.c_void_p,
+            ctypes.POINTER(_MemoryBasicInformation),
+            ctypes.c_size_t,
+        )
+        self._virtual_query_ex.restype = ctypes.c_size_t
+
+    def read_raw(self, address: int, pointer: int, size: int) -> None:
+        """
+        Read `size` bytes at `address` into the memory at `pointer`.
+        """
+        if not self._read_process_memory(
+            self.process_handle, address, pointer, size, None
+        ):
+            raise RuntimeError(
+                f"Failed to read memory at address {hex(address)}. Process may have exitted."
+            )
+
+    def read_into(self, address: int, buffer, size: int) -> None:
+        """
+        Read `size` bytes at `address` into a writable buffer (bytearray,
+        ctypes array, numpy array, ...).
+        """
+        view = (ctypes.c_char * size).from_buffer(buffer)
+        self.read_raw(address, ctypes.addressof(view), size)
+
+    def read(self, address: int, size: int) -> bytes:
+        buffer = ctypes.create_string_buffer(size)
+        self.read_raw(address, ctypes.addressof(buffer), size)
+        return buffer.raw
+
+    def read_ptr(self, address: int) -> int:
+        return _PTR.unpack(self.read(address, _PTR.size))[0]
+
+    def write(self, address: int, data: bytes) -> None:
+        if not self._write_process_memory(
+            self.process_handle, address, data, len(data), None
+        ):
+            raise RuntimeError(f"Failed to write memory at address {hex(address)}.")
+
+    def regions(self) -> list[tuple[int, int]]:
+        """
+        (start, size) of the committed, readable regions of the process.
+        """
+        regions = []
+        info = _MemoryBasicInformation()
+        address = 0
+        while self._virtual_query_ex(
+            self.process_handle, address, ctypes.byref(info), ctypes.sizeof(info)
+        ):
+            start = info.BaseAddress or 0
+            if (
+                info.State == _MEM_COMMIT
+                and info.Protect & _PAGE_READABLE
+                and not info.Protect & (_PAGE_GUARD | _PAGE_NOACCESS)
+            ):
+                regions.append((start, info.RegionSize))
+            address = start + info.RegionSize
+        return regions
+
+
+class SimulatedMemory:
+    """
+    A sparse memory image made of mapped regions.
+
+    Reads outside mapped regions fail the same way as reading an invalid
+    address of the game process does.
+
+    Example
+    -------
+    mem = SimulatedMemory()
+    mem.map(mem.base_address, 0x100000)  # main module image
+    mem.write_ptr(mem.base_address + 0xDB544, 0x2000000)
+    """
+
+    def __init__(self, base_address: int = 0x400000):
+        self.base_address = base_address
+        # (start, data, address of data)
+        self._regions: list[tuple[int, bytearray, int]] = []
+
+    def map(self, address: int, size_or_data: int | bytes) -> memoryview:
+        """
+        Map a new region, either zero-filled or initialized with the given data.
+        """
+        data = bytearray(size_or_data)
+        end = address + len(data)
+        for start, region, _ in self._regions:
+            if address < start + len(region) and start < end:
+                raise ValueError(f"Region at {hex(address)} overlaps a mapped region")
+        pointer = ctypes.addressof((ctypes.c_char * len(data)).from_buffer(data))
+        self._regions.append((address, data, pointer))
+        self._regions.sort(key=lambda r: r[0])
+        return memoryview(data)
+
+    def _locate(self, address: int, size: int) -> tuple[bytearray, int, int]:
+        for start, region, pointer in self._regions:
+            if start <= address and address + size <= start + len(region):
+                return region, address - start, pointer
+        raise RuntimeError(
+            f"Failed to read memory at address {hex(address)}. Address is not mapped."
+        )
+
+    def read_raw(self, address: int, pointer: int, size: int) -> None:
+        _, offset, region_pointer = self._locate(address, size)
+        ctypes.memmove(pointer, region_pointer + offset, size)
+
+    def read_into(self, address: int, buffer, size: int) -> None:
+        region, offset, _ = self._locate(address, size)
+        memoryview(buffer).cast("B")[:size] = region[offset : offset + size]
+
+    def read(self, address: int, size: int) -> bytes:
+        region, offset, _ = self._locate(address, size)
+        return bytes(region[offset : offset + size])
+
+    def read_ptr(self, address: int) -> int:
+        return _PTR.unpack(self.read(address, _PTR.size))[0]
+
+    def write(self, address: int, data: bytes) -> None:
+        region, offset, _ = self._locate(address, len(data))
+        region[offset : offset + len(data)] = data
+
+    def write_ptr(self, address: int, value: int) -> None:
+        self.write(address, _PTR.pack(value))
+
+    def regions(self) -> list[tuple[int, int]]:
+        return [(start, len(region)) for start, region, _ in self._regions]
+
+
+class Field(NamedTuple):
+    """
+    Declaration of a game variable.
+
+    `path` is a pointer path. The first element is the offset relative to the
+    module base. Each following element dereferences the current address as a
+    32-bit pointer and adds the element to the result.
+
+    Example
+    -------
+    foo: Field((rel_addr_foo,), "int32")
+    foo.bar: Field((rel_addr_foo, offset_bar), "float32")
+    foo.bar.baz: Field((rel_addr_foo, offset_bar, offset_baz), "int32")
+    """
+
+    path: tuple[int, ...]
+    type: str = "int32"
+
+
+class CompiledField:
+    """
+    A `Field` bound to a memory backend, with its unpacker and buffers
+    prepared in advance. Calling it reads the current value.
+    """
+
+    __slots__ = (
+        "_read_raw",
+        "_address",
+        "_offsets",
+        "_size",
+        "_unpack_from",
+        "_buffer",
+        "_buffer_ptr",
+        "_ptr_buffer",
+        "_ptr_buffer_ptr",
+    )
+
+    def __init__(self, memory, field: Field):
+        if len(field.path) == 0:
+            raise ValueError("Field path should not be empty")
+        if field.type not in FIELD_TYPES:
+            raise ValueError(f"Invalid field type: {field.type}")
+        unpacker = struct.Struct(FIELD_TYPES[field.type])
+        self._read_raw = memory.read_raw
+        self._address = memory.base_address + field.path[0]
+        self._offsets = field.path[1:]
+        self._size = unpacker.size
+        self._unpack_from = unpacker.unpack_from
+        self._buffer = ctypes.create_string_buffer(unpacker.size)
+        self._buffer_ptr = ctypes.addressof(self._buffer)
+        self._ptr_buffer = ctypes.create_string_buffer(_PTR.size)
+        self._ptr_buffer_ptr = ctypes.addressof(self._ptr_buffer)
+
+    def address(self) -> int:
+        """
+        Resolve the pointer path to the absolute address of the field.
+        """
+        address = self._address
+        for offset in self._offsets:
+            self._read_raw(address, self._ptr_buffer_ptr, 4)
+            address = _PTR.unpack_from(self._ptr_buffer)[0] + offset
+        return address
+
+    def __call__(self) -> int | float:
+        self._read_raw(self.address(), self._buffer_ptr, self._size)
+        return self._unpack_from(self._buffer)[0]
+
+
+def compile_fields(memory, fields: dict[str, Field]) -> dict[str, CompiledField]:
+    return {key: CompiledField(memory, field) for key, field in fields.items()}
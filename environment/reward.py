@@ -0,0 +1,44 @@
+"""
+Reward of `Touhou14Env`, shared with `SimulatedTouhou14Env`.
+"""
+
+import numpy as np
+
+
+def compute_reward(
+    prev_info: dict,
+    curr_info: dict,
+    player_position: np.ndarray,
+    prev_player_position: np.ndarray | None,
+    move: int,
+    episode_time: float,
+    step_scale: float = 1.0,
+) -> float:
+    """
+    Reward of a step from the game info before and after it.
+
+    The events (lost lives, damage to the boss, clear) are counted once
+    however long the step is, while the terms given at every step (survival,
+    useless movement, risky position) are scaled by `step_scale`, the length
+    of the step relative to the default one, so that longer steps earn them
+    at the same rate per frame. `episode_time` is counted in default steps.
+    """
+    diff_life = (curr_info["lives"] - prev_info["lives"]) * 3 + (
+        curr_info["life_fragments"] - prev_info["life_fragments"]
+    )
+    diff_boss_hp = min(0, curr_info["boss_hp"] - prev_info["boss_hp"])
+    # a jump of the boss HP between its phases
+    if diff_boss_hp < -100 * max(1.0, step_scale):
+        diff_boss_hp = 0
+    reward = diff_life * 500 - diff_boss_hp + step_scale
+    # clear bonus
+    if curr_info["boss_hp"] == 9999 and prev_info["boss_hp"] == 0:
+        reward += 1500 * max(0, 500 - episode_time) / 500
+
+    # penalize useless movement
+    if np.all(player_position == prev_player_position) and move != 0:
+        reward -= 10 * step_scale
+
+    # penalize risky y positions
+    reward -= (432.0 - player_position[1]) / 10 * step_scale
+    return reward
@@ -0,0 +1,236 @@
+"""
+CPU placement of the game, the env and the learner running on one machine.
+
+The env steps the game from the main thread, spin-waiting on the in-game
+timer, while PyTorch runs the gradient steps on its own thread pools, and
+the game renders in its own process. Left alone, they compete for the same
+cores and the frame timing of the game suffers. `configure_runtime` caps the
+PyTorch thread pools, pins the main thread to the env cores and the game to
+its own cores, optionally changes the process priorities, and logs the
+resulting placement.
+
+The scripts expose it with `add_runtime_args` and `configure_from_args`.
+"""
+
+import argparse
+import ctypes
+import logging
+import os
+import sys
+
+import psutil
+import torch as th
+
+
+logger = logging.getLogger("runtime")
+
+_GAME_PROCESS_NAME = "th14.exe"
+
+PRIORITIES = ("idle", "below_normal", "normal", "above_normal", "high")
+# nice values of the priorities outside Windows
+_NICE_VALUES = {
+    "idle": 19,
+    "below_normal": 10,
+    "normal": 0,
+    "above_normal": -5,
+    "high": -10,
+}
+
+
+def parse_cpus(cpus: str) -> list[int]:
+    """
+    Parse a CPU list such as "0-3,6".
+    """
+    result = set()
+    for part in cpus.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        try:
+            first, last = int(first), int(last or first)
+        except ValueError:
+            raise ValueError(f"Invalid CPU list: {cpus}") from None
+        if first < 0 or last < first:
+            raise ValueError(f"Invalid CPU list: {cpus}")
+        result.update(range(first, last + 1))
+    if not result:
+        raise ValueError(f"Invalid CPU list: {cpus}")
+    return sorted(result)
+
+
+def find_game_process() -> psutil.Process | None:
+    for process in psutil.process_iter(["name"]):
+        if (process.info["name"] or "").lower() == _GAME_PROCESS_NAME:
+            return process
+    return None
+
+
+def _set_priority(process: psutil.Process, priority: str) -> None:
+    if priority not in PRIORITIES:
+        raise ValueError(f"Invalid priority {priority}, should be one of {PRIORITIES}")
+    try:
+        if sys.platform == "win32":
+            process.nice(getattr(psutil, f"{priority.upper()}_PRIORITY_CLASS"))
+        else:
+            process.nice(_NICE_VALUES[priority])
+    except psutil.AccessDenied:
+        raise RuntimeError(
+            f"Not allowed to set the priority of process {process.pid} to {priority}"
+        ) from None
+
+
+def pin_current_thread(cpus: list[int]) -> None:
+    """
+    Restrict the calling thread to the given CPUs.
+    """
+    if sys.platform == "win32":
+        kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+        kernel32.GetCurrentThread.restype = ctypes.c_void_p
+        kernel32.SetThreadAffinityMask.argtypes = (ctypes.c_void_p, ctypes.c_size_t)
+        kernel32.SetThreadAffinityMask.restype = ctypes.c_size_t
+        mask = sum(1 << cpu for cpu in cpus)
+        if not kernel32.SetThreadAffinityMask(kernel32.GetCurrentThread(), mask):
+            raise RuntimeError(
+                f"Failed to pin the thread, error code: {ctypes.get_last_error()}"
+            )
+    else:
+        # the calling thread only, on Linux
+        os.sched_setaffinity(0, cpus)
+
+
+def _start_torch_pools() -> None:
+    # threads inherit the affinity of the thread creating them on Linux, so
+    # the intra-op pool is started from the learner CPUs, before the main
+    # thread is pinned to the env CPUs
+    a = th.ones(256, 256)
+    (a @ a).sum().item()
+
+
+def configure_runtime(
+    torch_threads: int | None = None,
+    interop_threads: int | None = None,
+    env_cpus: list[int] | None = None,
+    learner_cpus: list[int] | None = None,
+    game_cpus: list[int] | None = None,
+    priority: str | None = None,
+    game_priority: str | None = None,
+    game_process: psutil.Process | None = None,
+) -> dict:
+    """
+    Configure the thread budgets and the CPU placement of this process and of
+    the game, and return the resulting placement. Settings left to None are
+    not changed. Call it before creating the model, since the PyTorch thread
+    pools keep the placement they are started with.
+
+    :param torch_threads: Size of the PyTorch intra-op thread pool
+    :param interop_threads: Size of the PyTorch inter-op thread pool, which
+        can only be set before any parallel work
+    :param env_cpus: CPUs of the main thread, which steps the env
+    :param learner_cpus: CPUs of the PyTorch thread pools. This process is
+        restricted to them and `env_cpus`. On Windows, the pools can use all
+        the CPUs of the process
+    :param game_cpus: CPUs of the game process
+    :param priority: Priority of this process, one of `PRIORITIES`
+    :param game_priority: Priority of the game process
+    :param game_process: Game process, found by name by default
+    """
+    if torch_threads is not None:
+        if torch_threads < 1:
+            raise ValueError("Number of PyTorch threads should be positive")
+        th.set_num_threads(torch_threads)
+    if interop_threads is not None:
+        if interop_threads < 1:
+            raise ValueError("Number of PyTorch inter-op threads should be positive")
+        try:
+            th.set_num_interop_threads(interop_threads)
+        except RuntimeError as e:
+            logger.warning(f"Cannot set the inter-op threads: {e}")
+
+    process = psutil.Process()
+    if learner_cpus is not None:
+        process.cpu_affinity(sorted(set(learner_cpus) | set(env_cpus or ())))
+        pin_current_thread(learner_cpus)
+    if learner_cpus is not None or env_cpus is not None:
+        _start_torch_pools()
+    if env_cpus is not None:
+        pin_current_thread(env_cpus)
+    if priority is not None:
+        _set_priority(process, priority)
+
+    if game_cpus is not None or game_priority is not None:
+        if game_process is None:
+            game_process = find_game_process()
+        if game_process is None:
+            raise RuntimeError(f"Cannot find the {_GAME_PROCESS_NAME} process")
+        if game_cpus is not None:
+            game_process.cpu_affinity(game_cpus)
+        if game_priority is not None:
+            _set_priority(game_process, game_priority)
+
+    placement = {
+        "cpu_count": psutil.cpu_count(),
+        "torch_threads": th.get_num_threads(),
+        "interop_threads": th.get_num_interop_threads(),
+        "learner_cpus": learner_cpus,
+        "env_cpus": env_cpus,
+        "priority": priority,
+    }
+    if game_process is not None:
+        placement["game_pid"] = game_process.pid
+        placement["game_cpus"] = game_process.cpu_affinity()
+        placement["game_priority"] = game_priority
+    logger.info(f"Runtime placement: {placement}")
+    return placement
+
+
+def add_runtime_args(parser: argparse.ArgumentParser) -> None:
+    group = parser.add_argument_group("runtime placement")
+    group.add_argument(
+        "--torch_threads", type=int, default=None, help="PyTorch intra-op threads"
+    )
+    group.add_argument(
+        "--interop_threads", type=int, default=None, help="PyTorch inter-op threads"
+    )
+    group.add_argument(
+        "--env_cpus",
+        type=parse_cpus,
+        default=None,
+        help="CPUs of the env thread, e.g., 0 or 0-1",
+    )
+    group.add_argument(
+        "--learner_cpus",
+        type=parse_cpus,
+        default=None,
+        help="CPUs of the PyTorch threads, e.g., 2-5",
+    )
+    group.add_argument(
+        "--game_cpus",
+        type=parse_cpus,
+        default=None,
+        help="CPUs of the game process, e.g., 6-7",
+    )
+    group.add_argument(
+        "--priority", choices=PRIORITIES, default=None, help="Priority of this process"
+    )
+    group.add_argument(
+        "--game_priority",
+        choices=PRIORITIES,
+        default=None,
+        help="Priority of the game process",
+    )
+
+
+def configure_from_args(args: argparse.Namespace) -> dict:
+    """
+    `configure_runtime` with the arguments added by `add_runtime_args`.
+    """
+    return configure_runtime(
+        torch_threads=args.torch_threads,
+        interop_threads=args.interop_threads,
+        env_cpus=args.env_cpus,
+        learner_cpus=args.learner_cpus,
+        game_cpus=args.game_cpus,
+        priority=args.priority,
+        game_priority=args.game_priority,
+    )
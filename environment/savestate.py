@@ -0,0 +1,120 @@
+"""
+Savestates made of game memory regions.
+
+A savestate is captured once at the start of the spell card and restored by
+writing the regions back while the game process is suspended, which is much
+faster than resetting through the menus.
+
+Heap objects are located through pointer paths when capturing. Restoring is
+refused when a path no longer resolves to the captured address, e.g., after the
+game reallocated its managers for a new run, and the caller should then fall
+back to resetting through the menus. Only the checked paths are followed,
+not the objects they point to, so the regions should only hold scalar fields,
+never pointers into the heap, which would dangle once the game rebuilds it.
+The fields of the elements of an array, e.g., the bullet pool, are saved as a
+strided region, and restored by rewriting the array with the other bytes of
+the elements as they currently are.
+
+A savestate is thus only the part of the scene held in the saved fields. The
+state the game keeps elsewhere, such as the random number generator or the
+attack script of the boss, is not restored and goes on from where the run
+stopped, so the restored run may play out differently from the saved one.
+"""
+
+from typing import NamedTuple
+
+import numpy as np
+
+
+class Region(NamedTuple):
+    """
+    A memory region to save. `path` is a pointer path in the same format as
+    `environment.memory.Field.path`, resolving to the start of the region.
+
+    With a `count`, the region is made of `count` fields of `size` bytes,
+    `stride` bytes apart, e.g., a field of each element of an array.
+    """
+
+    path: tuple[int, ...]
+    size: int
+    stride: int = 0
+    count: int = 1
+
+
+def _fields(region: Region, span) -> np.ndarray:
+    """
+    A (count, size) view of the fields of a strided region in its span.
+    """
+    if region.count > 1 and region.stride < region.size:
+        raise ValueError("The stride of a region should cover its size")
+    return np.lib.stride_tricks.as_strided(
+        np.frombuffer(span, dtype=np.uint8),
+        shape=(region.count, region.size),
+        strides=(region.stride, 1),
+    )
+
+
+def _span_size(region: Region) -> int:
+    return (region.count - 1) * region.stride + region.size
+
+
+def resolve(memory, path: tuple[int, ...]) -> int:
+    address = memory.base_address + path[0]
+    for offset in path[1:]:
+        address = memory.read_ptr(address) + offset
+    return address
+
+
+class Savestate:
+    def __init__(self, regions: list[Region], snapshots: list[tuple[int, bytes]]):
+        self.regions = regions
+        # (absolute address, data) for each region
+        self.snapshots = snapshots
+
+    @property
+    def nbytes(self) -> int:
+        return sum(len(data) for _, data in self.snapshots)
+
+    @classmethod
+    def capture(cls, memory, regions: list[Region]) -> "Savestate":
+        """
+        Capture the regions from a memory backend. The game process should be
+        suspended so that the regions are consistent with each other.
+        """
+        snapshots = []
+        for region in regions:
+            address = resolve(memory, region.path)
+            data = memory.read(address, _span_size(region))
+            if region.count > 1:
+                data = _fields(region, data).tobytes()
+            snapshots.append((address, data))
+        return cls(regions, snapshots)
+
+    def is_valid(self, memory) -> bool:
+        """
+        Check that all the regions still live at the captured addresses.
+        """
+        try:
+            return all(
+                resolve(memory, region.path) == address
+                for region, (address, _) in zip(self.regions, self.snapshots)
+            )
+        except RuntimeError:
+            return False
+
+    def restore(self, memory) -> bool:
+        """
+        Write the regions back through a write-capable memory backend.
+        Return False without writing anything if the savestate is stale.
+        """
+        if not self.is_valid(memory):
+            return False
+        for region, (address, data) in zip(self.regions, self.snapshots):
+            if region.count > 1:
+                span = bytearray(memory.read(address, _span_size(region)))
+                _fields(region, span)[:] = np.frombuffer(data, np.uint8).reshape(
+                    region.count, region.size
+                )
+                data = bytes(span)
+            memory.write(address, data)
+        return True
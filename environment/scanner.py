@@ -0,0 +1,307 @@
+"""
+Memory scanner for finding the game variables, in the spirit of Cheat Engine.
+
+`MemoryScanner` snapshots the readable regions of a memory backend (see
+`memory.py`) in large chunks, and narrows down the addresses of a variable
+with vectorized searches for exact, changed or unchanged values across
+snapshots. `find_pointer_paths` then searches for pointer paths from the main
+module to an address, which stay valid across runs, unlike the address itself.
+The paths are in the format of `Field.path`.
+
+Example
+-------
+scanner = MemoryScanner(memory, "int32")
+scanner.exact(3)  # lives
+# lose a life
+scanner.exact(2)
+for address in scanner.addresses():
+    print(find_pointer_paths(memory, int(address)))
+"""
+
+from typing import Callable
+
+import numpy as np
+
+from environment.memory import FIELD_TYPES
+
+_PTR_DTYPE = np.dtype("<u4")
+
+
+def _chunks(memory, chunk_size: int, overlap: int = 0) -> list[tuple[int, int]]:
+    """
+    The readable regions split into (start, size) chunks, each overlapping the
+    next one of its region by `overlap` bytes.
+    """
+    return [
+        (address, min(chunk_size + overlap, start + size - address))
+        for start, size in memory.regions()
+        for address in range(start, start + size, chunk_size)
+    ]
+
+
+def _read(memory, start: int, size: int) -> np.ndarray | None:
+    data = np.empty(size, dtype=np.uint8)
+    try:
+        memory.read_into(start, data, size)
+    except RuntimeError:
+        # freed since the regions were listed
+        return None
+    return data
+
+
+class MemoryScanner:
+    """
+    Narrow down the addresses holding a value of the given type by successive
+    scans.
+
+    Before the first scan, every aligned address of the readable regions is a
+    candidate. Each scan reads the chunks which still contain candidates and
+    keeps the candidates whose value passes the test. Only the values at the
+    candidates are kept between scans, except for the first snapshot of an
+    unknown initial value (`start`).
+
+    :param value_type: Type of the value, one of `FIELD_TYPES`
+    :param alignment: Alignment of the candidate addresses in bytes
+    :param chunk_size: Size of the reads in bytes
+    """
+
+    def __init__(
+        self,
+        memory,
+        value_type: str = "int32",
+        alignment: int = 4,
+        chunk_size: int = 1 << 20,
+    ):
+        if value_type not in FIELD_TYPES:
+            raise ValueError(f"Invalid value type: {value_type}")
+        if alignment < 1:
+            raise ValueError("Alignment should be positive")
+        if chunk_size < 1:
+            raise ValueError("Chunk size should be positive")
+        self.memory = memory
+        self.dtype = np.dtype(FIELD_TYPES[value_type])
+        self.alignment = alignment
+        self.chunk_size = chunk_size
+        # (start, size, candidate offsets or None for all, previous values)
+        self._state = None
+
+    def _chunks(self) -> list[tuple[int, int]]:
+        # overlapping so that the values straddling two chunks are read whole
+        return [
+            (start, size)
+            for start, size in _chunks(
+                self.memory, self.chunk_size, self.dtype.itemsize - 1
+            )
+            if size >= self.dtype.itemsize
+        ]
+
+    def _values(self, data: np.ndarray, offsets: np.ndarray | None) -> np.ndarray:
+        """
+        Values at the given byte offsets of the data, or at every aligned
+        offset.
+        """
+        # a view of the value starting at each byte, up to the start of the
+        # next chunk, whose values are the next chunk's
+        values = np.ndarray(
+            (min(len(data) - self.dtype.itemsize + 1, self.chunk_size),),
+            dtype=self.dtype,
+            buffer=data,
+            strides=(1,),
+        )
+        if offsets is None:
+            return values[:: self.alignment]
+        return values[offsets]
+
+    def start(self) -> None:
+        """
+        Snapshot the memory, for a first scan relative to an unknown value.
+        """
+        self._state = []
+        for start, size in self._chunks():
+            data = _read(self.memory, start, size)
+            if data is not None:
+                self._state.append((start, size, None, self._values(data, None)))
+
+    def scan(self, test: Callable[[np.ndarray, np.ndarray | None], np.ndarray]) -> int:
+        """
+        Keep the candidates for which `test(values, previous_values)` is True,
+        and return their number. The previous values are None for a first scan
+        without `start`.
+        """
+        if self._state is None:
+            state = [(start, size, None, None) for start, size in self._chunks()]
+        else:
+            state = self._state
+        self._state = []
+        for start, size, offsets, previous in state:
+            data = _read(self.memory, start, size)
+            if data is None:
+                continue
+            values = self._values(data, offsets)
+            mask = test(values, previous)
+            if offsets is None:
+                offsets = np.flatnonzero(mask) * self.alignment
+            else:
+                offsets = offsets[mask]
+            if len(offsets) > 0:
+                self._state.append((start, size, offsets, values[mask]))
+        return self.count()
+
+    def exact(self, value: int | float, tolerance: float = 0.0) -> int:
+        if tolerance > 0:
+            return self.scan(lambda x, _: np.abs(x - value) <= tolerance)
+        return self.scan(lambda x, _: x == value)
+
+    def _scan_relative(self, test) -> int:
+        if self._state is None:
+            raise ValueError("No previous values, call `start` first")
+        return self.scan(test)
+
+    def changed(self) -> int:
+        return self._scan_relative(lambda x, previous: x != previous)
+
+    def unchanged(self) -> int:
+        return self._scan_relative(lambda x, previous: x == previous)
+
+    def increased(self) -> int:
+        return self._scan_relative(lambda x, previous: x > previous)
+
+    def decreased(self) -> int:
+        return self._scan_relative(lambda x, previous: x < previous)
+
+    def count(self) -> int:
+        if self._state is None:
+            return 0
+        return sum(
+            len(values) if offsets is None else len(offsets)
+            for _, _, offsets, values in self._state
+        )
+
+    def addresses(self) -> np.ndarray:
+        """
+        Addresses of the remaining candidates.
+        """
+        if self._state is None:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate(
+            [np.zeros(0, dtype=np.int64)]
+            + [
+                start + np.arange(len(values), dtype=np.int64) * self.alignment
+                if offsets is None
+                else start + offsets
+                for start, _, offsets, values in self._state
+            ]
+        )
+
+    def values(self) -> np.ndarray:
+        """
+        Values of the remaining candidates as of the last scan.
+        """
+        if self._state is None:
+            return np.zeros(0, dtype=self.dtype)
+        return np.concatenate(
+            [np.zeros(0, dtype=self.dtype)]
+            + [values for _, _, _, values in self._state]
+        )
+
+
+def static_range(memory) -> tuple[int, int]:
+    """
+    Address range of the regions contiguous from the module base, i.e., the
+    module image, whose addresses don't change across runs.
+    """
+    end = memory.base_address
+    for start, size in sorted(memory.regions()):
+        if start <= end < start + size:
+            end = start + size
+    return memory.base_address, end
+
+
+def pointer_map(memory, chunk_size: int = 1 << 20) -> tuple[np.ndarray, np.ndarray]:
+    """
+    All the 32-bit aligned values of the readable regions which point into a
+    readable region, as arrays of (values, their addresses) sorted by value.
+    """
+    regions = sorted(memory.regions())
+    region_starts = np.array([start for start, _ in regions], dtype=np.int64)
+    region_ends = np.array([start + size for start, size in regions], dtype=np.int64)
+    all_values, all_addresses = [], []
+    for start, size in _chunks(memory, chunk_size):
+        data = _read(memory, start, size - size % 4)
+        if data is None:
+            continue
+        values = data.view(_PTR_DTYPE).astype(np.int64)
+        i = np.searchsorted(region_starts, values, side="right") - 1
+        valid = (i >= 0) & (values < region_ends[i.clip(0)])
+        all_values.append(values[valid])
+        all_addresses.append(start + 4 * np.flatnonzero(valid))
+    values = np.concatenate([np.zeros(0, dtype=np.int64)] + all_values)
+    addresses = np.concatenate([np.zeros(0, dtype=np.int64)] + all_addresses)
+    order = np.argsort(values, kind="stable")
+    return values[order], addresses[order]
+
+
+def find_pointer_paths(
+    memory,
+    target: int,
+    max_depth: int = 4,
+    max_offset: int = 0x8000,
+    max_nodes: int = 100000,
+    pointers: tuple[np.ndarray, np.ndarray] | None = None,
+    static: tuple[int, int] | None = None,
+) -> list[tuple[int, ...]]:
+    """
+    Pointer paths (see `Field`) from the module to `target`, found by walking
+    the pointers backwards from the target, breadth first.
+
+    :param max_depth: Maximum number of dereferences
+    :param max_offset: Maximum offset added to a pointer, the game objects
+        are large (e.g., the boss data is at 0x11F0 of an enemy node)
+    :param max_nodes: Maximum number of addresses explored at each depth
+    :param pointers: Result of `pointer_map`, to reuse it across searches
+    :param static: Address range of the module, `static_range` by default
+    """
+    if pointers is None:
+        pointers = pointer_map(memory)
+    if static is None:
+        static = static_range(memory)
+    values, addresses = pointers
+    base = memory.base_address
+
+    paths = []
+    if static[0] <= target < static[1]:
+        paths.append((target - base,))
+    # each depth is kept as arrays of (parent node, offset from the pointer
+    # value to the parent node), so that paths are only built for the
+    # pointers in the module
+    levels = []
+    node_addresses = np.array([target], dtype=np.int64)
+    for _ in range(max_depth):
+        if len(node_addresses) == 0:
+            break
+        lo = np.searchsorted(values, node_addresses - max_offset, side="left")
+        hi = np.searchsorted(values, node_addresses, side="right")
+        counts = hi - lo
+        parents = np.repeat(np.arange(len(node_addresses)), counts)
+        # the pointers lo[i] to hi[i] - 1 for each node i
+        indices = (
+            np.arange(counts.sum())
+            - np.repeat(np.cumsum(counts) - counts, counts)
+            + np.repeat(lo, counts)
+        )
+        offsets = node_addresses[parents] - values[indices]
+        locations = addresses[indices]
+        in_static = (locations >= static[0]) & (locations < static[1])
+        levels.append((parents, offsets))
+        for i in np.flatnonzero(in_static):
+            path = [int(locations[i]) - base]
+            for level_parents, level_offsets in reversed(levels):
+                path.append(int(level_offsets[i]))
+                i = level_parents[i]
+            paths.append(tuple(path))
+        # keep exploring from the other pointers, the smallest offsets first
+        keep = np.flatnonzero(~in_static)
+        keep = keep[np.argsort(offsets[keep], kind="stable")[:max_nodes]]
+        levels[-1] = (parents[keep], offsets[keep])
+        node_addresses = locations[keep]
+    return sorted(paths, key=lambda path: (len(path), path))
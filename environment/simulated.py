@@ -0,0 +1,354 @@
+"""
+Simulated stand-ins for `Touhou14Env` and for the game menus, which need
+neither the game nor Windows, for smoke tests of the training and evaluation
+scripts and of the menu macros.
+"""
+
+from collections import deque
+from typing import Any
+
+import gymnasium as gym
+import numpy as np
+
+from environment.input_backend import RecordingBackend
+from environment.reward import compute_reward
+from environment.spaces import (
+    FRAME_HEIGHT,
+    FRAME_WIDTH,
+    check_repeat_choices,
+    decode_action,
+    make_action_space,
+    make_observation_space,
+)
+
+# movement per frame (normal, slow)
+_SPEEDS = (4.5, 2.0)
+# (dx, dy) of the moves
+_DIRECTIONS = ((0, 0), (-1, 0), (1, 0), (0, -1), (0, 1))
+_X_RANGE = (-184.0, 184.0)
+_Y_RANGE = (32.0, 432.0)
+_BOSS_HP = 1500
+
+
+class SimulatedTouhou14Env(gym.Env):
+    """
+    Toy spell card with the same spaces, info keys and episode ends as
+    `Touhou14Env`, and the same reward.
+
+    The boss sways left and right and takes damage while the player is below
+    it, the player gets hit at random, and the run ends when the boss is
+    defeated, all lives are lost or the spell card times out. The frames only
+    show the player and the boss as squares.
+
+    :param hit_rate: Probability for the player to be hit in each frame
+    :param time_limit: Frames before the spell card times out
+    """
+
+    def __init__(
+        self,
+        n_frame_stack: int = 4,
+        action_repeat: int | None = None,
+        repeat_choices: tuple[int, ...] | None = None,
+        frame_downsize_ratio: float = 1.0,
+        channels_first: bool = False,
+        max_lost_lives: int = 0,
+        max_enemies: int = 0,
+        max_bullets: int = 0,
+        hit_rate: float = 0.002,
+        time_limit: int = 3600,
+    ):
+        if n_frame_stack < 1:
+            raise ValueError("Number of stacked frames should be positive")
+        if action_repeat is None:
+            action_repeat = n_frame_stack
+        if action_repeat < 1:
+            raise ValueError("Action repeat should be positive")
+        if frame_downsize_ratio <= 0.0 or frame_downsize_ratio > 1.0:
+            raise ValueError("Invalid frame downsize ratio, should be 0-1")
+        self.n_frame_stack = n_frame_stack
+        self.action_repeat = action_repeat
+        self.repeat_choices = check_repeat_choices(repeat_choices)
+        self.frame_downsize_ratio = frame_downsize_ratio
+        self.channels_first = channels_first
+        self.max_lost_lives = max_lost_lives
+        self.n_entities = max_enemies + max_bullets
+        self.hit_rate = hit_rate
+        self.time_limit = time_limit
+        self.observation_space = make_observation_space(
+            n_frame_stack, frame_downsize_ratio, self.n_entities, channels_first
+        )
+        self.action_space = make_action_space(self.repeat_choices)
+        self.frame_shape = (
+            int(FRAME_HEIGHT * frame_downsize_ratio),
+            int(FRAME_WIDTH * frame_downsize_ratio),
+        )
+        self.frame_buffer = deque(maxlen=n_frame_stack)
+
+    def reset(self, seed: int | None = None, options: dict | None = None):
+        super().reset(seed=seed)
+        self.frames = 0
+        self.episode_time = 0
+        self.player_position = np.array((0.0, 400.0), dtype=np.float32)
+        self.boss_position = np.array((0.0, 100.0), dtype=np.float32)
+        self.prev_pos = None
+        self.info = {
+            "score": 0,
+            "lives": 2,
+            "life_fragments": 0,
+            "bombs": 2,
+            "bomb_fragments": 0,
+            "power": 400,
+            "game_state": 2,
+            "in_dialog": 0,
+            "boss_hp": _BOSS_HP,
+        }
+        self.initial_lives = self.info["lives"]
+        frame = self._render()
+        self.frame_buffer.clear()
+        for _ in range(self.n_frame_stack):
+            self.frame_buffer.append(frame)
+        info = dict(self.info)
+        info["reset_latency"] = 0.0
+        return self._get_state(), info
+
+    def step(self, action: int | np.integer[Any]):
+        move, slow, n_frames = decode_action(
+            action, self.action_repeat, self.repeat_choices
+        )
+        # in default steps
+        step_scale = n_frames / self.action_repeat
+        self.episode_time += step_scale
+        prev_info = self.info
+        info = dict(prev_info)
+
+        if prev_info["boss_hp"] == 0:
+            # the boss was defeated in the previous step
+            info["boss_hp"] = 9999
+            info["game_state"] = 1
+        else:
+            self._advance(move, slow, n_frames, info)
+        self.frame_buffer.append(self._render())
+        state = self._get_state()
+
+        terminated = info["game_state"] != 2
+        truncated = info["lives"] < self.initial_lives - self.max_lost_lives
+        self.info = info
+        reward = compute_reward(
+            prev_info,
+            info,
+            state["player_position"],
+            self.prev_pos,
+            move,
+            self.episode_time,
+            step_scale,
+        )
+        self.prev_pos = state["player_position"]
+
+        info = dict(info)
+        info["action_repeat"] = n_frames
+        info["overshoot"] = 0
+        info["frozen"] = False
+        return state, reward, terminated, truncated, info
+
+    def _advance(self, move: int, slow: int, n_frames: int, info: dict) -> None:
+        """
+        Keep the action for `n_frames` frames, updating `info`.
+        """
+        speed = _SPEEDS[slow]
+        dx, dy = _DIRECTIONS[move]
+        for _ in range(n_frames):
+            self.frames += 1
+            self.player_position[0] = np.clip(
+                self.player_position[0] + dx * speed, *_X_RANGE
+            )
+            self.player_position[1] = np.clip(
+                self.player_position[1] + dy * speed, *_Y_RANGE
+            )
+            self.boss_position[0] = 120.0 * np.sin(self.frames / 60.0)
+
+            if abs(self.player_position[0] - self.boss_position[0]) < 48.0:
+                damage = min(info["boss_hp"], int(self.np_random.integers(0, 3)))
+                info["boss_hp"] -= damage
+                info["score"] += 10 * damage
+                if info["boss_hp"] == 0:
+                    return
+            if self.np_random.random() < self.hit_rate:
+                info["lives"] -= 1
+                if info["lives"] < 0:
+                    info["lives"] = 0
+                    info["game_state"] = 1
+                    return
+            if self.frames >= self.time_limit:
+                info["game_state"] = 1
+                return
+
+    def _render(self) -> np.ndarray:
+        height, width = self.frame_shape
+        frame = np.zeros(self.frame_shape, dtype=np.uint8)
+        for (x, y), size, value in (
+            (self.boss_position, 32, 128),
+            (self.player_position, 8, 255),
+        ):
+            row = int(y * height / FRAME_HEIGHT)
+            col = int((x + FRAME_WIDTH / 2) * width / FRAME_WIDTH)
+            half = max(1, int(size * height / FRAME_HEIGHT) // 2)
+            frame[max(0, row - half) : row + half, max(0, col - half) : col + half] = (
+                value
+            )
+        return frame
+
+    def _get_state(self) -> dict:
+        state = {
+            "frames": np.stack(
+                self.frame_buffer, axis=0 if self.channels_first else -1
+            ),
+            "player_position": self.player_position.copy(),
+            "boss_position": self.boss_position.copy(),
+        }
+        if self.n_entities > 0:
+            state["entities"] = np.zeros(
+                self.observation_space["entities"].shape, dtype=np.float32
+            )
+        return state
+
+
+# (screen, key) -> (next screen, range of frames before it is entered)
+_MENU_TRANSITIONS = {
+    ("demo", "esc"): ("title", (60, 150)),
+    ("title", "z"): ("stage_select", (15, 35)),
+    ("stage_select", "z"): ("spell_select", (15, 35)),
+    ("spell_select", "z"): ("character_select", (15, 35)),
+    ("character_select", "z"): ("loading", (1, 1)),
+    ("playing", "esc"): ("paused", (2, 6)),
+    ("paused", "r"): ("loading", (1, 1)),
+    ("paused", "q"): ("title", (60, 100)),
+    ("end_of_run", "esc"): ("end_menu", (6, 14)),
+    ("end_menu", "z"): ("loading", (1, 1)),
+}
+# range of frames the menus take to slide in once entered, before they take
+# input, and the screen stays still afterwards
+_MENU_ANIMATIONS = {
+    "title": (10, 25),
+    "stage_select": (5, 15),
+    "spell_select": (5, 15),
+    "character_select": (5, 15),
+    "paused": (6, 16),
+    "end_menu": (4, 8),
+}
+# screens left without input
+_MENU_AUTO_TRANSITIONS = {
+    "loading": ("playing", (30, 120)),
+}
+# game states of the screens, the others keep the last one as the game does
+_MENU_GAME_STATES = {
+    "playing": 2,
+    "dialog": 2,
+    "paused": 0,
+    "end_of_run": 1,
+    "end_menu": 1,
+}
+
+
+class _MenuInput(RecordingBackend):
+    def __init__(self, menus: "SimulatedMenus"):
+        super().__init__()
+        self.menus = menus
+
+    def _send(self, events: list[tuple[str, bool]]) -> None:
+        super()._send(events)
+        for key, pressed in events:
+            self.menus.on_key(key, pressed)
+
+
+class SimulatedMenus:
+    """
+    Toy model of the game screens and their memory fields, for running the
+    menu macros (see `macros.py`) without the game.
+
+    A key pressed on a screen moves to the next one after a random number of
+    frames, and the menus then slide in for a random number of frames. Keys
+    are ignored meanwhile, as the real menus do during their transitions,
+    although `game_state` already reads as paused while the pause menu slides
+    in. The "screen" field changes at every frame, except on the menus once
+    they have slid in. Dialogs last a random number of frames, and go faster
+    while ctrl is held. The keys are sent through `input_backend`, a
+    `RecordingBackend` keeping the batches it receives.
+
+    :param screen: Initial screen, e.g., "demo", "playing", "end_of_run" or
+        "dialog"
+    """
+
+    def __init__(self, screen: str = "demo", seed: int | None = None):
+        self.rng = np.random.default_rng(seed)
+        self.frame = 0
+        # left over from a previous run in the menus
+        self.game_state = 1
+        # (next screen, frame it is entered)
+        self.pending = None
+        # frame from which the current screen takes input
+        self.ready = 0
+        self.held = set()
+        self.dialog_frames = int(self.rng.integers(120, 600))
+        self.input_backend = _MenuInput(self)
+        self._enter(screen)
+
+    def _enter(self, screen: str) -> None:
+        self.screen = screen
+        self.game_state = _MENU_GAME_STATES.get(screen, self.game_state)
+        self.ready = self.frame
+        if screen in _MENU_ANIMATIONS:
+            low, high = _MENU_ANIMATIONS[screen]
+            self.ready += int(self.rng.integers(low, high + 1))
+        if screen in _MENU_AUTO_TRANSITIONS:
+            self._move_to(*_MENU_AUTO_TRANSITIONS[screen])
+
+    def _move_to(self, screen: str, latency: tuple[int, int]) -> None:
+        self.pending = (
+            screen,
+            self.frame + int(self.rng.integers(latency[0], latency[1] + 1)),
+        )
+
+    def on_key(self, key: str, pressed: bool) -> None:
+        if pressed:
+            self.held.add(key)
+        else:
+            self.held.discard(key)
+            return
+        if self.frame < self.ready or self.pending is not None:
+            return
+        if (self.screen, key) in _MENU_TRANSITIONS:
+            self._move_to(*_MENU_TRANSITIONS[(self.screen, key)])
+
+    def clock(self) -> int:
+        return self.frame
+
+    def sleep(self, k: int = 0) -> None:
+        for _ in range(k):
+            self.frame += 1
+            if self.pending is not None and self.frame >= self.pending[1]:
+                screen, self.pending = self.pending[0], None
+                self._enter(screen)
+            if self.screen == "dialog":
+                self.dialog_frames -= 6 if "ctrl" in self.held else 1
+                if self.dialog_frames <= 0:
+                    self._enter("playing")
+
+    def read(self, key: str):
+        if key == "game_state":
+            return self.game_state
+        if key == "in_dialog":
+            return -1 if self.screen == "dialog" else 0
+        if key == "boss_hp":
+            # the boss is only loaded during a run
+            return _BOSS_HP if self.screen in _MENU_GAME_STATES else None
+        if key == "global_timer":
+            return self.frame
+        if key == "screen":
+            still = (
+                self.screen in _MENU_ANIMATIONS
+                and self.pending is None
+                and self.frame >= self.ready
+            )
+            value = sorted(_MENU_ANIMATIONS).index(self.screen) if still else self.frame
+            return np.full((16, 16, 3), 7 * value % 256, dtype=np.uint8)
+        raise ValueError(f"Invalid field key: {key}")
@@ -0,0 +1,93 @@
+"""
+Observation and action spaces of `Touhou14Env`.
+
+They are kept apart from the env so that they can be built without a running
+game, e.g., for benchmarks or for simulated actors.
+"""
+
+import gymnasium as gym
+import numpy as np
+
+from environment.entities import ENTITY_FIELDS
+
+FRAME_WIDTH = 384
+FRAME_HEIGHT = 448
+N_ACTIONS = 10
+
+
+def make_observation_space(
+    n_frame_stack: int = 4,
+    frame_downsize_ratio: float = 1.0,
+    n_entities: int = 0,
+    channels_first: bool = False,
+) -> gym.spaces.Dict:
+    height = int(FRAME_HEIGHT * frame_downsize_ratio)
+    width = int(FRAME_WIDTH * frame_downsize_ratio)
+    spaces = {
+        # channels first frames are used by SB3 as is, instead of being
+        # transposed by `VecTransposeImage` at every step
+        "frames": gym.spaces.Box(
+            low=0,
+            high=255,
+            shape=(
+                (n_frame_stack, height, width)
+                if channels_first
+                else (height, width, n_frame_stack)
+            ),
+            dtype=np.uint8,
+        ),
+        "player_position": gym.spaces.Box(
+            low=np.array((-184.0, 32.0), dtype=np.float32),
+            high=np.array((184.0, 432.0), dtype=np.float32),
+            shape=(2,),
+        ),
+        "boss_position": gym.spaces.Box(
+            low=np.array((-184.0, 32.0), dtype=np.float32),
+            high=np.array((184.0, 432.0), dtype=np.float32),
+            shape=(2,),
+        ),
+    }
+    # optional compact state of the enemies and bullets, see `entities.py`
+    if n_entities > 0:
+        spaces["entities"] = gym.spaces.Box(
+            low=-np.inf,
+            high=np.inf,
+            shape=(n_entities, len(ENTITY_FIELDS)),
+            dtype=np.float32,
+        )
+    return gym.spaces.Dict(spaces)
+
+
+def make_action_space(
+    repeat_choices: tuple[int, ...] | None = None,
+) -> gym.spaces.Discrete:
+    """
+    The 10 combinations of a move (none, left, right, up, down) and of the
+    slow mode, or, with `repeat_choices`, of those and of a number of frames
+    to repeat the action for.
+    """
+    if repeat_choices is None:
+        return gym.spaces.Discrete(N_ACTIONS)
+    return gym.spaces.Discrete(N_ACTIONS * len(repeat_choices))
+
+
+def check_repeat_choices(repeat_choices) -> tuple[int, ...] | None:
+    if repeat_choices is None:
+        return None
+    repeat_choices = tuple(int(n) for n in repeat_choices)
+    if len(repeat_choices) == 0 or min(repeat_choices) < 1:
+        raise ValueError("Repeat choices should be positive numbers of frames")
+    return repeat_choices
+
+
+def decode_action(
+    action: int, action_repeat: int, repeat_choices: tuple[int, ...] | None = None
+) -> tuple[int, int, int]:
+    """
+    Move, slow mode and number of frames of an action of
+    `make_action_space(repeat_choices)`.
+    """
+    action = int(action)
+    base, repeat_index = action % N_ACTIONS, action // N_ACTIONS
+    n_frames = action_repeat if repeat_choices is None else repeat_choices[repeat_index]
+    return base % 5, base // 5, n_frames
@@ -0,0 +1,288 @@
+"""
+Append-only columnar store of per-step telemetry, e.g., the game info of
+every step of a run, readable while it is being written.
+
+A store is a folder holding:
+
+- `schema.json`: the name and dtype of each column, and the rows per segment
+- `count.bin`: the number of rows written, as a memory-mapped int64
+- `<column>.<segment>.bin`: the values of a column, as a memory-mapped array
+  of fixed dtype, split in segments of `segment_rows` rows
+
+`TelemetryStore` writes each row into the memory-mapped segments, then
+increments the count, so that readers in other processes (`TelemetryReader`)
+only ever see whole rows. Segments are created at their full size and never
+resized, which Windows doesn't allow while a reader has them mapped, and the
+values are written to the OS page cache, so that the rows survive a crash of
+the writer.
+
+`TelemetryWrapper` records the `episode` and `step` indices, the wall time,
+the action, the reward, the episode ends and the step info of every step of
+an env.
+"""
+
+import json
+import os
+import time
+
+import gymnasium as gym
+import numpy as np
+
+
+# step info fields of `Touhou14Env` and their dtypes
+INFO_COLUMNS = {
+    "score": np.int64,
+    "lives": np.int32,
+    "life_fragments": np.int32,
+    "bombs": np.int32,
+    "bomb_fragments": np.int32,
+    "power": np.int32,
+    "game_state": np.int32,
+    "in_dialog": np.int32,
+    "boss_hp": np.int32,
+    "action_repeat": np.int32,
+    "overshoot": np.int32,
+    "frozen": np.bool_,
+}
+STEP_COLUMNS = {
+    "episode": np.int32,
+    "step": np.int32,
+    "time": np.float64,
+    "action": np.int32,
+    "reward": np.float32,
+    "terminated": np.bool_,
+    "truncated": np.bool_,
+}
+
+
+def _segment_path(path: str, name: str, segment: int) -> str:
+    return os.path.join(path, f"{name}.{segment:06d}.bin")
+
+
+class TelemetryStore:
+    """
+    Writer of a store, appending to it if it exists.
+
+    :param path: Folder of the store
+    :param columns: Name and dtype of each column, ignored when appending to
+        an existing store
+    :param segment_rows: Rows per segment file
+    """
+
+    def __init__(
+        self,
+        path: str,
+        columns: dict[str, type] | None = None,
+        segment_rows: int = 1 << 16,
+    ):
+        schema_path = os.path.join(path, "schema.json")
+        count_path = os.path.join(path, "count.bin")
+        if os.path.exists(schema_path):
+            with open(schema_path) as f:
+                schema = json.load(f)
+        else:
+            if columns is None:
+                raise ValueError("Columns are required to create a store")
+            if segment_rows < 1:
+                raise ValueError("Rows per segment should be positive")
+            os.makedirs(path, exist_ok=True)
+            schema = {
+                "columns": {
+                    name: np.dtype(dtype).str for name, dtype in columns.items()
+                },
+                "segment_rows": segment_rows,
+            }
+            np.zeros(1, dtype=np.int64).tofile(count_path)
+            # written last, a store without it is incomplete
+            with open(schema_path, "w") as f:
+                json.dump(schema, f)
+        self.path = path
+        self.dtypes = {
+            name: np.dtype(dtype) for name, dtype in schema["columns"].items()
+        }
+        self.segment_rows = schema["segment_rows"]
+        self._count = np.memmap(count_path, dtype=np.int64, mode="r+", shape=(1,))
+        self.count = int(self._count[0])
+        # memory maps of the current segment
+        self._segment = None
+        self._columns = {}
+
+    def _open_segment(self, segment: int) -> None:
+        self._columns = {}
+        for name, dtype in self.dtypes.items():
+            segment_path = _segment_path(self.path, name, segment)
+            mode = "r+" if os.path.exists(segment_path) else "w+"
+            self._columns[name] = np.memmap(
+                segment_path, dtype=dtype, mode=mode, shape=(self.segment_rows,)
+            )
+        self._segment = segment
+
+    def append(self, row: dict) -> None:
+        """
+        Append a row, the missing columns being 0.
+        """
+        segment, i = divmod(self.count, self.segment_rows)
+        if segment != self._segment:
+            self.flush()
+            self._open_segment(segment)
+        for name, column in self._columns.items():
+            column[i] = row.get(name, 0)
+        self.count += 1
+        # published after the values
+        self._count[0] = self.count
+
+    def flush(self) -> None:
+        """
+        Write the mapped pages to disk, which is only needed to survive a
+        crash of the OS.
+        """
+        for column in self._columns.values():
+            column.flush()
+        self._count.flush()
+
+    def close(self) -> None:
+        self.flush()
+        self._columns = {}
+        self._segment = None
+
+
+class TelemetryReader:
+    """
+    Reader of a store, which may still be written.
+
+    Example
+    -------
+    reader = TelemetryReader("telemetry")
+    boss_hp = reader["boss_hp"]
+    starts, stops = reader.episode_bounds()
+    """
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, "schema.json")) as f:
+            schema = json.load(f)
+        self.path = path
+        self.dtypes = {
+            name: np.dtype(dtype) for name, dtype in schema["columns"].items()
+        }
+        self.segment_rows = schema["segment_rows"]
+        self._count = np.memmap(
+            os.path.join(path, "count.bin"), dtype=np.int64, mode="r", shape=(1,)
+        )
+        # (column, segment) -> memory map
+        self._segments = {}
+
+    @property
+    def columns(self) -> list[str]:
+        return list(self.dtypes)
+
+    def __len__(self) -> int:
+        return int(self._count[0])
+
+    def _segment(self, name: str, segment: int) -> np.memmap:
+        key = (name, segment)
+        if key not in self._segments:
+            self._segments[key] = np.memmap(
+                _segment_path(self.path, name, segment),
+                dtype=self.dtypes[name],
+                mode="r",
+                shape=(self.segment_rows,),
+            )
+        return self._segments[key]
+
+    def read(self, name: str, start: int = 0, stop: int | None = None) -> np.ndarray:
+        """
+        Values of a column for the rows [start, stop) written so far. Only the
+        segments of these rows are read.
+        """
+        if name not in self.dtypes:
+            raise ValueError(f"Unknown column {name}, should be one of {self.columns}")
+        count = len(self)
+        start, stop, _ = slice(start, stop).indices(count)
+        if stop <= start:
+            return np.empty(0, dtype=self.dtypes[name])
+        first, last = start // self.segment_rows, (stop - 1) // self.segment_rows
+        if first == last:
+            offset = first * self.segment_rows
+            return np.array(self._segment(name, first)[start - offset : stop - offset])
+        parts = []
+        for segment in range(first, last + 1):
+            offset = segment * self.segment_rows
+            parts.append(
+                self._segment(name, segment)[
+                    max(start - offset, 0) : min(stop - offset, self.segment_rows)
+                ]
+            )
+        return np.concatenate(parts)
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.read(name)
+
+    def read_all(
+        self, names: list[str] | None = None, start: int = 0, stop: int | None = None
+    ) -> dict[str, np.ndarray]:
+        """
+        Columns for the same rows, all the columns by default.
+        """
+        # the same rows for every column, even while rows are being appended
+        start, stop, _ = slice(start, stop).indices(len(self))
+        return {name: self.read(name, start, stop) for name in names or self.columns}
+
+    def episode_bounds(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Row ranges [starts[i], stops[i]) of the episodes, the last one
+        possibly still running.
+        """
+        episodes = self.read("episode")
+        if len(episodes) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        starts = np.flatnonzero(np.diff(episodes, prepend=episodes[0] - 1))
+        stops = np.append(starts[1:], len(episodes))
+        return starts, stops
+
+
+class TelemetryWrapper(gym.Wrapper):
+    """
+    Record every step of the env into a `TelemetryStore`. Wrap the env before
+    any action wrapper, e.g., `DiscretizeActionWrapper`, so that the actions
+    are recorded as the discrete actions of the env.
+
+    When appending to an existing store, the episode indices continue from
+    the last recorded episode.
+
+    :param path: Folder of the store
+    """
+
+    def __init__(self, env: gym.Env, path: str, segment_rows: int = 1 << 16):
+        super().__init__(env)
+        self.store = TelemetryStore(
+            path, {**STEP_COLUMNS, **INFO_COLUMNS}, segment_rows=segment_rows
+        )
+        reader = TelemetryReader(path)
+        self.episode = int(reader.read("episode", -1)[0]) if len(reader) else -1
+        self.episode_step = 0
+
+    def reset(self, **kwargs):
+        self.episode += 1
+        self.episode_step = 0
+        return self.env.reset(**kwargs)
+
+    def step(self, action):
+        obs, reward, terminated, truncated, info = self.env.step(action)
+        self.store.append(
+            {
+                **info,
+                "episode": self.episode,
+                "step": self.episode_step,
+                "time": time.time(),
+                "action": int(np.asarray(action).item()),
+                "reward": reward,
+                "terminated": terminated,
+                "truncated": truncated,
+            }
+        )
+        self.episode_step += 1
+        return obs, reward, terminated, truncated, info
+
+    def close(self):
+        self.store.close()
+        super().close()
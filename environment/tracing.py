@@ -0,0 +1,161 @@
+"""
+Opt-in timeline tracer, exporting Chrome trace JSON which can be opened in
+Perfetto (https://ui.perfetto.dev) or chrome://tracing.
+
+Spans are recorded into a bounded ring buffer, so a long run keeps only its
+latest events. Appending to a `deque` is atomic, so threads record without
+taking a lock. While the tracer is disabled (the default), `span` returns a
+shared no-op context and `traced` functions only check a flag.
+
+Example
+-------
+from environment import tracing
+
+tracing.enable()
+with tracing.span("rollout", "learner"):
+    ...
+tracing.dump("trace.json")
+"""
+
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+_NULL_SPAN = contextlib.nullcontext()
+
+
+class _Span:
+    __slots__ = ("_tracer", "_name", "_category", "_t0")
+
+    def __init__(self, tracer: "Tracer", name: str, category: str):
+        self._tracer = tracer
+        self._name = name
+        self._category = category
+
+    def __enter__(self) -> "_Span":
+        self._t0 = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self._tracer.record(self._name, self._category, self._t0)
+
+
+class Tracer:
+    """
+    Ring buffer of complete spans.
+
+    :param capacity: Maximum number of spans kept
+    """
+
+    def __init__(self, capacity: int = 1 << 18):
+        if capacity < 1:
+            raise ValueError("Capacity should be positive")
+        self.enabled = False
+        self._events = deque(maxlen=capacity)
+        # names of the threads which recorded spans, as they may have exited
+        # by the time of the dump
+        self._thread_names = {}
+
+    def enable(self, capacity: int | None = None) -> None:
+        if capacity is not None and capacity != self._events.maxlen:
+            if capacity < 1:
+                raise ValueError("Capacity should be positive")
+            self._events = deque(self._events, maxlen=capacity)
+        self.enabled = True
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def clear(self) -> None:
+        self._events.clear()
+
+    def span(self, name: str, category: str = "env"):
+        """
+        Context manager recording its duration as a span.
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, category)
+
+    def record(self, name: str, category: str, t0: int, t1: int | None = None) -> None:
+        """
+        Record a span between two `time.perf_counter_ns` timestamps, ending
+        now by default.
+        """
+        if t1 is None:
+            t1 = time.perf_counter_ns()
+        tid = threading.get_ident()
+        if tid not in self._thread_names:
+            self._thread_names[tid] = threading.current_thread().name
+        self._events.append((name, category, t0, t1, tid))
+
+    def to_chrome_trace(self) -> dict:
+        pid = os.getpid()
+        # `copy` is a single atomic operation, unlike iterating over the deque
+        # while other threads append to it
+        events = self._events.copy()
+        trace_events = [
+            {
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": t0 / 1000,
+                "dur": (t1 - t0) / 1000,
+                "pid": pid,
+                "tid": tid,
+            }
+            for name, category, t0, t1, tid in events
+        ]
+        trace_events += [
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": pid,
+                "tid": tid,
+                "args": {"name": thread_name},
+            }
+            for tid, thread_name in self._thread_names.copy().items()
+        ]
+        return {"traceEvents": trace_events, "displayTimeUnit": "ms"}
+
+    def dump(self, path: str) -> None:
+        """
+        Write the recorded spans as Chrome trace JSON.
+        """
+        with open(path, "w") as f:
+            json.dump(self.to_chrome_trace(), f)
+
+
+tracer = Tracer()
+enable = tracer.enable
+disable = tracer.disable
+span = tracer.span
+dump = tracer.dump
+
+
+def traced(category: str = "env", name: str | None = None):
+    """
+    Decorator recording each call of a function as a span of the global
+    tracer.
+    """
+
+    def decorator(fn):
+        span_name = name or fn.__qualname__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return fn(*args, **kwargs)
+            t0 = time.perf_counter_ns()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                tracer.record(span_name, category, t0)
+
+        return wrapper
+
+    return decorator
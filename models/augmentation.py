@@ -0,0 +1,156 @@
+"""
+Image augmentation at replay sample time, i.e., the random shifts of DrQ
+(https://arxiv.org/abs/2004.13649), applied to whole minibatches.
+"""
+
+from typing import Optional, Union
+
+import numpy as np
+import torch as th
+from gymnasium import spaces
+from stable_baselines3.common.buffers import DictReplayBuffer
+from stable_baselines3.common.preprocessing import is_image_space
+from stable_baselines3.common.type_aliases import DictReplayBufferSamples
+from stable_baselines3.common.vec_env import VecNormalize
+
+
+def random_shift(images: th.Tensor, pad: int) -> th.Tensor:
+    """
+    Shift each image of a (B, C, H, W) batch by a random offset of up to `pad`
+    pixels along each axis, the borders being replicated. It is the same as
+    padding the images and randomly cropping them back to (H, W), done with a
+    single gather instead of a loop over the batch.
+    """
+    if pad == 0:
+        return images
+    b, c, h, w = images.shape
+    device = images.device
+    shifts = th.randint(-pad, pad + 1, (b, 2), device=device)
+    # clamping the source pixels replicates the borders
+    rows = (th.arange(h, device=device) + shifts[:, :1]).clamp_(0, h - 1)
+    cols = (th.arange(w, device=device) + shifts[:, 1:]).clamp_(0, w - 1)
+    index = (rows[:, :, None] * w + cols[:, None, :]).view(b, 1, h * w)
+    shifted = th.gather(images.reshape(b, c, h * w), 2, index.expand(b, c, h * w))
+    return shifted.view(b, c, h, w)
+
+
+class AugmentedDictReplayBuffer(DictReplayBuffer):
+    """
+    Dict replay buffer randomly shifting the image observations (the `frames`
+    of `Touhou14Env`) of each sampled minibatch. The observations and next
+    observations are shifted independently.
+
+    :param shift_pad: Maximum shift in pixels, 0 to disable the augmentation
+    """
+
+    def __init__(
+        self,
+        buffer_size: int,
+        observation_space: spaces.Dict,
+        action_space: spaces.Space,
+        device: Union[th.device, str] = "auto",
+        n_envs: int = 1,
+        optimize_memory_usage: bool = False,
+        handle_timeout_termination: bool = True,
+        shift_pad: int = 4,
+    ):
+        super().__init__(
+            buffer_size,
+            observation_space,
+            action_space,
+            device=device,
+            n_envs=n_envs,
+            optimize_memory_usage=optimize_memory_usage,
+            handle_timeout_termination=handle_timeout_termination,
+        )
+        if shift_pad < 0:
+            raise ValueError("Shift padding should be non-negative")
+        self.shift_pad = shift_pad
+        # images are channels first in the buffer, as transposed by SB3
+        self.image_keys = [
+            k
+            for k, space in observation_space.spaces.items()
+            if is_image_space(space, check_channels=False)
+        ]
+
+    def _augment(self, observations: dict[str, th.Tensor]) -> dict[str, th.Tensor]:
+        return {
+            k: random_shift(obs, self.shift_pad) if k in self.image_keys else obs
+            for k, obs in observations.items()
+        }
+
+    def _augment_samples(self, samples):
+        """
+        Shift the images of the (named tuple of) samples.
+        """
+        if self.shift_pad == 0:
+            return samples
+        return samples._replace(
+            observations=self._augment(samples.observations),
+            next_observations=self._augment(samples.next_observations),
+        )
+
+    def add_transitions(
+        self,
+        obs: dict[str, np.ndarray],
+        next_obs: dict[str, np.ndarray],
+        actions: np.ndarray,
+        rewards: np.ndarray,
+        dones: np.ndarray,
+        timeouts: np.ndarray,
+    ) -> None:
+        """
+        Add `n` consecutive transitions of each env, the arrays being
+        `(n, n_envs, ...)`. It is the same as `n` calls of `add` with the
+        `TimeLimit.truncated` infos in `timeouts`, but writes whole slices of
+        the buffer arrays, wrapping around at the end.
+        """
+        n = len(rewards)
+        # only the last transitions are kept when there are more than fit
+        skipped = max(0, n - self.buffer_size)
+        if skipped > 0:
+            self.pos = (self.pos + skipped) % self.buffer_size
+            self.full = True
+        # (buffer array, values, shape of a transition of an env)
+        columns = []
+        for k, shape in self.obs_shape.items():
+            columns.append((self.observations[k], obs[k], shape))
+            columns.append((self.next_observations[k], next_obs[k], shape))
+        columns += [
+            (self.actions, actions, (self.action_dim,)),
+            (self.rewards, rewards, ()),
+            (self.dones, dones, ()),
+        ]
+        if self.handle_timeout_termination:
+            columns.append((self.timeouts, timeouts, ()))
+        n -= skipped
+        first = min(n, self.buffer_size - self.pos)
+        for array, values, shape in columns:
+            values = np.asarray(values)[skipped:].reshape((n, self.n_envs) + shape)
+            array[self.pos : self.pos + first] = values[:first]
+            array[: n - first] = values[first:]
+        self.pos += n
+        if self.pos >= self.buffer_size:
+            self.full = True
+            self.pos -= self.buffer_size
+
+    def sample_indices(self, batch_size: int) -> np.ndarray:
+        """
+        Indices of a minibatch, the part of `sample` reading the buffer
+        state besides the stored transitions.
+        """
+        upper_bound = self.buffer_size if self.full else self.pos
+        return np.random.randint(0, upper_bound, size=batch_size)
+
+    def get_samples(
+        self, batch_inds: np.ndarray, env: Optional[VecNormalize] = None
+    ) -> DictReplayBufferSamples:
+        """
+        Gather the transitions of `sample_indices` and augment them.
+        """
+        return self._augment_samples(self._get_samples(batch_inds, env=env))
+
+    def sample(
+        self, batch_size: int, env: Optional[VecNormalize] = None
+    ) -> DictReplayBufferSamples:
+        return self.get_samples(self.sample_indices(batch_size), env=env)
@@ -0,0 +1,355 @@
+"""
+Training callbacks
+"""
+
+import glob
+import os
+import queue
+import re
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+import numpy as np
+from stable_baselines3.common.buffers import DictReplayBuffer
+from stable_baselines3.common.callbacks import BaseCallback, CheckpointCallback
+
+from environment import tracing
+
+_CHUNK_PATTERN = re.compile(r"chunk_(\d+)\.npz$")
+
+
+def find_latest_checkpoint(save_path: str, name_prefix: str = "model") -> str:
+    """
+    Path of the model checkpoint with the most steps in a save folder.
+    """
+    pattern = re.compile(re.escape(name_prefix) + r"_(\d+)_steps\.zip$")
+    checkpoints = [
+        (int(m.group(1)), path)
+        for path in glob.glob(os.path.join(save_path, f"{name_prefix}_*_steps.zip"))
+        if (m := pattern.search(path))
+    ]
+    if len(checkpoints) == 0:
+        raise FileNotFoundError(f"No checkpoint found in {save_path}")
+    return max(checkpoints)[1]
+
+
+def list_replay_chunks(replay_path: str) -> list[str]:
+    """
+    Replay buffer chunks in a folder, in the order they were written.
+    """
+    chunks = [
+        (int(m.group(1)), path)
+        for path in glob.glob(os.path.join(replay_path, "chunk_*.npz"))
+        if (m := _CHUNK_PATTERN.search(path))
+    ]
+    return [path for _, path in sorted(chunks)]
+
+
+def load_replay_chunks(replay_buffer: DictReplayBuffer, replay_path: str) -> int:
+    """
+    Restore a replay buffer from the chunks written by
+    `ReplayCheckpointCallback`. Return the number of chunks loaded.
+    """
+    chunks = list_replay_chunks(replay_path)
+    for path in chunks:
+        with np.load(path) as chunk:
+            positions = chunk["positions"]
+            for key, obs in replay_buffer.observations.items():
+                obs[positions] = chunk[f"observations.{key}"]
+            for key, obs in replay_buffer.next_observations.items():
+                obs[positions] = chunk[f"next_observations.{key}"]
+            for name in ("actions", "rewards", "dones", "timeouts"):
+                getattr(replay_buffer, name)[positions] = chunk[name]
+            if "priorities" in chunk and hasattr(replay_buffer, "sum_tree"):
+                n_envs = replay_buffer.n_envs
+                leaves = positions[:, None] * n_envs + np.arange(n_envs)
+                replay_buffer.sum_tree.update(
+                    leaves.ravel(), chunk["priorities"].ravel()
+                )
+                replay_buffer.max_priority = float(chunk["max_priority"])
+            replay_buffer.pos = int(chunk["pos"])
+            replay_buffer.full = bool(chunk["full"])
+    return len(chunks)
+
+
+class ReplayCheckpointCallback(CheckpointCallback):
+    """
+    Checkpoint callback which also persists the replay buffer, so that a
+    crashed run can be resumed with `load_replay_chunks`.
+
+    Each time a checkpoint is saved, only the buffer slots added since the
+    previous one are copied, and they are written by a background thread as
+    a new chunk in `<save_path>/replay`. Chunks whose slots have all been
+    overwritten since are deleted.
+
+    The priorities of a prioritized replay buffer are saved along with the
+    slots, so those updated afterwards are restored with their older value.
+
+    Notice that the chunk of the latest model checkpoint may still be in
+    flight when the process dies, in which case the resumed buffer misses the
+    last `save_freq` transitions.
+
+    :param compress: Compress the chunks, which is slower but much smaller for
+        game frames
+    """
+
+    def __init__(
+        self,
+        save_freq: int,
+        save_path: str,
+        name_prefix: str = "model",
+        compress: bool = True,
+        verbose: int = 0,
+    ):
+        super().__init__(save_freq, save_path, name_prefix, verbose=verbose)
+        self.replay_path = os.path.join(save_path, "replay")
+        self.compress = compress
+        self._queue = queue.Queue()
+        self._writer = None
+        # (path, number of slots written to the buffer when it was saved) of
+        # the chunks on disk, only used by the writer thread once started
+        self._chunks = []
+        self._n_chunks = 0
+        self._slots_written = 0
+        self._timesteps_saved = 0
+        # total seconds spent in the training loop saving checkpoints
+        self.save_time = 0.0
+
+    def _init_callback(self) -> None:
+        super()._init_callback()
+        os.makedirs(self.replay_path, exist_ok=True)
+        # continue after the chunks of a resumed run
+        for path in list_replay_chunks(self.replay_path):
+            with np.load(path) as chunk:
+                self._chunks.append((path, int(chunk["slots_written"])))
+        if self._chunks:
+            path, self._slots_written = self._chunks[-1]
+            self._n_chunks = int(_CHUNK_PATTERN.search(path).group(1)) + 1
+        self._timesteps_saved = self.model.num_timesteps
+        self._writer = threading.Thread(
+            target=self._write_chunks, name="replay_writer", daemon=True
+        )
+        self._writer.start()
+
+    def _on_step(self) -> bool:
+        if self.n_calls % self.save_freq == 0:
+            t0 = time.perf_counter()
+            with tracing.span("checkpoint", "learner"):
+                super()._on_step()
+                self._save_replay_chunk()
+            self.save_time += time.perf_counter() - t0
+        return True
+
+    def _on_training_end(self) -> None:
+        self._queue.put(None)
+        self._writer.join()
+
+    def _save_replay_chunk(self) -> None:
+        replay_buffer = self.model.replay_buffer
+        n_envs = replay_buffer.n_envs
+        # callbacks are called before the transition of the current step is
+        # added to the buffer
+        stored_timesteps = self.num_timesteps - n_envs
+        n_new = min(
+            (stored_timesteps - self._timesteps_saved) // n_envs,
+            replay_buffer.buffer_size,
+        )
+        self._timesteps_saved = stored_timesteps
+        if n_new <= 0:
+            return
+        self._slots_written += n_new
+
+        positions = (replay_buffer.pos - n_new + np.arange(n_new)) % (
+            replay_buffer.buffer_size
+        )
+        # copy now, the background thread must not see later overwrites
+        arrays = {
+            "positions": positions,
+            "pos": np.array(replay_buffer.pos),
+            "full": np.array(replay_buffer.full),
+            "slots_written": np.array(self._slots_written),
+        }
+        for key, obs in replay_buffer.observations.items():
+            arrays[f"observations.{key}"] = obs[positions]
+        for key, obs in replay_buffer.next_observations.items():
+            arrays[f"next_observations.{key}"] = obs[positions]
+        for name in ("actions", "rewards", "dones", "timeouts"):
+            arrays[name] = getattr(replay_buffer, name)[positions]
+        if hasattr(replay_buffer, "sum_tree"):
+            leaves = positions[:, None] * n_envs + np.arange(n_envs)
+            arrays["priorities"] = replay_buffer.sum_tree[leaves]
+            arrays["max_priority"] = np.array(replay_buffer.max_priority)
+
+        path = os.path.join(self.replay_path, f"chunk_{self._n_chunks:06d}.npz")
+        self._n_chunks += 1
+        self._queue.put((path, self._slots_written, arrays))
+
+    def _write_chunks(self) -> None:
+        while (item := self._queue.get()) is not None:
+            path, slots_written, arrays = item
+            # write to a temporary file first so that a partially written
+            # chunk is never loaded
+            tmp_path = path[: -len(".npz")] + ".tmp.npz"
+            with tracing.span("write_replay_chunk", "io"):
+                if self.compress:
+                    np.savez_compressed(tmp_path, **arrays)
+                else:
+                    np.savez(tmp_path, **arrays)
+                os.replace(tmp_path, path)
+            if self.verbose >= 2:
+                print(f"Saving replay buffer chunk to {path}")
+            self._chunks.append((path, slots_written))
+            self._prune_chunks(slots_written)
+
+    def _prune_chunks(self, slots_written: int) -> None:
+        """
+        Delete the chunks whose slots have all been overwritten since.
+        """
+        buffer_size = self.model.replay_buffer.buffer_size
+        while self._chunks and self._chunks[0][1] + buffer_size <= slots_written:
+            os.remove(self._chunks.pop(0)[0])
+
+
+class ThroughputCallback(BaseCallback):
+    """
+    Log how the wall time of the training loop splits between collecting
+    rollouts, gradient updates, target network syncs and checkpoint saves,
+    along with the effective env steps and game frames per second.
+
+    A cycle spans a rollout and the training that follows it. The logged
+    values (under `throughput/`) are averaged over the last `window_size`
+    cycles. The learner is flagged as the bottleneck (`learner_bound`) when
+    it takes more time than collecting the rollouts, since it then stalls
+    the game.
+
+    The rollout and train phases are also recorded as spans when
+    `environment.tracing` is enabled.
+
+    :param window_size: Number of cycles of the sliding window
+    :param frames_per_step: Game frames per env step (the `action_repeat` of
+        the env), to compare the throughput with the game's 60 fps. The
+        frames reported as `action_repeat` in the step infos are counted
+        instead when there are any, e.g., with the `repeat_choices` of the env
+    :param checkpoint_callback: `ReplayCheckpointCallback` whose save time is
+        reported separately from the rollouts
+    """
+
+    GAME_FPS = 60
+
+    def __init__(
+        self,
+        window_size: int = 100,
+        frames_per_step: Optional[int] = None,
+        checkpoint_callback: Optional[ReplayCheckpointCallback] = None,
+        verbose: int = 0,
+    ):
+        super().__init__(verbose)
+        self.window_size = window_size
+        self.frames_per_step = frames_per_step
+        self.checkpoint_callback = checkpoint_callback
+        # (timesteps, gradient steps, rollout, train, target sync, checkpoint,
+        # game frames) of each cycle, with the times in seconds
+        self._cycles = deque(maxlen=window_size)
+        self._cycle_start = None
+        self._rollout_end = None
+        self.learner_bound = False
+
+    def _target_sync_time(self) -> float:
+        # only the DQN of `models/dqn.py` times its target syncs, TD3/DDPG
+        # sync theirs during training
+        return getattr(self.model, "target_sync_time", 0.0)
+
+    def _checkpoint_time(self) -> float:
+        if self.checkpoint_callback is None:
+            return 0.0
+        return self.checkpoint_callback.save_time
+
+    def _on_rollout_start(self) -> None:
+        now = time.perf_counter()
+        if self._cycle_start is not None:
+            self._end_cycle(now)
+        self._cycle_start = now
+        self._rollout_end = None
+        self._cycle_timesteps = self.num_timesteps
+        self._cycle_updates = self.model._n_updates
+        self._cycle_checkpoint_time = self._checkpoint_time()
+        self._cycle_target_sync_time = self._target_sync_time()
+        self._cycle_frames = 0
+
+    def _on_rollout_end(self) -> None:
+        self._rollout_end = time.perf_counter()
+
+    def _on_step(self) -> bool:
+        for info in self.locals.get("infos", ()):
+            self._cycle_frames += info.get("action_repeat", 0)
+        return True
+
+    def _on_training_end(self) -> None:
+        if self._cycle_start is not None:
+            self._end_cycle(time.perf_counter())
+            self._cycle_start = None
+
+    def _end_cycle(self, now: float) -> None:
+        rollout_end = now if self._rollout_end is None else self._rollout_end
+        if tracing.tracer.enabled:
+            # same clock as `time.perf_counter_ns`
+            tracing.tracer.record(
+                "rollout",
+                "learner",
+                int(self._cycle_start * 1e9),
+                int(rollout_end * 1e9),
+            )
+            tracing.tracer.record(
+                "train", "learner", int(rollout_end * 1e9), int(now * 1e9)
+            )
+        checkpoint = self._checkpoint_time() - self._cycle_checkpoint_time
+        target_sync = self._target_sync_time() - self._cycle_target_sync_time
+        self._cycles.append(
+            (
+                self.num_timesteps - self._cycle_timesteps,
+                self.model._n_updates - self._cycle_updates,
+                rollout_end - self._cycle_start - checkpoint - target_sync,
+                now - rollout_end,
+                target_sync,
+                checkpoint,
+                self._cycle_frames,
+            )
+        )
+        self._record()
+
+    def _record(self) -> None:
+        timesteps, updates, rollout, train, target_sync, checkpoint, frames = np.sum(
+            self._cycles, axis=0
+        )
+        wall = rollout + train + target_sync + checkpoint
+        if wall <= 0:
+            return
+        steps_per_s = timesteps / wall
+        self.logger.record("throughput/env_steps_per_s", steps_per_s)
+        if rollout > 0:
+            self.logger.record("throughput/rollout_steps_per_s", timesteps / rollout)
+        self.logger.record("throughput/gradient_steps_per_s", updates / wall)
+        if frames == 0 and self.frames_per_step is not None:
+            frames = timesteps * self.frames_per_step
+        if frames > 0:
+            game_fps = frames / wall
+            self.logger.record("throughput/frames_per_step", frames / max(1, timesteps))
+            self.logger.record("throughput/game_fps", game_fps)
+            self.logger.record("throughput/game_fps_ratio", game_fps / self.GAME_FPS)
+        self.logger.record("throughput/rollout_frac", rollout / wall)
+        self.logger.record("throughput/train_frac", train / wall)
+        self.logger.record("throughput/target_sync_frac", target_sync / wall)
+        self.logger.record("throughput/checkpoint_frac", checkpoint / wall)
+
+        learner_bound = train > rollout
+        self.logger.record("throughput/learner_bound", int(learner_bound))
+        if learner_bound != self.learner_bound and self.verbose >= 1:
+            print(
+                f"Step {self.num_timesteps}: the "
+                f"{'learner' if learner_bound else 'env'} is now the bottleneck "
+                f"({train / wall:.0%} of the time training, "
+                f"{rollout / wall:.0%} collecting rollouts)"
+            )
+        self.learner_bound = learner_bound
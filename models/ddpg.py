@@ -117,6 +117,12 @@ class DDPG(TD3):
         if _init_setup_model:
             self._setup_model()
 
+    def train(self, gradient_steps: int, batch_size: int = 100) -> None:
+        if hasattr(self.replay_buffer, "expect"):
+            # see `models/prefetch.py`
+            self.replay_buffer.expect(gradient_steps)
+        super().train(gradient_steps, batch_size)
+
     def learn(
         self: SelfDDPG,
         total_timesteps: int,
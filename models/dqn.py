@@ -0,0 +1,113 @@
+"""
+Add prioritized experience replay support to the DQN class
+"""
+
+import time
+
+import numpy as np
+import torch as th
+from torch.nn import functional as F
+
+from stable_baselines3.dqn.dqn import DQN as _DQN
+
+
+class DQN(_DQN):
+    """
+    Deep Q-Network (DQN) which also works with prioritized replay buffers.
+
+    When the replay buffer returns importance-sampling weights (see
+    `models/prioritized_replay.py`), the Huber loss of each sample is weighted
+    accordingly, and the absolute TD errors are fed back to the buffer as new
+    priorities. When it returns the discounts of n-step transitions (see
+    `models/n_step.py`), they replace `gamma` in the TD targets. Otherwise, it
+    trains exactly like SB3's DQN.
+
+    It also keeps the total time spent syncing the target network in
+    `target_sync_time`, for `ThroughputCallback`.
+
+    Takes the same parameters as SB3's DQN.
+    """
+
+    target_sync_time = 0.0
+
+    def _setup_model(self) -> None:
+        super()._setup_model()
+        if hasattr(self.replay_buffer, "n_steps"):
+            # the n-step returns are discounted by the buffer
+            self.replay_buffer.gamma = self.gamma
+
+    def _on_step(self) -> None:
+        # the target network is synced here
+        t0 = time.perf_counter()
+        super()._on_step()
+        self.target_sync_time += time.perf_counter() - t0
+
+    def train(self, gradient_steps: int, batch_size: int = 100) -> None:
+        # Switch to train mode (this affects batch norm / dropout)
+        self.policy.set_training_mode(True)
+        # Update learning rate according to schedule
+        self._update_learning_rate(self.policy.optimizer)
+        if hasattr(self.replay_buffer, "anneal_beta"):
+            self.replay_buffer.anneal_beta(1.0 - self._current_progress_remaining)
+        if hasattr(self.replay_buffer, "expect"):
+            # see `models/prefetch.py`
+            self.replay_buffer.expect(gradient_steps)
+
+        losses = []
+        for _ in range(gradient_steps):
+            # Sample replay buffer
+            replay_data = self.replay_buffer.sample(
+                batch_size, env=self._vec_normalize_env
+            )
+            weights = getattr(replay_data, "weights", None)
+            discounts = getattr(replay_data, "discounts", None)
+            if discounts is None:
+                discounts = self.gamma
+
+            with th.no_grad():
+                # Compute the next Q-values using the target network
+                next_q_values = self.q_net_target(replay_data.next_observations)
+                # Follow greedy policy: use the one with the highest value
+                next_q_values, _ = next_q_values.max(dim=1)
+                # Avoid potential broadcast issue
+                next_q_values = next_q_values.reshape(-1, 1)
+                # 1-step or n-step TD target
+                target_q_values = (
+                    replay_data.rewards
+                    + (1 - replay_data.dones) * discounts * next_q_values
+                )
+
+            # Get current Q-values estimates
+            current_q_values = self.q_net(replay_data.observations)
+
+            # Retrieve the q-values for the actions from the replay buffer
+            current_q_values = th.gather(
+                current_q_values, dim=1, index=replay_data.actions.long()
+            )
+
+            # Compute Huber loss (less sensitive to outliers)
+            if weights is None:
+                loss = F.smooth_l1_loss(current_q_values, target_q_values)
+            else:
+                elementwise_loss = F.smooth_l1_loss(
+                    current_q_values, target_q_values, reduction="none"
+                )
+                loss = (weights * elementwise_loss).mean()
+                td_errors = (current_q_values - target_q_values).detach()
+                self.replay_buffer.update_priorities(
+                    replay_data.indices, td_errors.cpu().numpy().flatten()
+                )
+            losses.append(loss.item())
+
+            # Optimize the policy
+            self.policy.optimizer.zero_grad()
+            loss.backward()
+            # Clip gradient norm
+            th.nn.utils.clip_grad_norm_(self.policy.parameters(), self.max_grad_norm)
+            self.policy.optimizer.step()
+
+        # Increase update counter
+        self._n_updates += gradient_steps
+
+        self.logger.record("train/n_updates", self._n_updates, exclude="tensorboard")
+        self.logger.record("train/loss", np.mean(losses))
@@ -0,0 +1,103 @@
+import gymnasium as gym
+import numpy as np
+import torch
+import torch.nn as nn
+from stable_baselines3.common.preprocessing import is_image_space
+from stable_baselines3.common.torch_layers import BaseFeaturesExtractor
+from stable_baselines3.common.type_aliases import TensorDict
+
+
+class TouhouExtractor(BaseFeaturesExtractor):
+    """
+    Features extractor for the Dict observation of `Touhou14Env`, as a cheaper
+    alternative to SB3's `CombinedExtractor`.
+
+    The frames go through a CNN whose first layer already downsamples them 8
+    times along each axis (4 times in NatureCNN), and which ends with a small
+    fixed-size pooled grid, so that neither the early activations nor the
+    first linear layer scale with the full frame size. It runs in
+    channels_last memory format, which is faster for convolutions on CPU. The other (vector) entries are concatenated, embedded
+    by a small MLP and fused with the image features at the end.
+
+    Vector entries with finite bounds (positions) are rescaled to [-1, 1].
+
+    Works with both the DQN (incl. dueling) and the DDPG policies through
+    `policy_kwargs=dict(features_extractor_class=TouhouExtractor)`.
+    """
+
+    def __init__(
+        self,
+        observation_space: gym.spaces.Dict,
+        features_dim: int = 256,
+        cnn_output_dim: int = 256,
+        vector_output_dim: int = 64,
+        pooled_size: tuple[int, int] = (6, 6),
+        normalized_image: bool = False,
+    ):
+        super().__init__(observation_space, features_dim)
+        image_keys = [
+            k
+            for k, space in observation_space.spaces.items()
+            if is_image_space(space, normalized_image=normalized_image)
+        ]
+        if len(image_keys) != 1:
+            raise ValueError("The observation space should contain exactly 1 image")
+        self.image_key = image_keys[0]
+        self.vector_keys = [k for k in observation_space.spaces if k != self.image_key]
+
+        # SB3 hands over the images channels first
+        n_channels = observation_space[self.image_key].shape[0]
+        self.cnn = nn.Sequential(
+            # non-overlapping 8x8 patches: every pixel is seen, but the first
+            # activations are 64 times smaller than the frames
+            nn.Conv2d(n_channels, 32, kernel_size=8, stride=8),
+            nn.ReLU(),
+            # padded so that downsized frames still fit
+            nn.Conv2d(32, 64, kernel_size=3, stride=2, padding=1),
+            nn.ReLU(),
+            nn.Conv2d(64, 64, kernel_size=3, stride=2, padding=1),
+            nn.ReLU(),
+            nn.AdaptiveAvgPool2d(pooled_size),
+            nn.Flatten(),
+            nn.Linear(64 * pooled_size[0] * pooled_size[1], cnn_output_dim),
+            nn.ReLU(),
+        ).to(memory_format=torch.channels_last)
+
+        lows, highs = [], []
+        for k in self.vector_keys:
+            space = observation_space[k]
+            lows.append(np.broadcast_to(space.low, space.shape).ravel())
+            highs.append(np.broadcast_to(space.high, space.shape).ravel())
+        low = np.concatenate(lows) if lows else np.zeros(0)
+        high = np.concatenate(highs) if highs else np.zeros(0)
+        finite = np.isfinite(low) & np.isfinite(high) & (high > low)
+        scale = np.where(finite, 2.0 / np.where(finite, high - low, 1.0), 1.0)
+        shift = np.where(finite, -1.0 - low * scale, 0.0)
+        self.register_buffer("vector_scale", torch.as_tensor(scale).float())
+        self.register_buffer("vector_shift", torch.as_tensor(shift).float())
+
+        if len(low) > 0:
+            self.vector_net = nn.Sequential(
+                nn.Linear(len(low), vector_output_dim), nn.ReLU()
+            )
+        else:
+            self.vector_net = None
+            vector_output_dim = 0
+
+        self.fusion = nn.Sequential(
+            nn.Linear(cnn_output_dim + vector_output_dim, features_dim), nn.ReLU()
+        )
+
+    def forward(self, observations: TensorDict) -> torch.Tensor:
+        images = observations[self.image_key].contiguous(
+            memory_format=torch.channels_last
+        )
+        features = self.cnn(images)
+        if self.vector_net is not None:
+            vectors = torch.cat(
+                [observations[k].flatten(start_dim=1) for k in self.vector_keys],
+                dim=1,
+            )
+            vectors = vectors * self.vector_scale + self.vector_shift
+            features = torch.cat((features, self.vector_net(vectors)), dim=1)
+        return self.fusion(features)
@@ -0,0 +1,503 @@
+"""
+Learner server for actors running the game on other machines.
+
+Actors step their own env with the latest policy weights they got from the
+server, and send their transitions in batches over TCP. The server adds them
+to the replay buffer of its model, trains it at the same replay ratio as a
+local run (`train_freq`, `gradient_steps`), and publishes new versions of the
+weights for the actors to fetch.
+
+Protocol
+--------
+Each message is a `<BI` header (message type, payload length) followed by the
+payload. An actor sends:
+
+- `TRANSITIONS`: a batch encoded by `encode_batch`, answered with `ACK`, an
+  8-byte version of the latest weights. The server only answers once the
+  batch has been queued for the learner, and the actor waits for the answer
+  before sending its next batch, so a learner falling behind slows the
+  actors down instead of piling up batches (backpressure).
+- `GET_WEIGHTS`: answered with `WEIGHTS`, the version and the exploration
+  rate (`<Qd`), followed by the `torch.save`d policy state dict. Actors load
+  it with `weights_only`, so that a payload holding anything else than
+  tensors is refused instead of running code on the actor.
+
+A batch holds the columns of consecutive transitions: observations, actions,
+rewards, dones and timeouts, plus the next observations of the transitions
+whose next observation isn't the observation of the following one, i.e., at
+episode ends and for the last transition. It is compressed with zlib.
+"""
+
+import io
+import json
+import os
+import queue
+import socket
+import struct
+import threading
+import time
+import zlib
+from typing import Any, Optional
+
+import gymnasium as gym
+import numpy as np
+import torch as th
+from stable_baselines3.common.base_class import BaseAlgorithm
+from stable_baselines3.common.vec_env import VecTransposeImage
+
+from environment import tracing
+
+_HEADER = struct.Struct("<BI")
+_VERSION = struct.Struct("<Q")
+_WEIGHTS_HEADER = struct.Struct("<Qd")
+_META_LENGTH = struct.Struct("<I")
+
+TRANSITIONS = 1
+ACK = 2
+GET_WEIGHTS = 3
+WEIGHTS = 4
+
+
+def parse_address(address: str) -> tuple[str, int]:
+    """
+    Parse a "host:port" address.
+    """
+    host, _, port = address.rpartition(":")
+    if not host or not port.isdigit():
+        raise ValueError(f"Invalid address {address}, should be host:port")
+    return host, int(port)
+
+
+def _recv_exactly(sock: socket.socket, n: int) -> bytes:
+    data = bytearray(n)
+    view = memoryview(data)
+    received = 0
+    while received < n:
+        k = sock.recv_into(view[received:])
+        if k == 0:
+            raise ConnectionError("Connection closed")
+        received += k
+    return bytes(data)
+
+
+def send_message(sock: socket.socket, message_type: int, payload: bytes = b"") -> None:
+    sock.sendall(_HEADER.pack(message_type, len(payload)) + payload)
+
+
+def recv_message(sock: socket.socket) -> tuple[int, bytes]:
+    message_type, length = _HEADER.unpack(_recv_exactly(sock, _HEADER.size))
+    return message_type, _recv_exactly(sock, length)
+
+
+def encode_batch(columns: dict[str, np.ndarray], level: int = 1) -> bytes:
+    """
+    Serialize named arrays, each of them stored contiguously, and compress
+    them.
+    """
+    arrays = [np.ascontiguousarray(a) for a in columns.values()]
+    meta = json.dumps(
+        [(name, a.dtype.str, a.shape) for name, a in zip(columns, arrays)]
+    ).encode()
+    raw = b"".join([_META_LENGTH.pack(len(meta)), meta] + [a.data for a in arrays])
+    return zlib.compress(raw, level)
+
+
+def decode_batch(data: bytes) -> dict[str, np.ndarray]:
+    raw = zlib.decompress(data)
+    (meta_length,) = _META_LENGTH.unpack_from(raw)
+    offset = _META_LENGTH.size + meta_length
+    columns = {}
+    for name, dtype, shape in json.loads(raw[_META_LENGTH.size : offset]):
+        dtype = np.dtype(dtype)
+        n = int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+        columns[name] = np.frombuffer(
+            raw, dtype, offset=offset, count=n // dtype.itemsize
+        )
+        columns[name] = columns[name].reshape(shape)
+        offset += n
+    return columns
+
+
+def make_batch(transitions: list[tuple]) -> dict[str, np.ndarray]:
+    """
+    Columns of a list of consecutive (obs, action, reward, next_obs,
+    terminated, truncated) transitions, see the module docstring.
+    """
+    n = len(transitions)
+    next_rows = [
+        i
+        for i, (_, _, _, _, terminated, truncated) in enumerate(transitions)
+        if terminated or truncated or i == n - 1
+    ]
+    columns = {}
+    for k in transitions[0][0]:
+        columns[f"obs.{k}"] = np.stack([t[0][k] for t in transitions])
+        columns[f"next.{k}"] = np.stack([transitions[i][3][k] for i in next_rows])
+    columns["next_rows"] = np.array(next_rows, dtype=np.int32)
+    columns["actions"] = np.array([t[1] for t in transitions])
+    columns["rewards"] = np.array([t[2] for t in transitions], dtype=np.float32)
+    columns["dones"] = np.array([t[4] or t[5] for t in transitions], dtype=bool)
+    # truncated but not terminated, i.e., to be bootstrapped
+    columns["timeouts"] = np.array([t[5] and not t[4] for t in transitions], dtype=bool)
+    return columns
+
+
+def split_batch(columns: dict[str, np.ndarray]) -> tuple[dict, dict]:
+    """
+    Observations and next observations of a batch made by `make_batch`.
+    """
+    keys = [name[4:] for name in columns if name.startswith("obs.")]
+    observations = {k: columns[f"obs.{k}"] for k in keys}
+    next_observations = {}
+    for k in keys:
+        next_obs = np.empty_like(observations[k])
+        next_obs[:-1] = observations[k][1:]
+        next_obs[columns["next_rows"]] = columns[f"next.{k}"]
+        next_observations[k] = next_obs
+    return observations, next_observations
+
+
+class LearnerServer:
+    """
+    Accepts actor connections, each served by its own thread, which decodes
+    the batches and queues them for the learner (`get_batch`), and serves the
+    weights published by the learner (`publish_weights`).
+
+    :param model: Model whose policy weights are served
+    :param max_pending_batches: Maximum number of batches waiting for the
+        learner, beyond which the actors are slowed down
+    """
+
+    def __init__(
+        self,
+        model: BaseAlgorithm,
+        host: str = "0.0.0.0",
+        port: int = 5555,
+        max_pending_batches: int = 16,
+    ):
+        self.model = model
+        self.host = host
+        self.port = port
+        self._batches = queue.Queue(maxsize=max_pending_batches)
+        self._weights_lock = threading.Lock()
+        self._weights = None
+        self.version = 0
+        self._closed = threading.Event()
+        self._socket = None
+        self._threads = []
+        # statistics, updated by the connection threads
+        self._stats_lock = threading.Lock()
+        self.n_actors = 0
+        self.compressed_bytes = 0
+        self.raw_bytes = 0
+
+    def start(self) -> None:
+        self._socket = socket.create_server((self.host, self.port))
+        # the actual port when binding to port 0
+        self.port = self._socket.getsockname()[1]
+        self.publish_weights()
+        thread = threading.Thread(
+            target=self._accept, name="learner_server", daemon=True
+        )
+        thread.start()
+        self._threads.append(thread)
+
+    def publish_weights(self) -> None:
+        """
+        Serialize the current policy weights as a new version.
+        """
+        buffer = io.BytesIO()
+        th.save({k: v.cpu() for k, v in self.model.policy.state_dict().items()}, buffer)
+        with self._weights_lock:
+            self.version += 1
+            self._weights = (
+                _WEIGHTS_HEADER.pack(self.version, float(self.model.exploration_rate))
+                + buffer.getvalue()
+            )
+
+    def get_batch(self, timeout: Optional[float] = None) -> dict | None:
+        try:
+            return self._batches.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def _accept(self) -> None:
+        while not self._closed.is_set():
+            try:
+                conn, address = self._socket.accept()
+            except OSError:
+                return
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            thread = threading.Thread(
+                target=self._serve,
+                args=(conn, address),
+                name=f"actor_{address[0]}:{address[1]}",
+                daemon=True,
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def _serve(self, conn: socket.socket, address) -> None:
+        with self._stats_lock:
+            self.n_actors += 1
+        print(f"\033[96mActor connected from {address[0]}:{address[1]}\033[0m")
+        try:
+            with conn:
+                while not self._closed.is_set():
+                    message_type, payload = recv_message(conn)
+                    if message_type == TRANSITIONS:
+                        with tracing.span("receive_batch", "server"):
+                            columns = decode_batch(payload)
+                        with self._stats_lock:
+                            self.compressed_bytes += len(payload)
+                            self.raw_bytes += sum(a.nbytes for a in columns.values())
+                        # blocks while the learner is behind
+                        while not self._closed.is_set():
+                            try:
+                                self._batches.put(columns, timeout=1.0)
+                                break
+                            except queue.Full:
+                                continue
+                        with self._weights_lock:
+                            version = self.version
+                        send_message(conn, ACK, _VERSION.pack(version))
+                    elif message_type == GET_WEIGHTS:
+                        with self._weights_lock:
+                            weights = self._weights
+                        send_message(conn, WEIGHTS, weights)
+                    else:
+                        raise ValueError(f"Invalid message type: {message_type}")
+        except (ConnectionError, OSError, ValueError) as e:
+            print(f"\033[93mActor {address[0]}:{address[1]} disconnected: {e}\033[0m")
+        finally:
+            with self._stats_lock:
+                self.n_actors -= 1
+
+    def close(self) -> None:
+        self._closed.set()
+        if self._socket is not None:
+            try:
+                # closing alone doesn't wake up a pending accept on Linux
+                self._socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._socket.close()
+
+
+def _add_batch(model: BaseAlgorithm, columns: dict[str, np.ndarray]) -> int:
+    """
+    Add the transitions of a batch to the replay buffer of the model, and
+    return their number.
+    """
+    observations, next_observations = split_batch(columns)
+    env = model.get_env()
+    if isinstance(env, VecTransposeImage):
+        # channels last images are stored transposed, as SB3 does
+        observations = env.transpose_observations(observations)
+        next_observations = env.transpose_observations(next_observations)
+    n = len(columns["actions"])
+    replay_buffer = model.replay_buffer
+    if hasattr(replay_buffer, "add_transitions"):
+        # the buffers of `models` write the whole batch at once
+        replay_buffer.add_transitions(
+            {k: obs[:, None] for k, obs in observations.items()},
+            {k: obs[:, None] for k, obs in next_observations.items()},
+            columns["actions"][:, None],
+            columns["rewards"][:, None],
+            columns["dones"][:, None],
+            columns["timeouts"][:, None],
+        )
+        return n
+    for i in range(n):
+        replay_buffer.add(
+            {k: obs[i : i + 1] for k, obs in observations.items()},
+            {k: obs[i : i + 1] for k, obs in next_observations.items()},
+            columns["actions"][i : i + 1],
+            columns["rewards"][i : i + 1],
+            columns["dones"][i : i + 1],
+            [{"TimeLimit.truncated": bool(columns["timeouts"][i])}],
+        )
+    return n
+
+
+def run_learner(
+    model: BaseAlgorithm,
+    server: LearnerServer,
+    total_timesteps: int,
+    save_path: Optional[str] = None,
+    save_freq: int = 0,
+    publish_interval: int = 100,
+    log_interval: float = 30.0,
+) -> None:
+    """
+    Train the model on the transitions received by the server until
+    `total_timesteps` transitions have been received.
+
+    :param save_freq: Save a `model_<steps>_steps.zip` checkpoint to
+        `save_path` every `save_freq` transitions, 0 to disable
+    :param publish_interval: Publish the weights every this many gradient
+        steps
+    :param log_interval: Seconds between the logs
+    """
+    freq = model.train_freq.frequency
+    steps_since_train = 0
+    gradient_steps_since_publish = 0
+    n_gradient_steps = 0
+    last_save = model.num_timesteps
+    last_log, last_log_steps, last_log_gradient_steps = time.perf_counter(), 0, 0
+    while model.num_timesteps < total_timesteps:
+        columns = server.get_batch(timeout=1.0)
+        if columns is None:
+            continue
+        with tracing.span("add_batch", "learner"):
+            n = _add_batch(model, columns)
+        for _ in range(n):
+            model.num_timesteps += 1
+            model._update_current_progress_remaining(
+                model.num_timesteps, total_timesteps
+            )
+            # exploration schedule and target network sync
+            model._on_step()
+        steps_since_train += n
+
+        # the same replay ratio as `learn`
+        while steps_since_train >= freq:
+            steps_since_train -= freq
+            if model.num_timesteps <= model.learning_starts:
+                continue
+            gradient_steps = model.gradient_steps if model.gradient_steps >= 0 else freq
+            with tracing.span("train", "learner"):
+                model.train(gradient_steps, model.batch_size)
+            n_gradient_steps += gradient_steps
+            gradient_steps_since_publish += gradient_steps
+        if gradient_steps_since_publish >= publish_interval:
+            gradient_steps_since_publish = 0
+            with tracing.span("publish_weights", "learner"):
+                server.publish_weights()
+
+        if save_freq > 0 and model.num_timesteps - last_save >= save_freq:
+            last_save = model.num_timesteps
+            model.save(
+                os.path.join(save_path, f"model_{model.num_timesteps}_steps.zip")
+            )
+
+        now = time.perf_counter()
+        if now - last_log >= log_interval:
+            elapsed = now - last_log
+            model.logger.record("server/actors", server.n_actors)
+            model.logger.record(
+                "server/transitions_per_s",
+                (model.num_timesteps - last_log_steps) / elapsed,
+            )
+            model.logger.record(
+                "server/gradient_steps_per_s",
+                (n_gradient_steps - last_log_gradient_steps) / elapsed,
+            )
+            model.logger.record("server/pending_batches", server._batches.qsize())
+            model.logger.record(
+                "server/compression_ratio",
+                server.raw_bytes / max(1, server.compressed_bytes),
+            )
+            model.logger.record("server/weights_version", server.version)
+            model.logger.dump(model.num_timesteps)
+            last_log = now
+            last_log_steps = model.num_timesteps
+            last_log_gradient_steps = n_gradient_steps
+
+
+class ActorClient:
+    """
+    Connection of an actor to a `LearnerServer`.
+    """
+
+    def __init__(self, address: str, connect_timeout: float = 60.0):
+        host, port = parse_address(address)
+        deadline = time.monotonic() + connect_timeout
+        while True:
+            try:
+                self.sock = socket.create_connection((host, port), timeout=10.0)
+                break
+            except OSError:
+                # the server may not be up yet
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(1.0)
+        self.sock.settimeout(None)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def send_transitions(self, transitions: list[tuple]) -> int:
+        """
+        Send a batch of transitions and return the latest weights version.
+        """
+        send_message(self.sock, TRANSITIONS, encode_batch(make_batch(transitions)))
+        message_type, payload = recv_message(self.sock)
+        if message_type != ACK:
+            raise ConnectionError(f"Unexpected message type: {message_type}")
+        return _VERSION.unpack(payload)[0]
+
+    def get_weights(self) -> tuple[int, float, dict[str, Any]]:
+        """
+        Latest (version, exploration rate, policy state dict).
+        """
+        send_message(self.sock, GET_WEIGHTS)
+        message_type, payload = recv_message(self.sock)
+        if message_type != WEIGHTS:
+            raise ConnectionError(f"Unexpected message type: {message_type}")
+        version, exploration_rate = _WEIGHTS_HEADER.unpack_from(payload)
+        # the payload comes from the network, only tensors may be unpickled
+        state_dict = th.load(
+            io.BytesIO(payload[_WEIGHTS_HEADER.size :]),
+            map_location="cpu",
+            weights_only=True,
+        )
+        return version, exploration_rate, state_dict
+
+    def close(self) -> None:
+        self.sock.close()
+
+
+def run_actor(
+    env: gym.Env,
+    model: BaseAlgorithm,
+    address: str,
+    batch_size: int = 64,
+    stop: Optional[threading.Event] = None,
+) -> int:
+    """
+    Step the env with the policy of the model, kept in sync with the server,
+    and send the transitions until the server goes away or `stop` is set.
+    Return the number of steps.
+
+    :param batch_size: Transitions per batch sent to the server
+    """
+    client = ActorClient(address)
+    n_steps = 0
+    try:
+        version, model.exploration_rate, state_dict = client.get_weights()
+        model.policy.load_state_dict(state_dict)
+        transitions = []
+        obs, _ = env.reset()
+        while stop is None or not stop.is_set():
+            # epsilon greedy with the exploration rate of the server
+            action, _ = model.predict(obs, deterministic=False)
+            next_obs, reward, terminated, truncated, _ = env.step(action)
+            transitions.append(
+                (obs, int(action), float(reward), next_obs, terminated, truncated)
+            )
+            n_steps += 1
+            obs = env.reset()[0] if terminated or truncated else next_obs
+            if len(transitions) >= batch_size:
+                with tracing.span("send_batch", "actor"):
+                    latest = client.send_transitions(transitions)
+                transitions = []
+                if latest > version:
+                    with tracing.span("get_weights", "actor"):
+                        version, model.exploration_rate, state_dict = (
+                            client.get_weights()
+                        )
+                    model.policy.load_state_dict(state_dict)
+    except ConnectionError as e:
+        print(f"\033[93mDisconnected from the learner: {e}\033[0m")
+    finally:
+        client.close()
+    return n_steps
@@ -0,0 +1,170 @@
+"""
+N-step returns for the Dict replay buffers, computed at sample time.
+
+The buffer stores 1-step transitions as usual. For each sampled transition,
+the rewards of the next `n_steps` transitions are summed with discounting,
+with the whole minibatch gathered as one `(batch, n_steps)` array, and the
+target bootstraps from the next observation of the last of them with a
+discount of `gamma ** k`, `k` being the number of rewards summed. The sums
+stop early at the end of an episode, whether terminated (no bootstrapping)
+or truncated (bootstrapping from the stored next observation), and at the
+latest transition of the buffer, whose successors aren't stored yet.
+
+Use it with the `DQN` class in `models/dqn.py`, which uses the per-sample
+discounts of the minibatches, and sets the `gamma` of the buffer to its own.
+"""
+
+from typing import Callable, NamedTuple, Optional, Union
+
+import numpy as np
+import torch as th
+from gymnasium import spaces
+from stable_baselines3.common.type_aliases import TensorDict
+from stable_baselines3.common.vec_env import VecNormalize
+
+from models.augmentation import AugmentedDictReplayBuffer
+
+
+class NStepDictReplayBufferSamples(NamedTuple):
+    observations: TensorDict
+    actions: th.Tensor
+    next_observations: TensorDict
+    dones: th.Tensor
+    # discounted sums of the rewards
+    rewards: th.Tensor
+    # discounts of the bootstrapped values
+    discounts: th.Tensor
+
+
+def n_step_returns(
+    rewards: np.ndarray,
+    dones: np.ndarray,
+    batch_inds: np.ndarray,
+    env_inds: np.ndarray,
+    pos: int,
+    n_steps: int,
+    gamma: float,
+    normalize_reward: Optional[Callable[[np.ndarray], np.ndarray]] = None,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    N-step returns of the transitions `(batch_inds, env_inds)` of a buffer
+    whose next transition is written at `pos`.
+
+    :param rewards: Rewards of the buffer, (buffer_size, n_envs)
+    :param dones: Episode ends of the buffer, terminations and truncations
+    :param normalize_reward: Applied to the gathered rewards
+    :return: The discounted sums of the rewards, the buffer positions of the
+        transitions to bootstrap from, and the discounts of the bootstrapped
+        values
+    """
+    buffer_size = rewards.shape[0]
+    steps = np.arange(n_steps)
+    positions = (batch_inds[:, None] + steps) % buffer_size
+    env_inds = env_inds[:, None]
+    # transitions stored after the sampled ones, the latest one being at
+    # pos - 1, which also holds when the buffer has wrapped around
+    available = (pos - 1 - batch_inds) % buffer_size
+    ends = dones[positions, env_inds].astype(bool) | (steps >= available[:, None])
+    ends[:, -1] = True
+    # index of the first end, included in the sums
+    last_steps = ends.argmax(axis=1)
+    mask = steps <= last_steps[:, None]
+    rewards = rewards[positions, env_inds]
+    if normalize_reward is not None:
+        rewards = normalize_reward(rewards)
+    returns = (rewards * gamma**steps * mask).sum(axis=1)
+    last_positions = positions[np.arange(len(batch_inds)), last_steps]
+    discounts = gamma ** (last_steps + 1.0)
+    return (
+        returns.astype(np.float32),
+        last_positions,
+        discounts.astype(np.float32),
+    )
+
+
+class NStepDictReplayBuffer(AugmentedDictReplayBuffer):
+    """
+    Dict replay buffer sampling n-step transitions (see the module
+    docstring).
+
+    :param n_steps: Number of rewards summed, 1 for the usual 1-step
+        transitions
+    :param gamma: Discount factor, set to the one of `DQN`
+    :param shift_pad: Maximum random shift of the sampled images in pixels,
+        see `AugmentedDictReplayBuffer`
+    """
+
+    def __init__(
+        self,
+        buffer_size: int,
+        observation_space: spaces.Dict,
+        action_space: spaces.Space,
+        device: Union[th.device, str] = "auto",
+        n_envs: int = 1,
+        optimize_memory_usage: bool = False,
+        handle_timeout_termination: bool = True,
+        n_steps: int = 3,
+        gamma: float = 0.99,
+        shift_pad: int = 0,
+    ):
+        super().__init__(
+            buffer_size,
+            observation_space,
+            action_space,
+            device=device,
+            n_envs=n_envs,
+            optimize_memory_usage=optimize_memory_usage,
+            handle_timeout_termination=handle_timeout_termination,
+            shift_pad=shift_pad,
+        )
+        if n_steps < 1:
+            raise ValueError("Number of steps should be positive")
+        self.n_steps = n_steps
+        self.gamma = gamma
+
+    def _get_samples(
+        self, batch_inds: np.ndarray, env: Optional[VecNormalize] = None
+    ) -> NStepDictReplayBufferSamples:
+        env_inds = np.random.randint(0, high=self.n_envs, size=(len(batch_inds),))
+        return get_n_step_samples(self, batch_inds, env_inds, env)
+
+
+def get_n_step_samples(
+    buffer: AugmentedDictReplayBuffer,
+    batch_inds: np.ndarray,
+    env_inds: np.ndarray,
+    env: Optional[VecNormalize] = None,
+) -> NStepDictReplayBufferSamples:
+    """
+    N-step samples of a buffer with `n_steps` and `gamma` attributes.
+    """
+    returns, last_inds, discounts = n_step_returns(
+        buffer.rewards,
+        buffer.dones,
+        batch_inds,
+        env_inds,
+        buffer.pos,
+        buffer.n_steps,
+        buffer.gamma,
+        normalize_reward=lambda rewards: buffer._normalize_reward(rewards, env),
+    )
+    obs_ = buffer._normalize_obs(
+        {k: obs[batch_inds, env_inds] for k, obs in buffer.observations.items()},
+        env,
+    )
+    next_obs_ = buffer._normalize_obs(
+        {k: obs[last_inds, env_inds] for k, obs in buffer.next_observations.items()},
+        env,
+    )
+    # only the terminations, not the truncations, stop the bootstrapping
+    dones = buffer.dones[last_inds, env_inds] * (
+        1 - buffer.timeouts[last_inds, env_inds]
+    )
+    return NStepDictReplayBufferSamples(
+        observations={k: buffer.to_torch(obs) for k, obs in obs_.items()},
+        actions=buffer.to_torch(buffer.actions[batch_inds, env_inds]),
+        next_observations={k: buffer.to_torch(obs) for k, obs in next_obs_.items()},
+        dones=buffer.to_torch(dones).reshape(-1, 1),
+        rewards=buffer.to_torch(returns).reshape(-1, 1),
+        discounts=buffer.to_torch(discounts).reshape(-1, 1),
+    )
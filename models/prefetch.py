@@ -0,0 +1,217 @@
+"""
+Sample the next replay minibatches on a background thread while the current
+gradient step runs.
+"""
+
+import copy
+import threading
+from collections import deque
+from typing import Any, Optional
+
+import numpy as np
+import torch as th
+from stable_baselines3.common.buffers import ReplayBuffer
+from stable_baselines3.common.vec_env import VecNormalize
+
+from environment import tracing
+
+# methods of the buffers changing their content or sampling distribution
+_MUTATORS = ("add", "add_transitions", "reset", "update_priorities", "anneal_beta")
+
+
+def _map_tensors(samples, fn):
+    """
+    Apply `fn` to the tensors of a named tuple of samples, including the ones
+    in observation dicts.
+    """
+    fields = {}
+    for name, value in zip(samples._fields, samples):
+        if isinstance(value, dict):
+            fields[name] = {k: fn(v) for k, v in value.items()}
+        elif isinstance(value, th.Tensor):
+            fields[name] = fn(value)
+    return samples._replace(**fields)
+
+
+def _unwrap(buffer: ReplayBuffer) -> ReplayBuffer:
+    return buffer
+
+
+def _sample_indices(buffer: ReplayBuffer, batch_size: int):
+    if hasattr(buffer, "sample_indices"):
+        return buffer.sample_indices(batch_size)
+    # as `BaseBuffer.sample`
+    upper_bound = buffer.buffer_size if buffer.full else buffer.pos
+    return np.random.randint(0, upper_bound, size=batch_size)
+
+
+def _get_samples(buffer: ReplayBuffer, batch, env: Optional[VecNormalize]):
+    if hasattr(buffer, "get_samples"):
+        return buffer.get_samples(batch, env=env)
+    return buffer._get_samples(batch, env=env)
+
+
+class PrefetchingReplayBuffer:
+    """
+    Wraps a replay buffer so that `sample` returns minibatches prepared by a
+    background thread: the index sampling, the gathers of the frame stacks,
+    the augmentation and the tensor construction then overlap the gradient
+    step on the previous minibatch.
+
+    Only the index sampling (`sample_indices` of the buffers of `models`)
+    holds the lock the learner's `sample` and the buffer changes take. The
+    gathers run without it, so they never hold up the learner.
+
+    The sampling distribution is unchanged: the prefetched minibatches are
+    discarded whenever the buffer changes (`add`, `add_transitions`, `reset`, and
+    `update_priorities` and `anneal_beta` of prioritized buffers), including
+    while they are being gathered, so a minibatch is always sampled from the
+    same buffer state as it would have been without prefetching.
+    Consequently, the prefetching only pays off with more than one gradient
+    step per training call, or with prioritized replay, whose next minibatch
+    is sampled during the backward pass after the priorities are updated.
+
+    The `train` methods of `models/dqn.py` and `models/ddpg.py` announce their
+    number of gradient steps with `expect`, so that no minibatch is prepared
+    past the last one. Without it, minibatches are prepared continuously.
+
+    When the buffer is on a CUDA device, the minibatches are prepared in
+    pinned host memory and copied asynchronously when sampled.
+
+    Every other attribute is the wrapped buffer's. Wrap the buffer after
+    restoring its content (e.g., `load_replay_chunks`), since attributes are
+    not set through the wrapper.
+
+    :param buffer: Replay buffer to sample from
+    :param n_prefetch: Maximum number of minibatches prepared in advance
+    """
+
+    def __init__(self, buffer: ReplayBuffer, n_prefetch: int = 2):
+        if n_prefetch < 1:
+            raise ValueError("Number of prefetched minibatches should be positive")
+        self.buffer = buffer
+        self.n_prefetch = n_prefetch
+        self.device = th.device(buffer.device)
+        self.pin_memory = self.device.type == "cuda"
+        # guards the buffer content and the state below
+        self._cond = threading.Condition()
+        # (batch_size, env, samples) sampled from the current buffer state
+        self._batches = deque()
+        # bumped whenever the buffer changes
+        self._generation = 0
+        # samples still expected in the current training call, None if unknown
+        self._pending = None
+        # (batch_size, env) of the last sample
+        self._request = None
+        # whether a minibatch of the current generation is being gathered
+        self._in_flight = False
+        self._closed = False
+        self.n_hits = 0
+        self.n_misses = 0
+        self._thread = threading.Thread(
+            target=self._run, name="replay_prefetch", daemon=True
+        )
+        self._thread.start()
+
+    def __getattr__(self, name: str) -> Any:
+        # only called for the attributes not found on the wrapper
+        attr = getattr(self.__dict__["buffer"], name)
+        if name not in _MUTATORS:
+            return attr
+
+        def mutator(*args, **kwargs):
+            with self._cond:
+                result = attr(*args, **kwargs)
+                self._generation += 1
+                self._batches.clear()
+                # the minibatch being gathered is dropped when done
+                self._in_flight = False
+                # the priorities are updated in the middle of a training
+                # call, the other changes end it
+                if name != "update_priorities" and self._pending is not None:
+                    self._pending = 0
+                self._cond.notify_all()
+            return result
+
+        return mutator
+
+    def __reduce__(self):
+        # unpickled as the wrapped buffer, e.g., after `save_replay_buffer`
+        return _unwrap, (self.buffer,)
+
+    def expect(self, n_samples: int) -> None:
+        """
+        Announce that `sample` will be called `n_samples` times in a row.
+        """
+        with self._cond:
+            self._pending = n_samples
+
+    def _wants_batch(self) -> bool:
+        if self._request is None:
+            return False
+        n_wanted = self.n_prefetch
+        if self._pending is not None:
+            n_wanted = min(n_wanted, self._pending)
+        return len(self._batches) < n_wanted
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._closed and not self._wants_batch():
+                    self._cond.wait()
+                if self._closed:
+                    return
+                generation = self._generation
+                batch_size, env = self._request
+                batch = _sample_indices(self.buffer, batch_size)
+                self._in_flight = True
+                buffer = self.buffer
+                if self.pin_memory:
+                    # a shallow copy gathering on the CPU, sharing the storage
+                    buffer = copy.copy(self.buffer)
+                    buffer.device = th.device("cpu")
+            # without the lock, the buffer may change meanwhile, in which case
+            # the minibatch is dropped below
+            with tracing.span("prefetch", "learner"):
+                samples = _get_samples(buffer, batch, env)
+                if self.pin_memory:
+                    samples = _map_tensors(samples, lambda t: t.pin_memory())
+            with self._cond:
+                self._in_flight = False
+                if generation == self._generation:
+                    self._batches.append((batch_size, env, samples))
+                self._cond.notify_all()
+
+    def sample(self, batch_size: int, env: Optional[VecNormalize] = None):
+        with self._cond:
+            # waiting for the minibatch being gathered beats gathering another
+            while not self._batches and self._in_flight:
+                self._cond.wait()
+            samples = None
+            while self._batches and samples is None:
+                size, batch_env, batch = self._batches.popleft()
+                if size == batch_size and batch_env is env:
+                    samples = batch
+            if samples is None:
+                self.n_misses += 1
+                samples = self.buffer.sample(batch_size, env=env)
+            else:
+                self.n_hits += 1
+                if self.pin_memory:
+                    samples = _map_tensors(
+                        samples, lambda t: t.to(self.device, non_blocking=True)
+                    )
+            if self._pending is not None:
+                self._pending = max(0, self._pending - 1)
+            self._request = (batch_size, env)
+            self._cond.notify_all()
+        return samples
+
+    def close(self) -> None:
+        """
+        Stop the background thread.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
@@ -0,0 +1,259 @@
+"""
+Prioritized experience replay (https://arxiv.org/abs/1511.05952) for the Dict
+observations of `Touhou14Env`.
+
+Use it with the `DQN` class in `models/dqn.py`, which feeds the TD errors back
+to the buffer. It also supports the n-step returns of `models/n_step.py`.
+"""
+
+from typing import Any, NamedTuple, Optional, Union
+
+import numpy as np
+import torch as th
+from gymnasium import spaces
+from stable_baselines3.common.type_aliases import TensorDict
+from stable_baselines3.common.vec_env import VecNormalize
+
+from models.augmentation import AugmentedDictReplayBuffer
+from models.n_step import get_n_step_samples
+
+
+class SumTree:
+    """
+    Array-backed binary sum tree over `capacity` non-negative priorities.
+
+    Node `i` has children `2i` and `2i + 1`, the root is node 1 and the leaves
+    start at node `n_leaves` (the capacity rounded up to a power of 2). Batched
+    sampling and updates walk the tree one level at a time for the whole batch.
+    """
+
+    def __init__(self, capacity: int):
+        if capacity < 1:
+            raise ValueError("Capacity should be positive")
+        self.capacity = capacity
+        self.depth = int(np.ceil(np.log2(capacity))) if capacity > 1 else 0
+        self.n_leaves = 1 << self.depth
+        self.tree = np.zeros(2 * self.n_leaves, dtype=np.float64)
+
+    @property
+    def total(self) -> float:
+        return float(self.tree[1])
+
+    def __getitem__(self, indices: np.ndarray) -> np.ndarray:
+        return self.tree[self.n_leaves + np.asarray(indices)]
+
+    def update(self, indices: np.ndarray, priorities: np.ndarray) -> None:
+        """
+        Set the priorities of the given leaves. When an index appears more
+        than once, the last priority wins.
+        """
+        nodes = self.n_leaves + np.asarray(indices, dtype=np.int64)
+        self.tree[nodes] = priorities
+        for _ in range(self.depth):
+            nodes = np.unique(nodes >> 1)
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+
+    def find(self, values: np.ndarray) -> np.ndarray:
+        """
+        Return, for each value in [0, total), the leaf whose prefix sum range
+        contains it.
+        """
+        values = np.array(values, dtype=np.float64)
+        nodes = np.ones(len(values), dtype=np.int64)
+        for _ in range(self.depth):
+            left = 2 * nodes
+            left_sums = self.tree[left]
+            # the second condition guards against floating point drift
+            # leading to empty subtrees
+            go_right = (values >= left_sums) & (self.tree[left + 1] > 0)
+            values -= left_sums * go_right
+            nodes = left + go_right
+        return nodes - self.n_leaves
+
+    def sample(self, batch_size: int) -> np.ndarray:
+        """
+        Stratified sampling of leaves proportionally to their priorities.
+        """
+        bounds = np.linspace(0.0, self.total, batch_size + 1)
+        values = np.random.uniform(bounds[:-1], bounds[1:])
+        return self.find(values)
+
+
+class PrioritizedDictReplayBufferSamples(NamedTuple):
+    observations: TensorDict
+    actions: th.Tensor
+    next_observations: TensorDict
+    dones: th.Tensor
+    rewards: th.Tensor
+    # discounts of the bootstrapped values, None for 1-step transitions
+    discounts: Optional[th.Tensor]
+    # importance-sampling weights, normalized by the batch maximum
+    weights: th.Tensor
+    # flat transition indices, to be passed back to `update_priorities`
+    indices: np.ndarray
+
+
+class PrioritizedDictReplayBuffer(AugmentedDictReplayBuffer):
+    """
+    Dict replay buffer sampling transitions proportionally to
+    `priority ** alpha`, where the priority of a transition is its last
+    absolute TD error. New transitions get the maximum priority seen so far.
+
+    :param alpha: How much prioritization is used (0 - uniform sampling)
+    :param beta: Initial importance-sampling exponent, annealed to 1 by
+        the `DQN` class over the training
+    :param epsilon: Small constant added to the priorities so that every
+        transition can be sampled
+    :param shift_pad: Maximum random shift of the sampled images in pixels,
+        see `AugmentedDictReplayBuffer`
+    :param n_steps: Number of rewards summed in the sampled transitions, see
+        `models/n_step.py`
+    :param gamma: Discount factor of the n-step returns, set to the one of
+        `DQN`
+    """
+
+    def __init__(
+        self,
+        buffer_size: int,
+        observation_space: spaces.Dict,
+        action_space: spaces.Space,
+        device: Union[th.device, str] = "auto",
+        n_envs: int = 1,
+        optimize_memory_usage: bool = False,
+        handle_timeout_termination: bool = True,
+        alpha: float = 0.6,
+        beta: float = 0.4,
+        epsilon: float = 1e-6,
+        shift_pad: int = 0,
+        n_steps: int = 1,
+        gamma: float = 0.99,
+    ):
+        super().__init__(
+            buffer_size,
+            observation_space,
+            action_space,
+            device=device,
+            n_envs=n_envs,
+            optimize_memory_usage=optimize_memory_usage,
+            handle_timeout_termination=handle_timeout_termination,
+            shift_pad=shift_pad,
+        )
+        self.alpha = alpha
+        self.beta_initial = beta
+        self.beta = beta
+        self.epsilon = epsilon
+        if n_steps < 1:
+            raise ValueError("Number of steps should be positive")
+        self.n_steps = n_steps
+        self.gamma = gamma
+        self.max_priority = 1.0
+        # one leaf per (position, env)
+        self.sum_tree = SumTree(self.buffer_size * self.n_envs)
+
+    def anneal_beta(self, progress: float) -> None:
+        """
+        Anneal beta linearly to 1 given the training progress (0 to 1).
+        """
+        self.beta = self.beta_initial + (1.0 - self.beta_initial) * progress
+
+    def add(
+        self,
+        obs: dict[str, np.ndarray],
+        next_obs: dict[str, np.ndarray],
+        action: np.ndarray,
+        reward: np.ndarray,
+        done: np.ndarray,
+        infos: list[dict[str, Any]],
+    ) -> None:
+        leaves = self.pos * self.n_envs + np.arange(self.n_envs)
+        super().add(obs, next_obs, action, reward, done, infos)
+        self.sum_tree.update(
+            leaves, np.full(self.n_envs, self.max_priority**self.alpha)
+        )
+
+    def add_transitions(
+        self,
+        obs: dict[str, np.ndarray],
+        next_obs: dict[str, np.ndarray],
+        actions: np.ndarray,
+        rewards: np.ndarray,
+        dones: np.ndarray,
+        timeouts: np.ndarray,
+    ) -> None:
+        super().add_transitions(obs, next_obs, actions, rewards, dones, timeouts)
+        n = min(len(rewards), self.buffer_size)
+        positions = (self.pos - n + np.arange(n)) % self.buffer_size
+        leaves = positions[:, None] * self.n_envs + np.arange(self.n_envs)
+        self.sum_tree.update(
+            leaves.ravel(), np.full(leaves.size, self.max_priority**self.alpha)
+        )
+
+    def sample_indices(self, batch_size: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Flat indices and importance-sampling weights of a minibatch, the part
+        of `sample` reading the priorities.
+        """
+        indices = self.sum_tree.sample(batch_size)
+        n_transitions = self.size() * self.n_envs
+        probs = self.sum_tree[indices] / self.sum_tree.total
+        weights = (n_transitions * probs) ** -self.beta
+        weights /= weights.max()
+        return indices, weights
+
+    def get_samples(
+        self,
+        batch: tuple[np.ndarray, np.ndarray],
+        env: Optional[VecNormalize] = None,
+    ) -> PrioritizedDictReplayBufferSamples:
+        """
+        Gather the transitions of `sample_indices` and augment them.
+        """
+        return self._augment_samples(self._get_prioritized_samples(*batch, env))
+
+    def sample(
+        self, batch_size: int, env: Optional[VecNormalize] = None
+    ) -> PrioritizedDictReplayBufferSamples:
+        return self.get_samples(self.sample_indices(batch_size), env=env)
+
+    def _get_prioritized_samples(
+        self,
+        indices: np.ndarray,
+        weights: np.ndarray,
+        env: Optional[VecNormalize] = None,
+    ) -> PrioritizedDictReplayBufferSamples:
+        batch_inds, env_inds = np.divmod(indices, self.n_envs)
+        weights = self.to_torch(weights.astype(np.float32)).reshape(-1, 1)
+        if self.n_steps > 1:
+            samples = get_n_step_samples(self, batch_inds, env_inds, env)
+            return PrioritizedDictReplayBufferSamples(
+                *samples, weights=weights, indices=indices
+            )
+        obs_ = self._normalize_obs(
+            {k: obs[batch_inds, env_inds] for k, obs in self.observations.items()},
+            env,
+        )
+        next_obs_ = self._normalize_obs(
+            {k: obs[batch_inds, env_inds] for k, obs in self.next_observations.items()},
+            env,
+        )
+        dones = self.dones[batch_inds, env_inds] * (
+            1 - self.timeouts[batch_inds, env_inds]
+        )
+        rewards = self._normalize_reward(
+            self.rewards[batch_inds, env_inds].reshape(-1, 1), env
+        )
+        return PrioritizedDictReplayBufferSamples(
+            observations={k: self.to_torch(obs) for k, obs in obs_.items()},
+            actions=self.to_torch(self.actions[batch_inds, env_inds]),
+            next_observations={k: self.to_torch(obs) for k, obs in next_obs_.items()},
+            dones=self.to_torch(dones).reshape(-1, 1),
+            rewards=self.to_torch(rewards),
+            discounts=None,
+            weights=weights,
+            indices=indices,
+        )
+
+    def update_priorities(self, indices: np.ndarray, td_errors: np.ndarray) -> None:
+        priorities = np.abs(td_errors) + self.epsilon
+        self.max_priority = max(self.max_priority, float(priorities.max()))
+        self.sum_tree.update(indices, priorities**self.alpha)
@@ -0,0 +1,59 @@
+"""
+Helpers for the benchmark scripts.
+"""
+
+import threading
+import time
+
+import psutil
+
+
+class PeakMemorySampler:
+    """
+    Track the peak resident memory of this process while in the context, by
+    polling it from a background thread. The peak is relative to the memory
+    in use when entering the context.
+
+    Example
+    -------
+    with PeakMemorySampler() as sampler:
+        run()
+    print(sampler.peak_bytes)
+    """
+
+    def __init__(self, interval: float = 0.002):
+        self.interval = interval
+        self.peak_bytes = 0
+        self._process = psutil.Process()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        while not self._stop.is_set():
+            rss = self._process.memory_info().rss
+            self.peak_bytes = max(self.peak_bytes, rss - self._baseline)
+            time.sleep(self.interval)
+
+    def __enter__(self) -> "PeakMemorySampler":
+        self._baseline = self._process.memory_info().rss
+        self.peak_bytes = 0
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+def throughput(fn, n_items: int, repeats: int, warmup: int = 2) -> float:
+    """
+    Items processed per second by `fn`, which processes `n_items` per call.
+    """
+    for _ in range(warmup):
+        fn()
+    t0 = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return n_items * repeats / (time.perf_counter() - t0)
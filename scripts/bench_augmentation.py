@@ -0,0 +1,60 @@
+"""
+Benchmark the cost of randomly shifting a minibatch of stacked frames, with
+the batched gather of `random_shift` against padding and cropping each sample
+in a Python loop.
+"""
+
+import argparse
+
+import torch
+
+from environment.spaces import FRAME_HEIGHT, FRAME_WIDTH
+from models.augmentation import random_shift
+from models.profiling import throughput
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--batch_sizes", type=int, nargs="+", default=[32, 64, 256])
+parser.add_argument("--n_frame_stack", type=int, default=4)
+parser.add_argument("--frame_downsize_ratio", type=float, default=1.0)
+parser.add_argument("--pad", type=int, default=4)
+parser.add_argument("--repeats", type=int, default=20)
+parser.add_argument("--device", type=str, default="cpu")
+args = parser.parse_args()
+
+h = int(FRAME_HEIGHT * args.frame_downsize_ratio)
+w = int(FRAME_WIDTH * args.frame_downsize_ratio)
+
+
+def loop_shift(images: torch.Tensor, pad: int) -> torch.Tensor:
+    # replicate padding (F.pad does not support it for uint8)
+    rows = torch.arange(-pad, h + pad, device=images.device).clamp_(0, h - 1)
+    cols = torch.arange(-pad, w + pad, device=images.device).clamp_(0, w - 1)
+    padded = images[:, :, rows][:, :, :, cols]
+    out = torch.empty_like(images)
+    for i, (dy, dx) in enumerate(torch.randint(0, 2 * pad + 1, (len(images), 2))):
+        out[i] = padded[i, :, dy : dy + h, dx : dx + w]
+    return out
+
+
+def synchronize():
+    if args.device.startswith("cuda"):
+        torch.cuda.synchronize()
+
+
+print(f"frames: ({args.n_frame_stack}, {h}, {w}) uint8, pad {args.pad}")
+print(f"{'method':<10}{'batch':>7}{'ms/batch':>12}{'obs/s':>14}")
+for batch_size in args.batch_sizes:
+    images = torch.randint(
+        0, 256, (batch_size, args.n_frame_stack, h, w), dtype=torch.uint8
+    ).to(args.device)
+    for name, fn in (("gather", random_shift), ("loop", loop_shift)):
+
+        def run():
+            fn(images, args.pad)
+            synchronize()
+
+        rate = throughput(run, batch_size, args.repeats)
+        print(
+            f"{name:<10}{batch_size:>7}{1000 * batch_size / rate:>12.3f}{rate:>14,.0f}"
+        )
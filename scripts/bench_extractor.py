@@ -0,0 +1,69 @@
+"""
+Benchmark the features extractors on CPU: forward and forward/backward
+throughput, and peak memory, at the batch sizes used for training.
+"""
+
+import argparse
+
+import numpy as np
+import torch
+from stable_baselines3.common.preprocessing import preprocess_obs
+from stable_baselines3.common.torch_layers import CombinedExtractor
+
+from environment.spaces import make_observation_space
+from models.extractors import TouhouExtractor
+from models.profiling import PeakMemorySampler, throughput
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "--batch_sizes",
+    type=int,
+    nargs="+",
+    default=[32, 64, 256],
+    help="Batch sizes to benchmark (DQN uses 32, DDPG uses 64)",
+)
+parser.add_argument("--n_frame_stack", type=int, default=4)
+parser.add_argument("--frame_downsize_ratio", type=float, default=1.0)
+parser.add_argument("--repeats", type=int, default=5)
+parser.add_argument("--threads", type=int, default=None, help="torch threads")
+args = parser.parse_args()
+
+if args.threads is not None:
+    torch.set_num_threads(args.threads)
+
+# the policies see the frames channels first
+observation_space = make_observation_space(
+    args.n_frame_stack, args.frame_downsize_ratio, channels_first=True
+)
+
+print(
+    f"{'extractor':<20}{'params':>12}{'batch':>7}"
+    f"{'fwd (obs/s)':>14}{'fwd+bwd (obs/s)':>17}{'peak mem (MB)':>15}"
+)
+for extractor_class in (CombinedExtractor, TouhouExtractor):
+    extractor = extractor_class(observation_space)
+    n_params = sum(p.numel() for p in extractor.parameters())
+    for batch_size in args.batch_sizes:
+        obs = {
+            k: torch.as_tensor(
+                np.stack([observation_space[k].sample() for _ in range(batch_size)])
+            )
+            for k in observation_space.spaces
+        }
+
+        def forward():
+            with torch.no_grad():
+                extractor(preprocess_obs(obs, observation_space))
+
+        def forward_backward():
+            extractor.zero_grad()
+            extractor(preprocess_obs(obs, observation_space)).sum().backward()
+
+        fwd = throughput(forward, batch_size, args.repeats)
+        with PeakMemorySampler() as sampler:
+            fwd_bwd = throughput(forward_backward, batch_size, args.repeats)
+        print(
+            f"{extractor_class.__name__:<20}{n_params:>12,}{batch_size:>7}"
+            f"{fwd:>14,.1f}{fwd_bwd:>17,.1f}{sampler.peak_bytes / 2**20:>15,.1f}"
+        )
@@ -0,0 +1,102 @@
+"""
+Benchmark the keyboard input of the interface over a sequence of agent
+actions: the previous per-key `keyboard` calls, one OS input injection each,
+versus the batched key-state diffs of `environment.input_backend`.
+
+By default, the batches are recorded by `RecordingBackend`. Pass `--live` to
+send them with `SendInputBackend` instead, on Windows, with the game or
+another harmless window focused.
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from environment.input_backend import RecordingBackend
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--actions", "-n", type=int, default=100000)
+parser.add_argument(
+    "--repeat_prob",
+    type=float,
+    default=0.7,
+    help="Probability for the agent to repeat its previous action",
+)
+parser.add_argument("--seed", type=int, default=0)
+parser.add_argument("--live", action="store_true", help="Send the input with SendInput")
+args = parser.parse_args()
+
+rng = np.random.default_rng(args.seed)
+actions = rng.integers(0, 10, args.actions)
+repeat = rng.random(args.actions) < args.repeat_prob
+for i in range(1, args.actions):
+    if repeat[i]:
+        actions[i] = actions[i - 1]
+actions = actions.tolist()
+
+_MOVE_KEYS = ("left", "right", "up", "down")
+
+
+def legacy_calls() -> list[int]:
+    """
+    Number of `keyboard.press`/`keyboard.release` calls of each action when
+    `interface.act` pressed z and each changed key through `keyboard`.
+    """
+    pressed = dict.fromkeys(_MOVE_KEYS + ("shift",), False)
+    calls = []
+    for action in actions:
+        move, slow = action % 5, action // 5
+        n = 1  # keyboard.press("z")
+        for i, key in enumerate(_MOVE_KEYS):
+            if pressed[key] != (i == move - 1):
+                pressed[key] = not pressed[key]
+                n += 1
+        if pressed["shift"] != (slow == 1):
+            pressed["shift"] = not pressed["shift"]
+            n += 1
+        calls.append(n)
+    return calls
+
+
+def run_backend(backend) -> tuple[float, int, int]:
+    """
+    Time the actions through the backend, setting the keys as
+    `interface.act` does, and return the time and the numbers of injections
+    and events.
+    """
+    t0 = time.perf_counter()
+    for action in actions:
+        move, slow = action % 5, action // 5
+        backend.press("z")
+        for i, key in enumerate(_MOVE_KEYS):
+            backend.set_key(key, i == move - 1)
+        backend.set_key("shift", slow == 1)
+        backend.flush()
+    elapsed = time.perf_counter() - t0
+    n_batches, n_events = backend.n_batches, backend.n_events
+    backend.release_all()
+    return elapsed, n_batches, n_events
+
+
+if args.live:
+    from environment.input_backend import SendInputBackend
+
+    backend = SendInputBackend()
+else:
+    backend = RecordingBackend()
+
+calls = legacy_calls()
+elapsed, n_batches, n_events = run_backend(backend)
+n = args.actions
+print(f"{n:,} actions, repeat probability {args.repeat_prob}")
+print(
+    f"keyboard calls: {sum(calls) / n:.2f} injections/action, "
+    f"{sum(calls):,} events, at most {max(calls)} injections in an action"
+)
+print(
+    f"batched diffs:  {n_batches / n:.2f} injections/action, "
+    f"{n_events:,} events, at most 1 injection in an action, "
+    f"{elapsed / n * 1e6:.1f} us/action"
+)
@@ -0,0 +1,81 @@
+"""
+Compare the menu macros of `environment/macros.py` with the fixed waits they
+replace, on the simulated game menus of `environment/simulated.py`, in frames
+per macro (60 frames per second in the game).
+"""
+
+import argparse
+
+import numpy as np
+
+from environment import macros
+from environment.macros import MacroEngine, Step, field_is
+from environment.simulated import SimulatedMenus
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--runs", "-n", type=int, default=200)
+args = parser.parse_args()
+
+# the previous interface scripts, as macros of fixed waits
+_FIXED_INIT = (
+    Step("quit demo", ("down", "esc"), timeout=180),
+    Step("title", ("down", "esc")),
+    Step("spell practice", ("down", "down", "down", "z"), timeout=60),
+    Step("stage", ("z",), timeout=60),
+    Step("spell card", ("down",), timeout=60),
+    Step("character", ("z",), timeout=60),
+    Step("start", ("z",), timeout=150),
+)
+_FIXED_POLL = Step("poll", until=field_is("game_state", 2), timeout=300, poll=5)
+_FIXED_FORCE_RESET = (
+    Step("pause", ("esc",), timeout=30),
+    Step("restart", ("r",), timeout=30),
+    _FIXED_POLL,
+)
+_FIXED_RESET_FROM_END_OF_RUN = (
+    Step("menu", ("esc",), timeout=30),
+    Step("retry", ("up",), timeout=30),
+    Step("restart", ("z",), timeout=30),
+    _FIXED_POLL,
+)
+
+_SCENARIOS = (
+    ("init", "demo", _FIXED_INIT, macros.INIT),
+    ("force_reset", "playing", _FIXED_FORCE_RESET, macros.FORCE_RESET),
+    (
+        "reset_from_end_of_run",
+        "end_of_run",
+        _FIXED_RESET_FROM_END_OF_RUN,
+        macros.RESET_FROM_END_OF_RUN,
+    ),
+)
+
+
+def run(screen: str, steps: tuple[Step, ...]) -> tuple[np.ndarray, float]:
+    """
+    Frames of each run, and the rate of runs ending up playing.
+    """
+    frames, successes = [], 0
+    for seed in range(args.runs):
+        game = SimulatedMenus(screen, seed=seed)
+        engine = MacroEngine(game.read, game.clock, game.sleep, game.input_backend)
+        frames.append(engine.run("macro", steps))
+        successes += game.screen == "playing" and game.pending is None
+    return np.array(frames), successes / args.runs
+
+
+print(f"{args.runs} runs per macro, in frames")
+print(
+    f"{'macro':<24}{'fixed mean':>12}{'fixed max':>11}{'macro mean':>12}"
+    f"{'macro max':>11}{'saved':>8}{'ok':>7}"
+)
+for name, screen, fixed_steps, macro_steps in _SCENARIOS:
+    fixed, fixed_ok = run(screen, fixed_steps)
+    frames, ok = run(screen, macro_steps)
+    print(
+        f"{name:<24}{fixed.mean():>12.1f}{fixed.max():>11}{frames.mean():>12.1f}"
+        f"{frames.max():>11}{1 - frames.mean() / fixed.mean():>8.0%}"
+        f"{f'{ok:.0%}':>7}"
+    )
+    assert fixed_ok == 1.0 and ok == 1.0, "a macro did not end up playing"
@@ -0,0 +1,137 @@
+"""
+Microbenchmark of game variable reads: the previous per-call read path versus
+fields compiled by `environment.memory.compile_fields`.
+
+By default, reads are served by a simulated memory image laid out like the
+game's. Pass `--live` to benchmark against the running game instead.
+"""
+
+import argparse
+import ctypes
+import struct
+import time
+
+from environment.memory import Field, SimulatedMemory, compile_fields
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "--reads", "-n", type=int, default=200000, help="Number of reads per variant"
+)
+parser.add_argument(
+    "--live", action="store_true", help="Read from the running game process"
+)
+args = parser.parse_args()
+
+
+# a representative subset of the interface fields, in the previous offset format
+_OFFSETS = dict(
+    score=0xF5830,
+    game_state=0xF7AC8,
+    global_timer=(0xDB520, 0x191E0),
+    f_player_pos_x=(0xDB67C, 0x5E0),
+    boss_hp=(((((0xDB544, 0xD0), 0x4), 0x4), 0x0), 0x11F0 + 0x3F74),
+)
+_TYPES = dict(
+    score="int32",
+    game_state="int32",
+    global_timer="int32",
+    f_player_pos_x="float32",
+    boss_hp="int32",
+)
+
+
+def _flatten(offset) -> tuple[int, ...]:
+    if isinstance(offset, int):
+        return (offset,)
+    return _flatten(offset[0]) + (offset[1],)
+
+
+def _make_simulated_memory() -> SimulatedMemory:
+    """
+    Lay out a memory image in which every pointer path of `_OFFSETS` resolves.
+    """
+    memory = SimulatedMemory()
+    memory.map(memory.base_address, 0x100000)
+    heap = 0x10000000
+    for offset in _OFFSETS.values():
+        path = _flatten(offset)
+        address = memory.base_address + path[0]
+        for rel in path[1:]:
+            memory.map(heap, rel + 0x10)
+            memory.write_ptr(address, heap)
+            address = heap + rel
+            heap += 0x100000
+    return memory
+
+
+def _legacy_read_game_memory(memory, address: int, size: int) -> bytes:
+    # mirrors the allocations of the previous `_read_game_memory`
+    buffer = ctypes.create_string_buffer(size)
+    ctypes.c_int()  # bytes read
+    memory.read_raw(ctypes.c_uint64(address).value, ctypes.addressof(buffer), size)
+    return buffer.raw
+
+
+def _legacy_parse_ptr_addr(memory, ptr: tuple) -> int:
+    if len(ptr) != 2:
+        raise ValueError(
+            "Pointer must be given in the form of (base_addr, relative_offset)"
+        )
+    if isinstance(ptr[0], tuple):
+        base_addr = int.from_bytes(
+            _legacy_read_game_memory(memory, _legacy_parse_ptr_addr(memory, ptr[0]), 4),
+            byteorder="little",
+            signed=False,
+        )
+    else:
+        base_addr = int.from_bytes(
+            _legacy_read_game_memory(memory, memory.base_address + ptr[0], 4),
+            byteorder="little",
+            signed=False,
+        )
+    return base_addr + ptr[1]
+
+
+def _legacy_read_game_val(memory, key: str):
+    if key not in _OFFSETS:
+        raise ValueError(f"Invalid offset key: {key}")
+    offset = _OFFSETS[key]
+    if isinstance(offset, int):
+        data = _legacy_read_game_memory(memory, memory.base_address + offset, 4)
+    elif isinstance(offset, tuple):
+        data = _legacy_read_game_memory(
+            memory, _legacy_parse_ptr_addr(memory, offset), 4
+        )
+    else:
+        raise ValueError("Invalid offset received, should be an integer or a tuple")
+    if key.startswith("f_"):
+        return struct.unpack("f", data)[0]
+    return int.from_bytes(data, byteorder="little", signed=True)
+
+
+def _bench(read, key: str, n: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(n):
+        read(key)
+    return n / (time.perf_counter() - t0)
+
+
+if args.live:
+    import environment.interface as I
+
+    memory = I.game_memory
+else:
+    memory = _make_simulated_memory()
+
+fields = compile_fields(
+    memory, {k: Field(_flatten(v), _TYPES[k]) for k, v in _OFFSETS.items()}
+)
+
+print(f"{'field':<16}{'depth':>6}{'before (reads/s)':>20}{'after (reads/s)':>20}")
+for key, offset in _OFFSETS.items():
+    before = _bench(lambda k: _legacy_read_game_val(memory, k), key, args.reads)
+    after = _bench(lambda k: fields[k](), key, args.reads)
+    assert _legacy_read_game_val(memory, key) == fields[key]()
+    depth = len(_flatten(offset)) - 1
+    print(f"{key:<16}{depth:>6}{before:>20,.0f}{after:>20,.0f}")
@@ -0,0 +1,252 @@
+"""
+Benchmark the policies on CPU for a grid of configurations: the plain and
+dueling DQN Q-networks, and the DDPG actor and critic, with each features
+extractor, frame stack, frame downsize ratio and `net_arch`.
+
+For each configuration, report the parameters of the trained networks (the
+target networks have as many), the latency of choosing an action at batch 1,
+i.e., `policy.predict` as called at every env step, the transitions per
+second of a gradient step as done by `DQN.train` and `DDPG.train` at the
+given batch sizes, and the peak memory of the gradient steps. The results
+are printed as a table and can be saved as JSON with `--json`.
+
+The observation space is the one of `Touhou14Env` as seen by the policies,
+i.e., with the frames channels first, and the observations are random, so no
+game is needed.
+"""
+
+import argparse
+import json
+import platform
+import time
+
+import gymnasium as gym
+import numpy as np
+import torch as th
+import torch.nn.functional as F
+from stable_baselines3.common.preprocessing import preprocess_obs
+from stable_baselines3.common.torch_layers import CombinedExtractor
+from stable_baselines3.dqn.policies import MultiInputPolicy as DQNMultiInputPolicy
+from stable_baselines3.td3.policies import MultiInputPolicy as TD3MultiInputPolicy
+
+from environment.spaces import make_action_space, make_observation_space
+from models.dueling_dqn import DuelingDQNPolicy
+from models.extractors import TouhouExtractor
+from models.profiling import PeakMemorySampler, throughput
+
+
+MODELS = ("dqn", "dueling_dqn", "ddpg")
+EXTRACTORS = {"combined": CombinedExtractor, "touhou": TouhouExtractor}
+
+
+def parse_net_arch(net_arch: str) -> list[int]:
+    return [int(n) for n in net_arch.split(",") if n]
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--models", nargs="+", choices=MODELS, default=list(MODELS))
+parser.add_argument(
+    "--extractors", nargs="+", choices=list(EXTRACTORS), default=list(EXTRACTORS)
+)
+parser.add_argument("--n_frame_stacks", type=int, nargs="+", default=[4])
+parser.add_argument(
+    "--frame_downsize_ratios", type=float, nargs="+", default=[1.0, 0.5]
+)
+parser.add_argument(
+    "--net_archs",
+    type=parse_net_arch,
+    nargs="+",
+    default=[[256, 256]],
+    help="Hidden layers after the features extractor, e.g., 256,256",
+)
+parser.add_argument("--n_entities", type=int, default=0, help="Entity slots, 0 to omit")
+parser.add_argument(
+    "--batch_sizes",
+    type=int,
+    nargs="+",
+    default=[32, 64],
+    help="Batch sizes of the gradient steps (DQN uses 32, DDPG uses 64)",
+)
+parser.add_argument("--latency_repeats", type=int, default=50)
+parser.add_argument(
+    "--repeats", type=int, default=5, help="Gradient steps per batch size"
+)
+parser.add_argument("--threads", type=int, default=None, help="torch threads")
+parser.add_argument(
+    "--json", type=str, default=None, help="Save the results to this path"
+)
+args = parser.parse_args()
+
+if args.threads is not None:
+    th.set_num_threads(args.threads)
+
+
+def _constant(_):
+    return 1e-4
+
+
+def make_policy(model: str, observation_space, extractor_class, net_arch):
+    if model == "ddpg":
+        # as `DDPG`, with the action space of `DiscretizeActionWrapper`
+        action_space = gym.spaces.Box(
+            low=0.0, high=float(make_action_space().n), dtype=np.float32
+        )
+        return TD3MultiInputPolicy(
+            observation_space,
+            action_space,
+            _constant,
+            net_arch=net_arch,
+            features_extractor_class=extractor_class,
+            n_critics=1,
+        )
+    policy_class = DuelingDQNPolicy if model == "dueling_dqn" else DQNMultiInputPolicy
+    return policy_class(
+        observation_space,
+        make_action_space(),
+        _constant,
+        net_arch=net_arch,
+        features_extractor_class=extractor_class,
+    )
+
+
+def sample_batch(observation_space, batch_size: int) -> dict[str, th.Tensor]:
+    obs = {
+        k: th.as_tensor(np.stack([space.sample() for _ in range(batch_size)]))
+        for k, space in observation_space.spaces.items()
+    }
+    return preprocess_obs(obs, observation_space)
+
+
+def make_gradient_step(model: str, policy, observation_space, batch_size: int):
+    """
+    A gradient step on a random minibatch, as done by `DQN.train` or by
+    `DDPG.train`, without the replay buffer sampling.
+    """
+    obs = sample_batch(observation_space, batch_size)
+    next_obs = sample_batch(observation_space, batch_size)
+    rewards = th.randn(batch_size, 1)
+    dones = th.zeros(batch_size, 1)
+    if model == "ddpg":
+        actions = th.rand(batch_size, 1) * 2 - 1
+
+        def step():
+            with th.no_grad():
+                next_actions = policy.actor_target(next_obs)
+                next_q = policy.critic_target(next_obs, next_actions)[0]
+                target_q = rewards + (1 - dones) * 0.99 * next_q
+            critic_loss = F.mse_loss(policy.critic(obs, actions)[0], target_q)
+            policy.critic.optimizer.zero_grad()
+            critic_loss.backward()
+            policy.critic.optimizer.step()
+            actor_loss = -policy.critic.q1_forward(obs, policy.actor(obs)).mean()
+            policy.actor.optimizer.zero_grad()
+            actor_loss.backward()
+            policy.actor.optimizer.step()
+
+    else:
+        actions = th.randint(0, int(policy.action_space.n), (batch_size, 1))
+
+        def step():
+            with th.no_grad():
+                next_q = policy.q_net_target(next_obs).max(dim=1, keepdim=True)[0]
+                target_q = rewards + (1 - dones) * 0.99 * next_q
+            q = th.gather(policy.q_net(obs), dim=1, index=actions)
+            loss = F.smooth_l1_loss(q, target_q)
+            policy.optimizer.zero_grad()
+            loss.backward()
+            policy.optimizer.step()
+
+    return step
+
+
+def count_params(model: str, policy) -> int:
+    if model == "ddpg":
+        modules = (policy.actor, policy.critic)
+    else:
+        modules = (policy.q_net,)
+    return sum(p.numel() for module in modules for p in module.parameters())
+
+
+def latency_ms(policy, observation_space) -> float:
+    """
+    Median latency of `policy.predict` on one observation.
+    """
+    obs = observation_space.sample()
+    for _ in range(3):
+        policy.predict(obs, deterministic=True)
+    times = []
+    for _ in range(args.latency_repeats):
+        t0 = time.perf_counter()
+        policy.predict(obs, deterministic=True)
+        times.append(time.perf_counter() - t0)
+    return float(np.median(times)) * 1000
+
+
+def run(model, extractor, n_frame_stack, ratio, net_arch) -> dict:
+    observation_space = make_observation_space(
+        n_frame_stack, ratio, args.n_entities, channels_first=True
+    )
+    policy = make_policy(model, observation_space, EXTRACTORS[extractor], net_arch)
+    policy.set_training_mode(False)
+    result = {
+        "model": model,
+        "extractor": extractor,
+        "n_frame_stack": n_frame_stack,
+        "frame_downsize_ratio": ratio,
+        "net_arch": net_arch,
+        "frames_shape": list(observation_space["frames"].shape),
+        "params": count_params(model, policy),
+        "latency_ms": latency_ms(policy, observation_space),
+        "train": {},
+    }
+    policy.set_training_mode(True)
+    for batch_size in args.batch_sizes:
+        step = make_gradient_step(model, policy, observation_space, batch_size)
+        with PeakMemorySampler() as sampler:
+            transitions_per_s = throughput(step, batch_size, args.repeats, warmup=1)
+        result["train"][batch_size] = {
+            "transitions_per_s": transitions_per_s,
+            "peak_mb": sampler.peak_bytes / 2**20,
+        }
+    return result
+
+
+results = []
+header = f"{'model':<12}{'extractor':<10}{'stack':>6}{'ratio':>6}{'net_arch':>10}"
+header += f"{'params':>12}{'latency (ms)':>14}"
+for batch_size in args.batch_sizes:
+    header += f"{f'train/s @{batch_size}':>15}"
+header += f"{'peak mem (MB)':>15}"
+print(header)
+for model in args.models:
+    for extractor in args.extractors:
+        for n_frame_stack in args.n_frame_stacks:
+            for ratio in args.frame_downsize_ratios:
+                for net_arch in args.net_archs:
+                    result = run(model, extractor, n_frame_stack, ratio, net_arch)
+                    results.append(result)
+                    row = (
+                        f"{model:<12}{extractor:<10}{n_frame_stack:>6}{ratio:>6.2f}"
+                        f"{','.join(map(str, net_arch)):>10}"
+                        f"{result['params']:>12,}{result['latency_ms']:>14.2f}"
+                    )
+                    for batch_size in args.batch_sizes:
+                        row += f"{result['train'][batch_size]['transitions_per_s']:>15,.1f}"
+                    peak_mb = max(t["peak_mb"] for t in result["train"].values())
+                    print(row + f"{peak_mb:>15,.1f}")
+
+if args.json is not None:
+    with open(args.json, "w") as f:
+        json.dump(
+            {
+                "platform": platform.platform(),
+                "processor": platform.processor(),
+                "torch_version": th.__version__,
+                "torch_threads": th.get_num_threads(),
+                "batch_sizes": args.batch_sizes,
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+    print(f"Saved the results to {args.json}")
@@ -0,0 +1,101 @@
+"""
+Benchmark the sampling overhead of the n-step returns of `models/n_step.py`.
+
+For each number of steps, report the minibatches per second sampled from
+`NStepDictReplayBuffer` and from `PrioritizedDictReplayBuffer`, against the
+1-step buffers, and the minibatches per second of the n-step return
+computation alone. The buffers are filled with random transitions of the
+`Touhou14Env` spaces, with episodes ending at random.
+"""
+
+import argparse
+
+import numpy as np
+from stable_baselines3.common.buffers import DictReplayBuffer
+
+from environment.simulated import SimulatedTouhou14Env
+from models.n_step import NStepDictReplayBuffer, n_step_returns
+from models.prioritized_replay import PrioritizedDictReplayBuffer
+from models.profiling import throughput
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--buffer_size", type=int, default=2000)
+parser.add_argument("--batch_size", type=int, default=32)
+parser.add_argument("--n_steps", type=int, nargs="+", default=[1, 3, 5, 10])
+parser.add_argument("--episode_length", type=int, default=200)
+parser.add_argument("--frame_downsize_ratio", type=float, default=0.5)
+parser.add_argument("--repeats", type=int, default=200)
+args = parser.parse_args()
+
+env = SimulatedTouhou14Env(
+    frame_downsize_ratio=args.frame_downsize_ratio, channels_first=True
+)
+rng = np.random.default_rng(0)
+
+
+def fill(buffer: DictReplayBuffer) -> DictReplayBuffer:
+    for observations in (buffer.observations, buffer.next_observations):
+        for k, obs in observations.items():
+            if obs.dtype == np.uint8:
+                obs[:] = rng.integers(0, 256, obs.shape, dtype=np.uint8)
+            else:
+                obs[:] = rng.standard_normal(obs.shape)
+    buffer.actions[:] = rng.integers(0, env.action_space.n, buffer.actions.shape)
+    buffer.rewards[:] = rng.standard_normal(buffer.rewards.shape)
+    buffer.dones[:] = rng.random(buffer.dones.shape) < 1 / args.episode_length
+    buffer.timeouts[:] = buffer.dones * (rng.random(buffer.dones.shape) < 0.5)
+    buffer.full = True
+    # the write pointer in the middle, to include wrapping around
+    buffer.pos = args.buffer_size // 2
+    return buffer
+
+
+def sample_rate(buffer) -> float:
+    return throughput(lambda: buffer.sample(args.batch_size), 1, args.repeats, warmup=5)
+
+
+spaces = (env.observation_space, env.action_space)
+uniform = sample_rate(fill(DictReplayBuffer(args.buffer_size, *spaces, "cpu")))
+prioritized = fill(PrioritizedDictReplayBuffer(args.buffer_size, *spaces, "cpu"))
+prioritized.sum_tree.update(
+    np.arange(args.buffer_size), rng.exponential(size=args.buffer_size)
+)
+prioritized_rate = sample_rate(prioritized)
+
+print(
+    f"buffer: {args.buffer_size:,}, batch: {args.batch_size}, frames: "
+    f"{env.observation_space['frames'].shape}\n"
+    f"1-step sampling: {uniform:,.0f} batches/s (uniform), "
+    f"{prioritized_rate:,.0f} batches/s (prioritized)\n"
+    f"{'n_steps':>8}{'uniform (batches/s)':>21}{'overhead':>10}"
+    f"{'prioritized (batches/s)':>25}{'overhead':>10}{'returns only (batches/s)':>26}"
+)
+for n_steps in args.n_steps:
+    buffer = fill(
+        NStepDictReplayBuffer(args.buffer_size, *spaces, "cpu", n_steps=n_steps)
+    )
+    n_step_rate = sample_rate(buffer)
+    prioritized.n_steps = n_steps
+    n_step_prioritized_rate = sample_rate(prioritized)
+    batch_inds = rng.integers(0, args.buffer_size, args.batch_size)
+    env_inds = np.zeros(args.batch_size, dtype=np.int64)
+    returns_rate = throughput(
+        lambda: n_step_returns(
+            buffer.rewards,
+            buffer.dones,
+            batch_inds,
+            env_inds,
+            buffer.pos,
+            n_steps,
+            0.99,
+        ),
+        1,
+        args.repeats,
+    )
+    print(
+        f"{n_steps:>8}{n_step_rate:>21,.0f}{uniform / n_step_rate - 1:>10.1%}"
+        f"{n_step_prioritized_rate:>25,.0f}"
+        f"{prioritized_rate / n_step_prioritized_rate - 1:>10.1%}"
+        f"{returns_rate:>26,.0f}"
+    )
@@ -0,0 +1,97 @@
+"""
+Benchmark the gradient steps per second of DQN with and without the
+background minibatch prefetching of `models/prefetch.py`.
+
+The replay buffer is filled with random transitions of the `Touhou14Env`
+spaces (built by `SimulatedTouhou14Env`, no game needed), and `train` is
+called with several gradient steps per call, as after a rollout.
+"""
+
+import argparse
+import time
+
+import numpy as np
+import torch as th
+from stable_baselines3.common.logger import configure
+
+from environment.simulated import SimulatedTouhou14Env
+from models.dqn import DQN
+from models.extractors import TouhouExtractor
+from models.prefetch import PrefetchingReplayBuffer
+from models.prioritized_replay import PrioritizedDictReplayBuffer
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--buffer_size", type=int, default=2000)
+parser.add_argument("--batch_size", type=int, default=32)
+parser.add_argument("--gradient_steps", type=int, default=8)
+parser.add_argument("--calls", type=int, default=10, help="Training calls to time")
+parser.add_argument("--n_prefetch", type=int, nargs="+", default=[1, 2, 4])
+parser.add_argument("--frame_downsize_ratio", type=float, default=0.5)
+parser.add_argument("--prioritized", action="store_true")
+parser.add_argument("--device", type=str, default="cpu")
+args = parser.parse_args()
+
+env = SimulatedTouhou14Env(
+    frame_downsize_ratio=args.frame_downsize_ratio, channels_first=True
+)
+model = DQN(
+    "MultiInputPolicy",
+    env,
+    buffer_size=args.buffer_size,
+    batch_size=args.batch_size,
+    replay_buffer_class=PrioritizedDictReplayBuffer if args.prioritized else None,
+    device=args.device,
+    policy_kwargs=dict(net_arch=(256, 256), features_extractor_class=TouhouExtractor),
+)
+model.set_logger(configure(None, []))
+
+# random transitions filling the whole buffer
+buffer = model.replay_buffer
+rng = np.random.default_rng(0)
+for observations in (buffer.observations, buffer.next_observations):
+    for k, obs in observations.items():
+        if obs.dtype == np.uint8:
+            obs[:] = rng.integers(0, 256, obs.shape, dtype=np.uint8)
+        else:
+            obs[:] = rng.standard_normal(obs.shape)
+buffer.actions[:] = rng.integers(0, env.action_space.n, buffer.actions.shape)
+buffer.rewards[:] = rng.standard_normal(buffer.rewards.shape)
+buffer.full = True
+if args.prioritized:
+    n = buffer.buffer_size * buffer.n_envs
+    buffer.sum_tree.update(np.arange(n), rng.exponential(size=n))
+
+
+def gradient_steps_per_s() -> float:
+    # warm up
+    model.train(args.gradient_steps, args.batch_size)
+    if args.device.startswith("cuda"):
+        th.cuda.synchronize()
+    t0 = time.perf_counter()
+    for _ in range(args.calls):
+        model.train(args.gradient_steps, args.batch_size)
+    if args.device.startswith("cuda"):
+        th.cuda.synchronize()
+    return args.calls * args.gradient_steps / (time.perf_counter() - t0)
+
+
+print(
+    f"{'prioritized' if args.prioritized else 'uniform'} replay, "
+    f"batch {args.batch_size}, {args.gradient_steps} gradient steps per call, "
+    f"frames {buffer.observations['frames'].shape[2:]}, "
+    f"{th.get_num_threads()} torch threads"
+)
+print(f"{'prefetch':>9}{'grad steps/s':>14}{'speedup':>9}{'hit rate':>10}")
+baseline = gradient_steps_per_s()
+print(f"{0:>9}{baseline:>14.1f}{1.0:>9.2f}{'-':>10}")
+for n_prefetch in args.n_prefetch:
+    model.replay_buffer = PrefetchingReplayBuffer(buffer, n_prefetch)
+    rate = gradient_steps_per_s()
+    hits, misses = model.replay_buffer.n_hits, model.replay_buffer.n_misses
+    model.replay_buffer.close()
+    model.replay_buffer = buffer
+    print(
+        f"{n_prefetch:>9}{rate:>14.1f}{rate / baseline:>9.2f}"
+        f"{hits / (hits + misses):>10.0%}"
+    )
@@ -0,0 +1,40 @@
+"""
+Benchmark batched sampling and priority updates of the prioritized replay
+sum tree against uniform sampling.
+"""
+
+import argparse
+
+import numpy as np
+
+from models.prioritized_replay import SumTree
+from models.profiling import throughput
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--capacity", type=int, default=1_000_000)
+parser.add_argument("--batch_sizes", type=int, nargs="+", default=[32, 64, 256])
+parser.add_argument("--repeats", type=int, default=200)
+args = parser.parse_args()
+
+tree = SumTree(args.capacity)
+tree.update(np.arange(args.capacity), np.random.exponential(size=args.capacity))
+
+print(
+    f"capacity: {args.capacity:,}\n"
+    f"{'batch':>7}{'uniform (samples/s)':>22}{'sum tree (samples/s)':>23}"
+    f"{'update (samples/s)':>21}"
+)
+for batch_size in args.batch_sizes:
+    indices = tree.sample(batch_size)
+    priorities = np.random.exponential(size=batch_size)
+    uniform = throughput(
+        lambda: np.random.randint(0, args.capacity, size=batch_size),
+        batch_size,
+        args.repeats,
+    )
+    sample = throughput(lambda: tree.sample(batch_size), batch_size, args.repeats)
+    update = throughput(
+        lambda: tree.update(indices, priorities), batch_size, args.repeats
+    )
+    print(f"{batch_size:>7}{uniform:>22,.0f}{sample:>23,.0f}{update:>21,.0f}")
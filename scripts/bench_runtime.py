@@ -0,0 +1,113 @@
+"""
+Sweep PyTorch thread budgets with the env and the learner running at the
+same time, and report the env steps per second and the gradient steps per
+second of each budget.
+
+The env is stepped by the main thread with random actions, while a learner
+thread runs DQN gradient steps on a replay buffer of random transitions. The
+env is `SimulatedTouhou14Env` by default, pass `--live` to step the game
+instead. The placement arguments of `environment/runtime.py` (e.g.,
+`--env_cpus`, `--learner_cpus`, `--game_cpus`) apply to every budget.
+"""
+
+import argparse
+import threading
+import time
+
+import numpy as np
+import torch as th
+from stable_baselines3.common.logger import configure
+
+from environment.runtime import (
+    add_runtime_args,
+    configure_from_args,
+    pin_current_thread,
+)
+from models.dqn import DQN
+from models.extractors import TouhouExtractor
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "--budgets",
+    type=int,
+    nargs="+",
+    default=[1, 2, 4],
+    help="PyTorch intra-op threads to sweep",
+)
+parser.add_argument("--duration", type=float, default=20.0, help="Seconds per budget")
+parser.add_argument("--buffer_size", type=int, default=2000)
+parser.add_argument("--batch_size", type=int, default=32)
+parser.add_argument("--live", action="store_true", help="Step the game")
+add_runtime_args(parser)
+args = parser.parse_args()
+
+if args.live:
+    # the interface attaches to the game when imported
+    from environment.environment import Touhou14Env
+
+    env = Touhou14Env(channels_first=True)
+else:
+    from environment.simulated import SimulatedTouhou14Env
+
+    env = SimulatedTouhou14Env(channels_first=True)
+placement = configure_from_args(args)
+
+model = DQN(
+    "MultiInputPolicy",
+    env,
+    buffer_size=args.buffer_size,
+    batch_size=args.batch_size,
+    device="cpu",
+    policy_kwargs=dict(net_arch=(256, 256), features_extractor_class=TouhouExtractor),
+)
+model.set_logger(configure(None, []))
+buffer = model.replay_buffer
+rng = np.random.default_rng(0)
+for observations in (buffer.observations, buffer.next_observations):
+    for k, obs in observations.items():
+        if obs.dtype == np.uint8:
+            obs[:] = rng.integers(0, 256, obs.shape, dtype=np.uint8)
+        else:
+            obs[:] = rng.standard_normal(obs.shape)
+buffer.actions[:] = rng.integers(0, env.action_space.n, buffer.actions.shape)
+buffer.full = True
+
+
+def learner(stop: threading.Event, counter: list[int]) -> None:
+    if args.learner_cpus is not None:
+        pin_current_thread(args.learner_cpus)
+    while not stop.is_set():
+        model.train(1, args.batch_size)
+        counter[0] += 1
+
+
+def run(budget: int) -> tuple[float, float]:
+    th.set_num_threads(budget)
+    model.train(1, args.batch_size)  # warm up
+    stop = threading.Event()
+    gradient_steps = [0]
+    thread = threading.Thread(target=learner, args=(stop, gradient_steps))
+    env.reset()
+    env_steps = 0
+    t0 = time.perf_counter()
+    thread.start()
+    while time.perf_counter() - t0 < args.duration:
+        _, _, terminated, truncated, _ = env.step(env.action_space.sample())
+        env_steps += 1
+        if terminated or truncated:
+            env.reset()
+    stop.set()
+    thread.join()
+    elapsed = time.perf_counter() - t0
+    return env_steps / elapsed, gradient_steps[0] / elapsed
+
+
+try:
+    print(f"placement: {placement}")
+    print(f"{'torch threads':>14}{'env steps/s':>13}{'grad steps/s':>14}")
+    for budget in args.budgets:
+        env_rate, gradient_rate = run(budget)
+        print(f"{budget:>14}{env_rate:>13.1f}{gradient_rate:>14.1f}")
+finally:
+    env.close()
@@ -0,0 +1,86 @@
+"""
+Benchmark the memory scanner on a synthetic memory image: a module image and
+heap regions of zeros, small integers, floats and pointers, with a variable
+planted behind a pointer chain. Times the scans narrowing it down and the
+pointer path search, and checks that the planted address and path are found.
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from environment.memory import SimulatedMemory
+from environment.scanner import MemoryScanner, find_pointer_paths, pointer_map
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--heap_mb", type=int, default=256, help="Size of the heap")
+parser.add_argument("--n_heap_regions", type=int, default=16)
+parser.add_argument("--max_depth", type=int, default=3)
+parser.add_argument("--seed", type=int, default=0)
+args = parser.parse_args()
+
+rng = np.random.default_rng(args.seed)
+memory = SimulatedMemory()
+module_size = 0x100000
+heap_start = 0x10000000
+region_size = (args.heap_mb << 20) // args.n_heap_regions
+# leave gaps between the regions
+heap_regions = [heap_start + 2 * i * region_size for i in range(args.n_heap_regions)]
+
+
+def random_words(n: int) -> bytes:
+    kind = rng.random(n)
+    words = np.zeros(n, dtype=np.uint32)
+    small = (kind > 0.6) & (kind <= 0.8)
+    words[small] = rng.integers(0, 1000, small.sum())
+    floats = (kind > 0.8) & (kind <= 0.95)
+    words[floats] = rng.normal(0, 100, floats.sum()).astype(np.float32).view(np.uint32)
+    pointers = kind > 0.95
+    words[pointers] = rng.choice(heap_regions, pointers.sum()) + 4 * rng.integers(
+        0, region_size // 4, pointers.sum()
+    )
+    return words.tobytes()
+
+
+memory.map(memory.base_address, random_words(module_size // 4))
+for start in heap_regions:
+    memory.map(start, random_words(region_size // 4))
+
+# module + 0xDB544 -> manager, manager + 0xD0 -> boss, boss + 0x11F0 = lives
+path = (0xDB544, 0xD0, 0x11F0)
+manager = heap_start + 0x1000
+boss = heap_start + 6 * region_size + 0x2000
+lives = boss + path[2]
+memory.write_ptr(memory.base_address + path[0], manager)
+memory.write_ptr(manager + path[1], boss)
+
+print(f"{args.heap_mb} MB of heap in {args.n_heap_regions} regions")
+scanner = MemoryScanner(memory, "int32")
+for value in (3, 2, 1):
+    memory.write(lives, np.int32(value).tobytes())
+    t0 = time.perf_counter()
+    n = scanner.exact(value)
+    print(f"exact {value}: {n:>10,} candidates in {time.perf_counter() - t0:.3f} s")
+
+scanner = MemoryScanner(memory, "int32")
+t0 = time.perf_counter()
+scanner.start()
+print(f"start:      snapshot in {time.perf_counter() - t0:.3f} s")
+for scan, value in (("changed", 0), ("unchanged", None), ("changed", 1)):
+    if value is not None:
+        memory.write(lives, np.int32(value).tobytes())
+    t0 = time.perf_counter()
+    n = getattr(scanner, scan)()
+    print(f"{scan}: {n:>10,} candidates in {time.perf_counter() - t0:.3f} s")
+assert lives in scanner.addresses()
+
+t0 = time.perf_counter()
+pointers = pointer_map(memory)
+print(f"pointer map: {len(pointers[0]):,} pointers in {time.perf_counter() - t0:.3f} s")
+t0 = time.perf_counter()
+paths = find_pointer_paths(memory, lives, args.max_depth, pointers=pointers)
+print(f"pointer paths: {len(paths):,} paths in {time.perf_counter() - t0:.3f} s")
+assert path in paths, "planted path not found"
+print(f"planted path found: {tuple(hex(x) for x in path)}")
@@ -1,6 +1,9 @@
 from stable_baselines3 import DQN
 from models.ddpg import DDPG
 from environment.environment import Touhou14Env
+from environment import tracing
+from environment.telemetry import TelemetryWrapper
+from environment.runtime import add_runtime_args, configure_from_args
 from environment.ddpg_action_wrapper import DiscretizeActionWrapper
 import argparse
 import json
@@ -16,10 +19,42 @@ parser.add_argument(
 parser.add_argument(
     "--algorithm", "-a", type=str, default="dqn", help="Algorithm, dqn or ddpg"
 )
+parser.add_argument(
+    "--channels_first",
+    action="store_true",
+    help="Emit (n_frame_stack, H, W) frames, which SB3 does not need to transpose",
+)
+parser.add_argument(
+    "--repeat_choices",
+    type=int,
+    nargs="+",
+    default=None,
+    help="Repeat choices of the evaluated model",
+)
+parser.add_argument(
+    "--trace",
+    type=str,
+    default=None,
+    help="Record a timeline of the run and save it as Chrome trace JSON to this path",
+)
+parser.add_argument(
+    "--telemetry_dir",
+    type=str,
+    default=None,
+    help="Record the info of every step to this telemetry store folder",
+)
+add_runtime_args(parser)
 args = parser.parse_args()
+if args.trace is not None:
+    tracing.enable()
+configure_from_args(args)
 
 try:
-    env = Touhou14Env()
+    env = Touhou14Env(
+        channels_first=args.channels_first, repeat_choices=args.repeat_choices
+    )
+    if args.telemetry_dir is not None:
+        env = TelemetryWrapper(env, args.telemetry_dir)
 
     if args.algorithm == "dqn":
         model = DQN.load(args.save_path)
@@ -50,16 +85,21 @@ try:
         total_damages.append(total_damage)
         if terminated:
             clear_times += 1
+    lockstep_stats = env.unwrapped.get_lockstep_stats()
+    print(f"\033[96mLockstep stats: {lockstep_stats}\033[0m")
     with open(args.save_path.split(".")[0] + "-eval_results.json", "w") as f:
         json.dump(
             {
                 "total_rewards": total_rewards,
                 "total_damages": total_damages,
                 "clear_times": clear_times,
+                "lockstep_stats": lockstep_stats,
             },
             f,
         )
 finally:
+    if args.trace is not None:
+        tracing.dump(args.trace)
     if "env" in locals():
         print("\033[96mQuitting...\033[0m")
         env.close()
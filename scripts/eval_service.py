@@ -0,0 +1,187 @@
+"""
+Evaluate the checkpoints of a training run as they are saved.
+
+Run it in its own process next to the training, e.g.,
+
+    python scripts/eval_service.py --save_dir ./save/dqn_<timestamp>
+
+It polls the save folder for `model_*.zip` checkpoints and evaluates each of
+them on its own env instance, or on `SimulatedTouhou14Env` with
+`--simulated` for smoke tests. One JSON line per episode is appended to
+`eval_results.jsonl` in the save folder, so that a restarted service skips
+the episodes already evaluated. It exits after the final model has been
+evaluated.
+"""
+
+import argparse
+import glob
+import json
+import os
+import re
+import time
+import zipfile
+
+from environment.ddpg_action_wrapper import DiscretizeActionWrapper
+from models.ddpg import DDPG
+from models.dqn import DQN
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "--save_dir", "-d", type=str, required=True, help="Save folder of the run"
+)
+parser.add_argument(
+    "--episodes", "-n", type=int, default=1, help="Episodes per checkpoint"
+)
+parser.add_argument(
+    "--algorithm", "-a", type=str, default="dqn", help="Algorithm, dqn or ddpg"
+)
+parser.add_argument(
+    "--poll_interval", type=float, default=30.0, help="Seconds between polls"
+)
+parser.add_argument(
+    "--once",
+    action="store_true",
+    help="Evaluate the checkpoints already saved and exit",
+)
+parser.add_argument(
+    "--simulated",
+    action="store_true",
+    help="Evaluate on the simulated env, which needs no game",
+)
+parser.add_argument(
+    "--device", type=str, default="cpu", help="Leave the GPU to the training"
+)
+args = parser.parse_args()
+
+if args.algorithm not in ("dqn", "ddpg"):
+    raise ValueError("Invalid algorithm, should be dqn or ddpg")
+
+results_path = os.path.join(args.save_dir, "eval_results.jsonl")
+_CHECKPOINT_PATTERN = re.compile(r"model_(?:(\d+)_steps|final)\.zip$")
+
+
+def list_checkpoints() -> list[tuple[float, str]]:
+    """
+    (steps, path) of the saved checkpoints, the final model being the last.
+    """
+    checkpoints = []
+    for path in glob.glob(os.path.join(args.save_dir, "model_*.zip")):
+        m = _CHECKPOINT_PATTERN.search(path)
+        if m is not None:
+            steps = float("inf") if m.group(1) is None else int(m.group(1))
+            checkpoints.append((steps, path))
+    return sorted(checkpoints)
+
+
+def load_done_episodes() -> dict[str, int]:
+    """
+    Number of episodes already evaluated for each checkpoint.
+    """
+    done = {}
+    if os.path.exists(results_path):
+        with open(results_path) as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except json.JSONDecodeError:
+                    # a line cut short by a crash
+                    continue
+                done[result["checkpoint"]] = done.get(result["checkpoint"], 0) + 1
+    return done
+
+
+def make_env():
+    metadata = {}
+    metadata_path = os.path.join(args.save_dir, "metadata.json")
+    if os.path.exists(metadata_path):
+        with open(metadata_path) as f:
+            metadata = json.load(f)
+    env_kwargs = dict(
+        channels_first=metadata.get("channels_first", False),
+        repeat_choices=metadata.get("repeat_choices"),
+    )
+    if args.simulated:
+        from environment.simulated import SimulatedTouhou14Env
+
+        env = SimulatedTouhou14Env(**env_kwargs)
+    else:
+        # the interface attaches to the game when imported
+        from environment.environment import Touhou14Env
+
+        env = Touhou14Env(**env_kwargs)
+    if args.algorithm == "ddpg":
+        env = DiscretizeActionWrapper(env)
+    return env
+
+
+def evaluate_episode(model, env) -> dict:
+    obs, info = env.reset()
+    total_reward = 0.0
+    length = 0
+    frames = 0
+    while True:
+        action, _states = model.predict(obs, deterministic=True)
+        obs, reward, terminated, truncated, info = env.step(action)
+        total_reward += float(reward)
+        length += 1
+        frames += info["action_repeat"]
+        if terminated or truncated:
+            break
+    final_boss_hp = info["boss_hp"]
+    return {
+        "total_reward": total_reward,
+        "total_damage": 1500 if final_boss_hp == 9999 else 1500 - final_boss_hp,
+        "cleared": bool(terminated),
+        "length": length,
+        "frames": frames,
+    }
+
+
+def evaluate_checkpoint(env, path: str, n_done: int) -> bool:
+    """
+    Evaluate the remaining episodes of a checkpoint. Return False if it can't
+    be loaded yet, e.g., when it is still being written.
+    """
+    algorithm_class = DQN if args.algorithm == "dqn" else DDPG
+    try:
+        model = algorithm_class.load(path, device=args.device)
+    except (zipfile.BadZipFile, EOFError, ValueError, RuntimeError) as e:
+        print(f"\033[93mCannot load {path} yet: {e}\033[0m")
+        return False
+    name = os.path.basename(path)
+    for episode in range(n_done, args.episodes):
+        t0 = time.perf_counter()
+        result = evaluate_episode(model, env)
+        result = {
+            "checkpoint": name,
+            "num_timesteps": model.num_timesteps,
+            "episode": episode,
+            **result,
+            "wall_time": time.perf_counter() - t0,
+        }
+        with open(results_path, "a") as f:
+            f.write(json.dumps(result) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        print(f"\033[96m{result}\033[0m")
+    return True
+
+
+try:
+    env = make_env()
+    while True:
+        done = load_done_episodes()
+        final_done = False
+        for steps, path in list_checkpoints():
+            n_done = done.get(os.path.basename(path), 0)
+            if n_done < args.episodes and not evaluate_checkpoint(env, path, n_done):
+                continue
+            final_done = final_done or steps == float("inf")
+        if final_done or args.once:
+            break
+        time.sleep(args.poll_interval)
+finally:
+    if "env" in locals():
+        print("\033[96mQuitting...\033[0m")
+        env.close()
@@ -0,0 +1,320 @@
+"""
+Score the DQN checkpoints of a training run offline, on a fixed set of
+recorded transitions, to pick the few worth evaluating on the game.
+
+    python scripts/score_checkpoints.py --save_dir ./save/dqn_<timestamp>
+
+The transitions are read from the replay buffer chunks of the run
+(`<save_dir>/replay`, see `ReplayCheckpointCallback`), or from `--transitions`,
+either such a folder of chunks or an `.npz` file with the same keys, e.g.,
+saved by a previous run of this script with `--save_transitions`, so that
+checkpoints of different runs are scored on the same set.
+
+Every checkpoint runs its Q-network over all the transitions in large
+batches, the checkpoints being loaded and run by a pool of worker processes
+sharing the transitions through memory-mapped files. For each checkpoint, it
+reports the statistics of the Q-values, the agreement of its greedy actions
+with the recorded ones, and the 1-step TD error of its Q-network against the
+recorded rewards, with its target network as in training. It also reports
+the agreement of the greedy actions between each pair of checkpoints, and
+ranks the checkpoints. The results are saved as JSON.
+"""
+
+import argparse
+import glob
+import json
+import os
+import re
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import torch as th
+
+from models.callbacks import list_replay_chunks
+from models.dqn import DQN
+
+
+_CHECKPOINT_PATTERN = re.compile(r"model_(?:(\d+)_steps|final)\.zip$")
+_FIELDS = ("actions", "rewards", "dones", "timeouts")
+
+
+def list_checkpoints(save_dir: str) -> list[str]:
+    checkpoints = []
+    for path in glob.glob(os.path.join(save_dir, "model_*.zip")):
+        m = _CHECKPOINT_PATTERN.search(path)
+        if m is not None:
+            steps = float("inf") if m.group(1) is None else int(m.group(1))
+            checkpoints.append((steps, path))
+    return [path for _, path in sorted(checkpoints)]
+
+
+def _sample(n: int, max_transitions: int, seed: int) -> np.ndarray:
+    if max_transitions <= 0 or n <= max_transitions:
+        return np.arange(n)
+    rng = np.random.default_rng(seed)
+    return np.sort(rng.choice(n, max_transitions, replace=False))
+
+
+def load_transitions(
+    path: str, max_transitions: int = 0, seed: int = 0
+) -> dict[str, np.ndarray]:
+    """
+    Up to `max_transitions` random transitions of a folder of replay chunks
+    or of an `.npz` file, flattened over the envs. Of the chunks, only the
+    latest write of each buffer slot is used.
+    """
+    if not os.path.isdir(path):
+        with np.load(path) as f:
+            transitions = {k: f[k] for k in f.files}
+        indices = _sample(len(transitions["actions"]), max_transitions, seed)
+        return {k: a[indices] for k, a in transitions.items()}
+
+    chunks = list_replay_chunks(path)
+    if not chunks:
+        raise ValueError(f"No replay chunks in {path}")
+    # slot -> (chunk, row)
+    latest = {}
+    for i, chunk_path in enumerate(chunks):
+        with np.load(chunk_path) as chunk:
+            for row, position in enumerate(chunk["positions"]):
+                latest[int(position)] = (i, row)
+    slots = sorted(latest)
+    selected = [latest[slots[j]] for j in _sample(len(slots), max_transitions, seed)]
+    parts = {}
+    for i, chunk_path in enumerate(chunks):
+        rows = [row for chunk_index, row in selected if chunk_index == i]
+        if not rows:
+            continue
+        # one chunk in memory at a time
+        with np.load(chunk_path) as chunk:
+            for k in chunk.files:
+                if (
+                    k.startswith(("observations.", "next_observations."))
+                    or k in _FIELDS
+                ):
+                    parts.setdefault(k, []).append(chunk[k][rows])
+    # (slots, n_envs, ...) -> (slots * n_envs, ...)
+    return {k: np.concatenate(a).reshape(-1, *a[0].shape[2:]) for k, a in parts.items()}
+
+
+def _init_worker(arrays_dir: str, threads: int) -> None:
+    global _transitions
+    th.set_num_threads(threads)
+    # memory-mapped, so that the workers share the pages of the files
+    _transitions = {
+        os.path.basename(path)[: -len(".npy")]: np.load(path, mmap_mode="r")
+        for path in glob.glob(os.path.join(arrays_dir, "*.npy"))
+    }
+
+
+def _forward(net, prefix: str, start: int, stop: int) -> th.Tensor:
+    obs = {
+        k[len(prefix) + 1 :]: th.as_tensor(np.array(a[start:stop]))
+        for k, a in _transitions.items()
+        if k.startswith(prefix + ".")
+    }
+    return net(obs)
+
+
+def score_checkpoint(path: str, batch_size: int) -> tuple[dict, np.ndarray]:
+    """
+    Run in a worker: greedy actions and statistics of a checkpoint.
+    """
+    model = DQN.load(path, device="cpu")
+    policy = model.policy
+    policy.set_training_mode(False)
+    # copied out of the memory-mapped files
+    actions = _transitions["actions"].reshape(-1).astype(np.int64)
+    rewards = np.array(_transitions["rewards"], dtype=np.float32).reshape(-1)
+    # only the terminations stop the bootstrapping
+    dones = (_transitions["dones"] * (1 - _transitions["timeouts"])).reshape(-1)
+    dones = dones.astype(np.float32)
+    has_next = any(k.startswith("next_observations.") for k in _transitions)
+    max_q, recorded_q, greedy, td_errors = [], [], [], []
+    with th.no_grad():
+        for start in range(0, len(actions), batch_size):
+            stop = start + batch_size
+            q = _forward(policy.q_net, "observations", start, stop)
+            max_q.append(q.max(dim=1).values)
+            greedy.append(q.argmax(dim=1))
+            q_taken = q.gather(1, th.as_tensor(actions[start:stop])[:, None])[:, 0]
+            recorded_q.append(q_taken)
+            if has_next:
+                next_q = _forward(policy.q_net_target, "next_observations", start, stop)
+                target = (
+                    th.as_tensor(rewards[start:stop])
+                    + (1 - th.as_tensor(dones[start:stop]))
+                    * model.gamma
+                    * next_q.max(dim=1).values
+                )
+                td_errors.append(q_taken - target)
+    max_q = th.cat(max_q).numpy()
+    greedy = th.cat(greedy).numpy()
+    result = {
+        "checkpoint": os.path.basename(path),
+        "num_timesteps": int(model.num_timesteps),
+        "mean_max_q": float(max_q.mean()),
+        "std_max_q": float(max_q.std()),
+        "min_max_q": float(max_q.min()),
+        "max_max_q": float(max_q.max()),
+        "mean_recorded_q": float(th.cat(recorded_q).mean()),
+        "recorded_agreement": float((greedy == actions).mean()),
+        "action_counts": np.bincount(greedy, minlength=policy.action_space.n).tolist(),
+    }
+    if has_next:
+        td_errors = th.cat(td_errors).numpy()
+        result["td_error"] = float(np.abs(td_errors).mean())
+        result["td_rmse"] = float(np.sqrt((td_errors**2).mean()))
+    return result, greedy
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--save_dir", "-d", type=str, default=None, help="Save folder of the run"
+    )
+    parser.add_argument(
+        "--checkpoints",
+        type=str,
+        nargs="+",
+        default=None,
+        help="Checkpoints to score, instead of those of --save_dir",
+    )
+    parser.add_argument(
+        "--transitions",
+        type=str,
+        default=None,
+        help="Folder of replay chunks or .npz file, <save_dir>/replay by default",
+    )
+    parser.add_argument(
+        "--max_transitions",
+        type=int,
+        default=2000,
+        help="Transitions sampled from the recorded ones, 0 for all of them",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--save_transitions",
+        type=str,
+        default=None,
+        help="Save the sampled transitions to this .npz file, to score other runs on them",
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=128,
+        help="Forward pass batch, limited by the memory of the workers with full-size frames",
+    )
+    parser.add_argument("--workers", type=int, default=2, help="Worker processes")
+    parser.add_argument(
+        "--threads", type=int, default=1, help="PyTorch threads of each worker"
+    )
+    parser.add_argument(
+        "--rank_by",
+        type=str,
+        default="td_error",
+        choices=["td_error", "recorded_agreement", "mean_max_q"],
+        help="Metric ranking the checkpoints, the TD error being the lower the better",
+    )
+    parser.add_argument("--top", type=int, default=5, help="Checkpoints to recommend")
+    parser.add_argument(
+        "--output",
+        "-o",
+        type=str,
+        default=None,
+        help="JSON results, <save_dir>/checkpoint_scores.json by default",
+    )
+    args = parser.parse_args()
+    if args.save_dir is None and (
+        args.checkpoints is None or args.transitions is None or args.output is None
+    ):
+        parser.error(
+            "--checkpoints, --transitions and --output are required without --save_dir"
+        )
+
+    checkpoints = args.checkpoints or list_checkpoints(args.save_dir)
+    if not checkpoints:
+        raise ValueError("No checkpoints to score")
+    transitions_path = args.transitions or os.path.join(args.save_dir, "replay")
+    transitions = load_transitions(transitions_path, args.max_transitions, args.seed)
+    n_transitions = len(transitions["actions"])
+    print(
+        f"\033[96mScoring {len(checkpoints)} checkpoints on {n_transitions} "
+        f"transitions from {transitions_path}\033[0m"
+    )
+    if args.save_transitions is not None:
+        np.savez(args.save_transitions, **transitions)
+    if args.rank_by == "td_error" and not any(
+        k.startswith("next_observations.") for k in transitions
+    ):
+        raise ValueError("Ranking by TD error needs the next observations")
+
+    with tempfile.TemporaryDirectory() as arrays_dir:
+        for k, a in transitions.items():
+            np.save(os.path.join(arrays_dir, f"{k}.npy"), a)
+        del transitions
+        with ProcessPoolExecutor(
+            max_workers=args.workers,
+            initializer=_init_worker,
+            initargs=(arrays_dir, args.threads),
+        ) as executor:
+            futures = [
+                executor.submit(score_checkpoint, path, args.batch_size)
+                for path in checkpoints
+            ]
+            results, greedy_actions = zip(*(future.result() for future in futures))
+
+    # agreement of the greedy actions between each pair of checkpoints
+    greedy_actions = np.stack(greedy_actions)
+    agreement = (greedy_actions[:, None, :] == greedy_actions[None, :, :]).mean(axis=2)
+
+    has_td = "td_error" in results[0]
+    print(
+        f"{'checkpoint':<28}{'mean max Q':>12}{'std max Q':>11}{'recorded Q':>12}"
+        f"{'agreement':>11}" + (f"{'|TD|':>9}{'TD RMSE':>9}" if has_td else "")
+    )
+    for result in results:
+        row = (
+            f"{result['checkpoint']:<28}{result['mean_max_q']:>12.2f}"
+            f"{result['std_max_q']:>11.2f}{result['mean_recorded_q']:>12.2f}"
+            f"{result['recorded_agreement']:>11.1%}"
+        )
+        if has_td:
+            row += f"{result['td_error']:>9.2f}{result['td_rmse']:>9.2f}"
+        print(row)
+
+    print("\nGreedy action agreement between checkpoints:")
+    labels = [f"#{i}" for i in range(len(results))]
+    print(" " * 6 + "".join(f"{label:>7}" for label in labels))
+    for label, row in zip(labels, agreement):
+        print(f"{label:<6}" + "".join(f"{a:>7.0%}" for a in row))
+
+    ranked = sorted(
+        results,
+        key=lambda result: result[args.rank_by],
+        reverse=args.rank_by != "td_error",
+    )
+    top = [result["checkpoint"] for result in ranked[: args.top]]
+    print(f"\n\033[96mTop {len(top)} by {args.rank_by}: {', '.join(top)}\033[0m")
+
+    output = args.output or os.path.join(args.save_dir, "checkpoint_scores.json")
+    with open(output, "w") as f:
+        json.dump(
+            {
+                "transitions": transitions_path,
+                "n_transitions": n_transitions,
+                "results": list(results),
+                "agreement": agreement.tolist(),
+                "rank_by": args.rank_by,
+                "top": top,
+            },
+            f,
+            indent=2,
+        )
+    print(f"Saved the scores to {output}")
+
+
+if __name__ == "__main__":
+    # the workers import this module
+    main()
@@ -1,56 +1,201 @@
 from stable_baselines3.common.noise import NormalActionNoise
-from stable_baselines3.common.callbacks import CheckpointCallback
+from stable_baselines3.common.torch_layers import CombinedExtractor
 from stable_baselines3.common.logger import configure
-from environment.environment import Touhou14Env
+from environment import tracing
+from environment.runtime import add_runtime_args, configure_from_args
+from models.callbacks import (
+    ReplayCheckpointCallback,
+    ThroughputCallback,
+    find_latest_checkpoint,
+    load_replay_chunks,
+)
+from models.augmentation import AugmentedDictReplayBuffer
 from models.ddpg import DDPG
+from models.extractors import TouhouExtractor
+from models.prefetch import PrefetchingReplayBuffer
 from environment.ddpg_action_wrapper import DiscretizeActionWrapper
 from datetime import datetime
 import os
+import argparse
+import json
 import numpy as np
 
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "--memory",
+    "-m",
+    type=int,
+    default=10000,
+    help="Replay memory size. This should be limited to your available RAM",
+)
+parser.add_argument(
+    "--steps", "-n", type=int, default=50000, help="Number of training steps"
+)
+parser.add_argument(
+    "--resume",
+    type=str,
+    default=None,
+    help="Save folder of an interrupted run to resume from its latest checkpoint",
+)
+parser.add_argument(
+    "--gradient_steps",
+    type=int,
+    default=1,
+    help="Gradient steps after each rollout, -1 for as many as env steps",
+)
+parser.add_argument(
+    "--extractor",
+    type=str,
+    default="combined",
+    choices=["combined", "touhou"],
+    help="Features extractor, SB3's CombinedExtractor or the cheaper TouhouExtractor",
+)
+parser.add_argument(
+    "--prefetch",
+    type=int,
+    default=0,
+    help="Minibatches sampled in the background during the gradient steps, 0 to disable",
+)
+parser.add_argument(
+    "--shift_pad",
+    type=int,
+    default=0,
+    help="Randomly shift the sampled frames by up to this many pixels (DrQ), 0 to disable",
+)
+parser.add_argument(
+    "--channels_first",
+    action="store_true",
+    help="Emit (n_frame_stack, H, W) frames, which SB3 does not need to transpose",
+)
+parser.add_argument(
+    "--repeat_choices",
+    type=int,
+    nargs="+",
+    default=None,
+    help="Let the agent pick how many frames to repeat each action for among these, e.g., 4 8 16",
+)
+parser.add_argument(
+    "--trace",
+    type=str,
+    default=None,
+    help="Record a timeline of the run and save it as Chrome trace JSON to this path",
+)
+parser.add_argument(
+    "--simulated",
+    action="store_true",
+    help="Step the simulated env instead of the game",
+)
+parser.add_argument(
+    "--device", type=str, default="cuda", help="Device of the model, e.g., cuda or cpu"
+)
+add_runtime_args(parser)
+args = parser.parse_args()
+if args.trace is not None:
+    tracing.enable()
+configure_from_args(args)
+
 # Set up hyperparameters similar to DQN
-buffer_size = 10000  # Replay memory size similar to DQN
+buffer_size = args.memory  # Replay memory size similar to DQN
 batch_size = 64  # Mini-batch size
 learning_rate = 0.005  # Learning rate similar to DQN
 train_freq = (10, "step")  # Training frequency
-total_timesteps = 50000  # Number of training steps
+total_timesteps = args.steps  # Number of training steps
 exploration_noise = 0.1  # Action noise to promote exploration
 
 # Set up save directory
-save_dir = f"./save/ddpg_{datetime.strftime(datetime.now(), '%Y-%m-%d_%H-%M-%S')}"
-if not os.path.exists(save_dir):
-    os.makedirs(save_dir)
+timestamp = datetime.strftime(datetime.now(), "%Y-%m-%d_%H-%M-%S")
+if args.resume is None:
+    save_dir = f"./save/ddpg_{timestamp}"
+    if not os.path.exists(save_dir):
+        os.makedirs(save_dir)
+    # Record the training config, which the eval service builds its env from
+    with open(os.path.join(save_dir, "metadata.json"), "w") as f:
+        json.dump(vars(args), f)
+    log_dir = save_dir
+else:
+    save_dir = args.resume
+    # Do not overwrite the logs of the interrupted run
+    log_dir = os.path.join(save_dir, f"resume_{timestamp}")
 
 # Set up environment and wrapper
-env = Touhou14Env()
+if args.simulated:
+    from environment.simulated import SimulatedTouhou14Env
+
+    env = SimulatedTouhou14Env(
+        channels_first=args.channels_first, repeat_choices=args.repeat_choices
+    )
+else:
+    # The interface attaches to the game when imported
+    from environment.environment import Touhou14Env
+
+    env = Touhou14Env(
+        channels_first=args.channels_first, repeat_choices=args.repeat_choices
+    )
 wrapped_env = DiscretizeActionWrapper(env)
 
 # Configure logger and checkpoint callback
-logger = configure(save_dir, ["csv", "stdout"])
-chkpt_callback = CheckpointCallback(
+logger = configure(log_dir, ["csv", "stdout"])
+chkpt_callback = ReplayCheckpointCallback(
     save_freq=total_timesteps // 10, save_path=save_dir, name_prefix="model", verbose=2
 )
+throughput_callback = ThroughputCallback(
+    frames_per_step=env.action_repeat,
+    checkpoint_callback=chkpt_callback,
+    verbose=1,
+)
 
 # Set up action noise for exploration
 action_dim = wrapped_env.action_space.shape[0]
 action_noise = NormalActionNoise(
     mean=np.zeros(action_dim),
-    sigma=exploration_noise * np.ones(action_dim) * wrapped_env.action_space.high[0],
+    sigma=exploration_noise * np.ones(action_dim) * wrapped_env.action_space.high,
 )
 
-# Initialize the DDPG model with hyperparameters similar to the DQN
-model = DDPG(
-    "MultiInputPolicy",
-    wrapped_env,
-    buffer_size=buffer_size,
-    batch_size=batch_size,
-    train_freq=train_freq,
-    learning_rate=learning_rate,
-    action_noise=action_noise,
-    verbose=1,
-    device="cuda",
-    stats_window_size=5,
-)
+if args.resume is not None:
+    # Restore the model, optimizers and step counters, then the replay buffer
+    model = DDPG.load(
+        find_latest_checkpoint(save_dir),
+        env=wrapped_env,
+        device=args.device,
+        action_noise=action_noise,
+    )
+    n_chunks = load_replay_chunks(model.replay_buffer, chkpt_callback.replay_path)
+    print(
+        f"Resuming from step {model.num_timesteps}, "
+        f"{model.replay_buffer.size()} transitions from {n_chunks} chunks"
+    )
+else:
+    # Random shifts of the sampled frames
+    if args.shift_pad > 0:
+        replay_buffer_class = AugmentedDictReplayBuffer
+        replay_buffer_kwargs = dict(shift_pad=args.shift_pad)
+    else:
+        replay_buffer_class, replay_buffer_kwargs = None, None
+    # Initialize the DDPG model with hyperparameters similar to the DQN
+    model = DDPG(
+        "MultiInputPolicy",
+        wrapped_env,
+        buffer_size=buffer_size,
+        batch_size=batch_size,
+        train_freq=train_freq,
+        gradient_steps=args.gradient_steps,
+        learning_rate=learning_rate,
+        action_noise=action_noise,
+        replay_buffer_class=replay_buffer_class,
+        replay_buffer_kwargs=replay_buffer_kwargs,
+        policy_kwargs=dict(
+            features_extractor_class=(
+                TouhouExtractor if args.extractor == "touhou" else CombinedExtractor
+            ),
+        ),
+        verbose=1,
+        device=args.device,
+        stats_window_size=5,
+    )
+
+if args.prefetch > 0:
+    # Sample the next minibatches during the gradient steps
+    model.replay_buffer = PrefetchingReplayBuffer(model.replay_buffer, args.prefetch)
 
 # Set logger
 model.set_logger(logger)
@@ -58,7 +203,10 @@ model.set_logger(logger)
 # Train the model
 try:
     model.learn(
-        total_timesteps=total_timesteps, log_interval=1, callback=chkpt_callback
+        total_timesteps=total_timesteps - model.num_timesteps,
+        log_interval=1,
+        callback=[chkpt_callback, throughput_callback],
+        reset_num_timesteps=args.resume is None,
     )
 
     # Save the final trained model
@@ -69,6 +217,8 @@ except Exception as e:
     print(f"An error occurred during training: {e}")
 
 finally:
+    if args.trace is not None:
+        tracing.dump(args.trace)
     # Ensure the environment is properly closed
     if "wrapped_env" in locals() and wrapped_env is not None:
         wrapped_env.close()
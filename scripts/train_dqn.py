@@ -1,13 +1,27 @@
 from stable_baselines3.common.logger import configure
-from stable_baselines3.common.callbacks import CheckpointCallback
 from stable_baselines3.common.torch_layers import CombinedExtractor
-from stable_baselines3 import DQN
+from models.callbacks import (
+    ReplayCheckpointCallback,
+    ThroughputCallback,
+    find_latest_checkpoint,
+    load_replay_chunks,
+)
+from models.dqn import DQN
 from models.dueling_dqn import DuelingDQNPolicy
-from environment.environment import Touhou14Env
+from models.augmentation import AugmentedDictReplayBuffer
+from models.prioritized_replay import PrioritizedDictReplayBuffer
+from models.n_step import NStepDictReplayBuffer
+from models.prefetch import PrefetchingReplayBuffer
+from models.extractors import TouhouExtractor
+from models.learner_server import LearnerServer, parse_address, run_actor, run_learner
+from environment import tracing
+from environment.telemetry import TelemetryWrapper
+from environment.runtime import add_runtime_args, configure_from_args
 from datetime import datetime
 import os
 import argparse
 import json
+import threading
 
 
 parser = argparse.ArgumentParser()
@@ -34,50 +48,296 @@ parser.add_argument(
 parser.add_argument(
     "--dueling", action="store_true", help="Use dueling architecture or not"
 )
+parser.add_argument(
+    "--extractor",
+    type=str,
+    default="combined",
+    choices=["combined", "touhou"],
+    help="Features extractor, SB3's CombinedExtractor or the cheaper TouhouExtractor",
+)
+parser.add_argument(
+    "--prioritized", action="store_true", help="Use prioritized experience replay"
+)
+parser.add_argument(
+    "--per_alpha", type=float, default=0.6, help="Prioritization exponent"
+)
+parser.add_argument(
+    "--per_beta",
+    type=float,
+    default=0.4,
+    help="Initial importance-sampling exponent, annealed to 1",
+)
+parser.add_argument(
+    "--shift_pad",
+    type=int,
+    default=0,
+    help="Randomly shift the sampled frames by up to this many pixels (DrQ), 0 to disable",
+)
+parser.add_argument(
+    "--n_steps",
+    type=int,
+    default=1,
+    help="Rewards summed in the TD targets (n-step returns), 1 for 1-step targets",
+)
+parser.add_argument(
+    "--gradient_steps",
+    type=int,
+    default=1,
+    help="Gradient steps after each rollout of 4 steps",
+)
+parser.add_argument(
+    "--prefetch",
+    type=int,
+    default=0,
+    help="Minibatches sampled in the background during the gradient steps, 0 to disable",
+)
+parser.add_argument(
+    "--resume",
+    type=str,
+    default=None,
+    help="Save folder of an interrupted run to resume from its latest checkpoint",
+)
+parser.add_argument(
+    "--channels_first",
+    action="store_true",
+    help="Emit (n_frame_stack, H, W) frames, which SB3 does not need to transpose",
+)
+parser.add_argument(
+    "--repeat_choices",
+    type=int,
+    nargs="+",
+    default=None,
+    help="Let the agent pick how many frames to repeat each action for among these, e.g., 4 8 16",
+)
+parser.add_argument(
+    "--trace",
+    type=str,
+    default=None,
+    help="Record a timeline of the run and save it as Chrome trace JSON to this path",
+)
+parser.add_argument(
+    "--mode",
+    type=str,
+    default="local",
+    choices=["local", "server", "actor"],
+    help="Train on this machine, or as a learner server of remote actors, or as one of them",
+)
+parser.add_argument(
+    "--address",
+    type=str,
+    default="127.0.0.1:5555",
+    help="host:port the learner server listens on, or the actors connect to",
+)
+parser.add_argument(
+    "--actor_batch_size",
+    type=int,
+    default=64,
+    help="Transitions per batch sent by the actors",
+)
+parser.add_argument(
+    "--loopback_actors",
+    type=int,
+    default=0,
+    help="Simulated actors run by the learner server itself, e.g., to test it",
+)
+parser.add_argument(
+    "--simulated",
+    action="store_true",
+    help="Step the simulated env instead of the game",
+)
+parser.add_argument(
+    "--device", type=str, default="cuda", help="Device of the model, e.g., cuda or cpu"
+)
+parser.add_argument(
+    "--telemetry_dir",
+    type=str,
+    default=None,
+    help="Record the info of every step to this telemetry store folder",
+)
+add_runtime_args(parser)
 args = parser.parse_args()
+if args.resume is not None and args.mode != "local":
+    parser.error("--resume is only supported in local mode")
+if args.telemetry_dir is not None and args.mode == "server":
+    parser.error("--telemetry_dir is only supported in local and actor modes")
+if args.trace is not None:
+    tracing.enable()
+configure_from_args(args)
 
 
-try:
-    env = Touhou14Env()
-
-    # save dir
-    save_dir = f"./save/dqn_{datetime.strftime(datetime.now(), '%Y-%m-%d_%H-%M-%S')}"
-    if not os.path.exists(save_dir):
-        os.makedirs(save_dir)
-
-    # record training config
-    with open(os.path.join(save_dir, "metadata.json"), "w") as f:
-        json.dump(vars(args), f)
-
-    # setup model
-    logger = configure(save_dir, ["csv", "stdout"])
-    chkpt_callback = CheckpointCallback(
-        save_freq=args.steps // args.n_save_chkpts,
-        save_path=save_dir,
-        name_prefix="model",
-        verbose=2,
+def make_env():
+    if args.simulated or args.mode == "server":
+        # the learner server only needs the spaces
+        from environment.simulated import SimulatedTouhou14Env
+
+        return SimulatedTouhou14Env(
+            channels_first=args.channels_first, repeat_choices=args.repeat_choices
+        )
+    # the interface attaches to the game when imported
+    from environment.environment import Touhou14Env
+
+    return Touhou14Env(
+        channels_first=args.channels_first, repeat_choices=args.repeat_choices
     )
-    model = DQN(
+
+
+def make_model(env, buffer_size: int) -> DQN:
+    if args.prioritized:
+        replay_buffer_class = PrioritizedDictReplayBuffer
+        replay_buffer_kwargs = dict(
+            alpha=args.per_alpha,
+            beta=args.per_beta,
+            shift_pad=args.shift_pad,
+            n_steps=args.n_steps,
+        )
+    elif args.n_steps > 1:
+        replay_buffer_class = NStepDictReplayBuffer
+        replay_buffer_kwargs = dict(n_steps=args.n_steps, shift_pad=args.shift_pad)
+    elif args.shift_pad > 0 or args.mode == "server":
+        # the learner server adds whole batches with its `add_transitions`
+        replay_buffer_class = AugmentedDictReplayBuffer
+        replay_buffer_kwargs = dict(shift_pad=args.shift_pad)
+    else:
+        replay_buffer_class, replay_buffer_kwargs = None, None
+    return DQN(
         DuelingDQNPolicy if args.dueling else "MultiInputPolicy",
         env,
-        buffer_size=args.memory,
+        buffer_size=buffer_size,
+        replay_buffer_class=replay_buffer_class,
+        replay_buffer_kwargs=replay_buffer_kwargs,
         target_update_interval=args.target_update_interval,
-        device="cuda",
+        gradient_steps=args.gradient_steps,
+        device=args.device,
         exploration_fraction=0.4,
         exploration_final_eps=0.01,
         policy_kwargs=dict(
-            net_arch=(256, 256), features_extractor_class=CombinedExtractor
+            net_arch=(256, 256),
+            features_extractor_class=(
+                TouhouExtractor if args.extractor == "touhou" else CombinedExtractor
+            ),
         ),
         stats_window_size=5,
     )
-    model.set_logger(logger)
 
-    # learn
-    model.learn(total_timesteps=args.steps, log_interval=1, callback=chkpt_callback)
 
-    # final save
-    model.save(os.path.join(save_dir, "model_final"))
+def run_loopback_actor(address: str, stop: threading.Event) -> None:
+    from environment.simulated import SimulatedTouhou14Env
+
+    actor_env = SimulatedTouhou14Env(
+        channels_first=args.channels_first, repeat_choices=args.repeat_choices
+    )
+    # only the policy of the actor is used
+    actor_model = make_model(actor_env, buffer_size=1)
+    run_actor(actor_env, actor_model, address, args.actor_batch_size, stop)
+
+
+try:
+    env = make_env()
+    if args.telemetry_dir is not None:
+        env = TelemetryWrapper(env, args.telemetry_dir)
+
+    if args.mode == "actor":
+        # the model only acts, with the weights and exploration of the server
+        model = make_model(env, buffer_size=1)
+        print(f"\033[96mActing for the learner at {args.address}\033[0m")
+        n_steps = run_actor(env, model, args.address, args.actor_batch_size)
+        print(f"\033[96mSent {n_steps} transitions\033[0m")
+    else:
+        timestamp = datetime.strftime(datetime.now(), "%Y-%m-%d_%H-%M-%S")
+        if args.resume is None:
+            # save dir
+            save_dir = f"./save/dqn_{timestamp}"
+            if not os.path.exists(save_dir):
+                os.makedirs(save_dir)
+
+            # record training config
+            with open(os.path.join(save_dir, "metadata.json"), "w") as f:
+                json.dump(vars(args), f)
+            log_dir = save_dir
+        else:
+            save_dir = args.resume
+            # do not overwrite the logs of the interrupted run
+            log_dir = os.path.join(save_dir, f"resume_{timestamp}")
+
+        # setup model
+        logger = configure(log_dir, ["csv", "stdout"])
+        chkpt_callback = ReplayCheckpointCallback(
+            save_freq=args.steps // args.n_save_chkpts,
+            save_path=save_dir,
+            name_prefix="model",
+            verbose=2,
+        )
+        throughput_callback = ThroughputCallback(
+            frames_per_step=env.unwrapped.action_repeat,
+            checkpoint_callback=chkpt_callback,
+            verbose=1,
+        )
+        if args.resume is not None:
+            # the model, optimizer and step counters, then the replay buffer
+            model = DQN.load(
+                find_latest_checkpoint(save_dir), env=env, device=args.device
+            )
+            n_chunks = load_replay_chunks(
+                model.replay_buffer, chkpt_callback.replay_path
+            )
+            print(
+                f"Resuming from step {model.num_timesteps}, "
+                f"{model.replay_buffer.size()} transitions from {n_chunks} chunks"
+            )
+        else:
+            model = make_model(env, args.memory)
+        if args.prefetch > 0:
+            model.replay_buffer = PrefetchingReplayBuffer(
+                model.replay_buffer, args.prefetch
+            )
+        model.set_logger(logger)
+
+        if args.mode == "server":
+            host, port = parse_address(args.address)
+            server = LearnerServer(model, host, port)
+            server.start()
+            print(f"\033[96mLearner server listening on {host}:{server.port}\033[0m")
+            stop_actors = threading.Event()
+            actors = [
+                threading.Thread(
+                    target=run_loopback_actor,
+                    args=(f"127.0.0.1:{server.port}", stop_actors),
+                    name=f"loopback_actor_{i}",
+                    daemon=True,
+                )
+                for i in range(args.loopback_actors)
+            ]
+            for actor in actors:
+                actor.start()
+            # learn from the actors
+            model._setup_learn(args.steps)
+            try:
+                run_learner(
+                    model,
+                    server,
+                    total_timesteps=args.steps,
+                    save_path=save_dir,
+                    save_freq=args.steps // args.n_save_chkpts,
+                )
+            finally:
+                stop_actors.set()
+                server.close()
+                for actor in actors:
+                    actor.join()
+        else:
+            # learn
+            model.learn(
+                total_timesteps=args.steps - model.num_timesteps,
+                log_interval=1,
+                callback=[chkpt_callback, throughput_callback],
+                reset_num_timesteps=args.resume is None,
+            )
+
+        # final save
+        model.save(os.path.join(save_dir, "model_final"))
 finally:
+    if args.trace is not None:
+        tracing.dump(args.trace)
     if "env" in locals():
         print("\033[96mQuitting...\033[0m")
         env.close()
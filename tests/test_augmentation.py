@@ -0,0 +1,124 @@
+import numpy as np
+import pytest
+import torch as th
+
+from environment.simulated import SimulatedTouhou14Env
+from models.augmentation import AugmentedDictReplayBuffer, random_shift
+from models.n_step import NStepDictReplayBuffer
+from models.prioritized_replay import PrioritizedDictReplayBuffer
+
+BUFFER_CLASSES = [
+    AugmentedDictReplayBuffer,
+    NStepDictReplayBuffer,
+    PrioritizedDictReplayBuffer,
+]
+
+
+def shifted_by_padding(image: th.Tensor, dy: int, dx: int, pad: int) -> th.Tensor:
+    """
+    A (C, H, W) image padded with its borders and cropped back at the shift.
+    """
+    _, h, w = image.shape
+    padded = th.nn.functional.pad(image[None].float(), (pad,) * 4, mode="replicate")
+    crop = padded[0, :, pad + dy : pad + dy + h, pad + dx : pad + dx + w]
+    return crop.to(image.dtype)
+
+
+@pytest.mark.parametrize("pad", [1, 4])
+def test_random_shift_replicates_the_borders(pad):
+    th.manual_seed(0)
+    images = th.randint(0, 256, (64, 2, 9, 7), dtype=th.uint8)
+    shifted = random_shift(images, pad)
+    assert shifted.shape == images.shape and shifted.dtype == images.dtype
+    # every image is one of the crops of its padded copy
+    shifts = set()
+    for image, result in zip(images, shifted):
+        matches = [
+            (dy, dx)
+            for dy in range(-pad, pad + 1)
+            for dx in range(-pad, pad + 1)
+            if th.equal(result, shifted_by_padding(image, dy, dx, pad))
+        ]
+        assert matches
+        shifts.update(matches)
+    # and the shifts reach the padding on every side
+    assert {dy for dy, _ in shifts} >= {-pad, pad}
+    assert {dx for _, dx in shifts} >= {-pad, pad}
+
+
+def test_random_shift_without_padding_is_the_identity():
+    images = th.rand(4, 3, 5, 5)
+    assert random_shift(images, 0) is images
+
+
+def make_buffer(buffer_class, buffer_size: int = 16, **kwargs):
+    env = SimulatedTouhou14Env(frame_downsize_ratio=0.125, channels_first=True)
+    return buffer_class(
+        buffer_size, env.observation_space, env.action_space, device="cpu", **kwargs
+    )
+
+
+def make_transitions(buffer, n: int, seed: int = 0) -> dict[str, np.ndarray]:
+    """
+    Columns of `n` random transitions of one env, shaped `(n, 1, ...)`.
+    """
+    rng = np.random.default_rng(seed)
+    obs, next_obs = {}, {}
+    for k, shape in buffer.obs_shape.items():
+        dtype = buffer.observations[k].dtype
+        obs[k] = (rng.random((n, 1) + shape) * 255).astype(dtype)
+        next_obs[k] = (rng.random((n, 1) + shape) * 255).astype(dtype)
+    dones = rng.random((n, 1)) < 0.2
+    return dict(
+        obs=obs,
+        next_obs=next_obs,
+        actions=rng.integers(0, 10, (n, 1)),
+        rewards=rng.standard_normal((n, 1)).astype(np.float32),
+        dones=dones,
+        timeouts=dones & (rng.random((n, 1)) < 0.5),
+    )
+
+
+def add_one_by_one(buffer, transitions: dict[str, np.ndarray]) -> None:
+    for i in range(len(transitions["rewards"])):
+        buffer.add(
+            {k: obs[i] for k, obs in transitions["obs"].items()},
+            {k: obs[i] for k, obs in transitions["next_obs"].items()},
+            transitions["actions"][i],
+            transitions["rewards"][i],
+            transitions["dones"][i],
+            [{"TimeLimit.truncated": bool(transitions["timeouts"][i, 0])}],
+        )
+
+
+def assert_same_buffers(buffer, expected) -> None:
+    assert (buffer.pos, buffer.full) == (expected.pos, expected.full)
+    for k in expected.observations:
+        np.testing.assert_array_equal(buffer.observations[k], expected.observations[k])
+        np.testing.assert_array_equal(
+            buffer.next_observations[k], expected.next_observations[k]
+        )
+    for name in ("actions", "rewards", "dones", "timeouts"):
+        np.testing.assert_array_equal(getattr(buffer, name), getattr(expected, name))
+    if hasattr(expected, "sum_tree"):
+        np.testing.assert_array_equal(buffer.sum_tree.tree, expected.sum_tree.tree)
+
+
+@pytest.mark.parametrize("buffer_class", BUFFER_CLASSES)
+# within the buffer, wrapping around, filling it exactly, and more than fits
+@pytest.mark.parametrize("n_before, n", [(3, 5), (10, 9), (0, 16), (5, 40)])
+def test_add_transitions_is_adding_one_by_one(buffer_class, n_before, n):
+    buffer = make_buffer(buffer_class)
+    expected = make_buffer(buffer_class)
+    before = make_transitions(buffer, n_before, seed=1)
+    add_one_by_one(buffer, before)
+    add_one_by_one(expected, before)
+    if hasattr(expected, "sum_tree") and n_before > 0:
+        # new transitions get the maximum priority
+        for b in (buffer, expected):
+            b.update_priorities(np.arange(b.size()), np.linspace(0.5, 3.0, b.size()))
+
+    transitions = make_transitions(buffer, n)
+    buffer.add_transitions(**transitions)
+    add_one_by_one(expected, transitions)
+    assert_same_buffers(buffer, expected)
@@ -0,0 +1,154 @@
+import struct
+
+import numpy as np
+import pytest
+
+from environment.entities import (
+    BULLET_TYPE_BASE,
+    ENEMY_TYPE,
+    BulletLayout,
+    EnemyLayout,
+    EntityReader,
+)
+from environment.memory import SimulatedMemory
+
+ENEMIES = EnemyLayout(max_nodes=16)
+# a smaller pool than the game's, with the same fields
+BULLETS = BulletLayout(capacity=32)
+ENEMY_MANAGER = 0x2000000
+NODES = 0x2100000
+ENEMY_DATA = 0x2200000
+BULLET_MANAGER = 0x3000000
+
+
+class CountingMemory(SimulatedMemory):
+    def __init__(self):
+        super().__init__()
+        self.reads = 0
+
+    def read_into(self, address, buffer, size):
+        self.reads += 1
+        super().read_into(address, buffer, size)
+
+    def read(self, address, size):
+        self.reads += 1
+        return super().read(address, size)
+
+
+@pytest.fixture
+def memory():
+    memory = CountingMemory()
+    memory.map(memory.base_address, 0x100000)
+    memory.map(ENEMY_MANAGER, 0x1000)
+    memory.map(NODES, 0x1000)
+    memory.map(ENEMY_DATA, 0x20000)
+    memory.map(BULLET_MANAGER, BULLETS.array + BULLETS.capacity * BULLETS.stride)
+    memory.write_ptr(memory.base_address + ENEMIES.manager_ptr, ENEMY_MANAGER)
+    memory.write_ptr(memory.base_address + BULLETS.manager_ptr, BULLET_MANAGER)
+    return memory
+
+
+def write_enemy_list(memory, enemies, next_of_last: int = 0) -> None:
+    """
+    Link a node for each enemy, given as (prev x, prev y, x, y), None for a
+    node without an enemy.
+    """
+    nodes = [NODES + i * 0x10 for i in range(len(enemies))]
+    memory.write_ptr(ENEMY_MANAGER + ENEMIES.list_head, nodes[0] if nodes else 0)
+    for i, (node, enemy) in enumerate(zip(nodes, enemies)):
+        data = 0
+        if enemy is not None:
+            data = ENEMY_DATA + i * 0x1000
+            prev_x, prev_y, x, y = enemy
+            block = data + ENEMIES.data
+            memory.write(block + ENEMIES.prev_pos, struct.pack("<ff", prev_x, prev_y))
+            memory.write(block + ENEMIES.pos, struct.pack("<ff", x, y))
+        memory.write_ptr(node + ENEMIES.node_val, data)
+        last = i == len(nodes) - 1
+        memory.write_ptr(
+            node + ENEMIES.node_next, next_of_last if last else nodes[i + 1]
+        )
+
+
+def write_bullet(memory, slot: int, x, y, vx, vy, sprite: int, state: int) -> None:
+    bullet = BULLET_MANAGER + BULLETS.array + slot * BULLETS.stride
+    memory.write(bullet + BULLETS.pos, struct.pack("<ff", x, y))
+    memory.write(bullet + BULLETS.vel, struct.pack("<ff", vx, vy))
+    memory.write(bullet + BULLETS.sprite, struct.pack("<H", sprite))
+    memory.write(bullet + BULLETS.state, struct.pack("<H", state))
+
+
+def make_reader(memory, **kwargs) -> EntityReader:
+    return EntityReader(memory, enemy_layout=ENEMIES, bullet_layout=BULLETS, **kwargs)
+
+
+def test_enemies_are_decoded_from_the_list(memory):
+    write_enemy_list(
+        memory, [(10.0, 20.0, 12.0, 19.0), None, (-5.0, 100.0, -5.0, 104.5)]
+    )
+    enemies = make_reader(memory).read_enemies()
+    np.testing.assert_array_equal(
+        enemies,
+        [
+            [12.0, 19.0, 2.0, -1.0, ENEMY_TYPE],
+            [-5.0, 104.5, 0.0, 4.5, ENEMY_TYPE],
+        ],
+    )
+    assert enemies.dtype == np.float32
+
+
+def test_each_enemy_node_is_read_at_once(memory):
+    write_enemy_list(memory, [(0.0, 0.0, float(i), 0.0) for i in range(5)])
+    reader = make_reader(memory)
+    memory.reads = 0
+    assert len(reader.read_enemies()) == 5
+    # the manager and the list head, then the node and the data of each enemy
+    assert memory.reads == 2 + 2 * 5
+
+
+def test_empty_enemy_list(memory):
+    write_enemy_list(memory, [])
+    assert make_reader(memory).read_enemies().shape == (0, 5)
+    memory.write_ptr(memory.base_address + ENEMIES.manager_ptr, 0)
+    assert make_reader(memory).read_enemies().shape == (0, 5)
+
+
+@pytest.mark.parametrize("with_enemies", [True, False])
+def test_enemy_list_cycle_is_cut_at_max_nodes(memory, with_enemies):
+    enemy = (0.0, 0.0, 1.0, 1.0) if with_enemies else None
+    write_enemy_list(memory, [enemy] * 3, next_of_last=NODES)
+    enemies = make_reader(memory).read_enemies()
+    assert len(enemies) == (ENEMIES.max_nodes if with_enemies else 0)
+
+
+def test_active_bullets_are_decoded_from_the_pool(memory):
+    write_bullet(memory, 0, 1.0, 2.0, 0.5, -0.5, sprite=3, state=1)
+    # an inactive slot
+    write_bullet(memory, 1, 7.0, 7.0, 7.0, 7.0, sprite=7, state=0)
+    write_bullet(memory, BULLETS.capacity - 1, -3.0, 4.0, 0.0, 2.0, sprite=0, state=2)
+    bullets = make_reader(memory).read_bullets()
+    np.testing.assert_array_equal(
+        bullets,
+        [
+            [1.0, 2.0, 0.5, -0.5, BULLET_TYPE_BASE + 3],
+            [-3.0, 4.0, 0.0, 2.0, BULLET_TYPE_BASE],
+        ],
+    )
+
+
+def test_empty_bullet_pool(memory):
+    assert make_reader(memory).read_bullets().shape == (0, 5)
+    memory.write_ptr(memory.base_address + BULLETS.manager_ptr, 0)
+    assert make_reader(memory).read_bullets().shape == (0, 5)
+
+
+def test_nearest_entities_are_kept(memory):
+    write_enemy_list(memory, [(0.0, 0.0, float(x), 0.0) for x in (50, 10, 30)])
+    for slot, x in enumerate((40.0, 5.0, 20.0)):
+        write_bullet(memory, slot, x, 0.0, 0.0, 0.0, sprite=1, state=1)
+    entities = make_reader(memory, max_enemies=2, max_bullets=4).read(origin=(0, 0))
+    np.testing.assert_array_equal(entities[:2, 0], [10.0, 30.0])
+    # all the bullets fit, in pool order
+    np.testing.assert_array_equal(entities[2:, 0], [40.0, 5.0, 20.0, 0.0])
+    # the padding row
+    assert entities[-1, 4] == 0
@@ -0,0 +1,170 @@
+import importlib
+import sys
+
+import numpy as np
+import pytest
+
+from environment.spaces import FRAME_HEIGHT, FRAME_WIDTH
+
+
+class StubInterface:
+    """
+    Stands in for `environment.interface`, which attaches to the game when
+    imported, with a game whose timer only moves through `act`.
+    """
+
+    game_memory = None
+
+    def __init__(self):
+        self.timer = 0
+        # frames the game runs past the target of each `act`
+        self.overshoot = 0
+        self.fields = {
+            "score": 0,
+            "lives": 3,
+            "life_fragments": 0,
+            "bombs": 3,
+            "bomb_fragments": 0,
+            "power": 100,
+            "game_state": 2,
+            "in_dialog": 0,
+            "boss_hp": 1500,
+            "f_player_pos_x": 0.0,
+            "f_player_pos_y": 400.0,
+            "f_boss_pos_x": 0.0,
+            "f_boss_pos_y": 100.0,
+        }
+        self.acts = []
+        self.captures = []
+        # game state after the given number of acts
+        self.end_after = None
+
+    def act(self, move: int, slow: int, k: int = 1) -> int:
+        self.acts.append((move, slow, k))
+        self.timer += k + self.overshoot
+        self.fields["boss_hp"] -= k
+        if self.end_after is not None and len(self.acts) >= self.end_after:
+            self.fields["game_state"] = 1
+        return self.overshoot
+
+    def capture_frame(self) -> np.ndarray:
+        self.captures.append(self.timer)
+        return np.full((FRAME_HEIGHT, FRAME_WIDTH, 3), self.timer % 256, np.uint8)
+
+    def read_game_val(self, key: str):
+        if key == "global_timer":
+            return self.timer
+        return self.fields[key]
+
+    def restore_savestate(self) -> bool:
+        return False
+
+    def init(self): ...
+
+    def suspend_game_process(self): ...
+
+    def resume_game_process(self): ...
+
+    def release_all_keys(self): ...
+
+    def force_reset(self): ...
+
+    def reset_from_end_of_run(self): ...
+
+    def skip_dialog(self): ...
+
+    def capture_savestate(self): ...
+
+    def clean_up(self): ...
+
+
+@pytest.fixture
+def game(monkeypatch):
+    game = StubInterface()
+    monkeypatch.setitem(sys.modules, "environment.interface", game)
+    monkeypatch.delitem(sys.modules, "environment.environment", raising=False)
+    return game
+
+
+def make_env(**kwargs):
+    module = importlib.import_module("environment.environment")
+    env = module.Touhou14Env(frame_downsize_ratio=0.25, **kwargs)
+    env.reset()
+    return env
+
+
+def test_step_acts_for_the_action_repeat(game):
+    env = make_env()
+    obs, reward, terminated, truncated, info = env.step(np.int64(7))
+    # action 7: right, slow mode
+    assert {(move, slow) for move, slow, _ in game.acts} == {(2, 1)}
+    assert sum(k for _, _, k in game.acts) == env.action_repeat == 4
+    assert obs["frames"].shape == env.observation_space["frames"].shape
+    assert not terminated and not truncated
+    assert info["action_repeat"] == 4
+    assert info["overshoot"] == 0
+    assert info["boss_hp"] == 1500 - 4
+    stats = env.get_lockstep_stats()
+    assert stats["steps"] == 1 and stats["frames"] == 4
+    assert stats["lost_frames"] == 0
+
+
+def test_step_reports_the_overshoot(game):
+    env = make_env()
+    game.overshoot = 2
+    _, _, _, _, info = env.step(np.int64(0))
+    assert info["overshoot"] == 2 * len(game.acts)
+    stats = env.get_lockstep_stats()
+    assert stats["overshot_steps"] == 1
+    assert stats["lost_frames"] == info["overshoot"]
+    assert stats["max_overshoot"] == 2
+
+
+def test_step_picks_the_repeat_choice(game):
+    env = make_env(repeat_choices=(2, 8))
+    _, _, _, _, info = env.step(np.int64(13))
+    assert sum(k for _, _, k in game.acts) == 8
+    assert {(move, slow) for move, slow, _ in game.acts} == {(3, 0)}
+    assert info["action_repeat"] == 8
+
+
+def test_step_stops_acting_at_the_end_of_the_run(game):
+    env = make_env()
+    game.end_after = 1
+    _, _, terminated, _, _ = env.step(np.int64(0))
+    assert terminated
+    assert len(game.acts) == 1
+
+
+@pytest.mark.parametrize(
+    "action_repeat, repeat_choices, capture_stride",
+    [(8, None, 2), (4, (2, 4, 8), 1), (6, (3, 6, 12), 3)],
+)
+def test_stacked_frames_are_evenly_spaced(
+    game, action_repeat, repeat_choices, capture_stride
+):
+    env = make_env(
+        action_repeat=action_repeat,
+        repeat_choices=repeat_choices,
+        capture_stride=capture_stride,
+    )
+    rng = np.random.default_rng(0)
+    for action in rng.integers(0, env.action_space.n, 20):
+        env.step(action)
+        # the first capture is the one of the reset
+        stacked = game.captures[1:][-env.n_frame_stack :]
+        if len(stacked) == env.n_frame_stack:
+            assert set(np.diff(stacked)) == {capture_stride}
+            assert stacked[-1] == game.timer
+
+
+@pytest.mark.parametrize(
+    "action_repeat, repeat_choices", [(4, None), (6, (2, 6)), (6, (6, 4))]
+)
+def test_steps_should_be_whole_capture_strides(game, action_repeat, repeat_choices):
+    with pytest.raises(ValueError, match="multiple of the capture stride"):
+        make_env(
+            action_repeat=action_repeat,
+            repeat_choices=repeat_choices,
+            capture_stride=3,
+        )
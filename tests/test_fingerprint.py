@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from environment.fingerprint import FreezeDetector, fingerprint
+
+
+def make_frame(seed: int, shape=(448, 384, 3)) -> np.ndarray:
+    return np.random.default_rng(seed).integers(0, 256, shape, dtype=np.uint8)
+
+
+@pytest.mark.parametrize("shape", [(448, 384, 3), (15, 17, 3)])
+def test_fingerprint_is_a_grid_of_block_means(shape):
+    frame = make_frame(0, shape)
+    fp = fingerprint(frame, grid=4)
+    assert fp.shape == (4, 4) and fp.dtype == np.float32
+    if shape[0] % 4 == 0 and shape[1] % 4 == 0:
+        h, w = shape[0] // 4, shape[1] // 4
+        expected = frame.reshape(4, h, 4, w, 3).mean(axis=(1, 3, 4))
+        np.testing.assert_allclose(fp, expected, atol=0.5)
+
+
+def test_repeated_captures_are_detected():
+    detector = FreezeDetector(tolerance=0.5, freeze_captures=3)
+    frame = make_frame(0)
+    assert not detector.update(frame)
+    # the first capture has nothing to repeat
+    assert detector.repeat_streak == 0
+    # a change too small to show in the block means
+    noisy = frame.copy()
+    noisy[0, 0] ^= 1
+    assert detector.update(noisy)
+    assert detector.update(frame)
+    assert not detector.frozen
+    assert detector.update(frame)
+    assert detector.frozen
+    # a new frame ends the streak
+    assert not detector.update(make_frame(1))
+    assert detector.repeat_streak == 0 and not detector.frozen
+
+
+def test_reset_forgets_the_previous_capture():
+    detector = FreezeDetector(freeze_captures=1)
+    frame = make_frame(0)
+    detector.update(frame)
+    detector.update(frame)
+    assert detector.frozen
+    detector.reset()
+    assert not detector.frozen
+    assert not detector.update(frame)
+
+
+def test_freeze_detector_parameters():
+    with pytest.raises(ValueError):
+        FreezeDetector(grid=0)
+    with pytest.raises(ValueError):
+        FreezeDetector(tolerance=-1)
+    with pytest.raises(ValueError):
+        FreezeDetector(freeze_captures=0)
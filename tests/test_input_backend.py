@@ -0,0 +1,60 @@
+import pytest
+
+from environment.input_backend import SCANCODES, InputBackend, RecordingBackend
+
+
+def sent(backend: RecordingBackend) -> list[list[tuple[str, bool]]]:
+    return [events for _, events in backend.batches]
+
+
+def test_input_backend_is_abstract():
+    with pytest.raises(TypeError):
+        InputBackend()
+
+
+def test_flush_sends_only_the_changed_keys():
+    backend = RecordingBackend()
+    backend.press("z")
+    backend.set_key("left", True)
+    backend.set_key("shift", False)
+    assert backend.flush() == 2
+    # the same action again sends nothing
+    backend.press("z")
+    backend.set_key("left", True)
+    backend.set_key("shift", False)
+    assert backend.flush() == 0
+    backend.set_key("left", False)
+    backend.set_key("right", True)
+    backend.set_key("shift", True)
+    assert backend.flush() == 3
+    first, second = sent(backend)
+    assert first == [("z", True), ("left", True)]
+    # releases before presses
+    assert second[0] == ("left", False)
+    assert sorted(second[1:]) == [("right", True), ("shift", True)]
+    assert backend.is_pressed("right") and not backend.is_pressed("left")
+    assert (backend.n_flushes, backend.n_batches, backend.n_events) == (3, 2, 5)
+
+
+def test_key_set_back_before_the_flush_sends_nothing():
+    backend = RecordingBackend()
+    backend.press("up")
+    backend.flush()
+    backend.release("up")
+    backend.press("up")
+    assert backend.flush() == 0
+    assert sent(backend) == [[("up", True)]]
+
+
+def test_release_all_releases_every_key():
+    backend = RecordingBackend()
+    backend.press("z")
+    backend.flush()
+    assert backend.release_all() == len(SCANCODES)
+    assert sorted(sent(backend)[-1]) == sorted((key, False) for key in SCANCODES)
+    assert not any(backend.is_pressed(key) for key in SCANCODES)
+
+
+def test_invalid_key():
+    with pytest.raises(ValueError, match="Invalid key"):
+        RecordingBackend().press("a")
@@ -0,0 +1,200 @@
+import io
+import pickle
+import socket
+import threading
+
+import numpy as np
+import pytest
+import torch as th
+from stable_baselines3.common.logger import configure
+
+from environment.simulated import SimulatedTouhou14Env
+from models import learner_server
+from models.dqn import DQN
+from models.learner_server import (
+    WEIGHTS,
+    ActorClient,
+    LearnerServer,
+    decode_batch,
+    encode_batch,
+    make_batch,
+    run_actor,
+    run_learner,
+    send_message,
+    split_batch,
+)
+from models.prioritized_replay import PrioritizedDictReplayBuffer
+
+
+def make_env() -> SimulatedTouhou14Env:
+    return SimulatedTouhou14Env(frame_downsize_ratio=0.125, time_limit=200)
+
+
+def make_model(env, buffer_size: int = 1000, **kwargs) -> DQN:
+    return DQN(
+        "MultiInputPolicy",
+        env,
+        buffer_size=buffer_size,
+        learning_starts=16,
+        batch_size=8,
+        train_freq=4,
+        target_update_interval=50,
+        policy_kwargs=dict(net_arch=[16]),
+        device="cpu",
+        seed=0,
+        **kwargs,
+    )
+
+
+def test_batch_round_trip_keeps_the_episode_ends():
+    rng = np.random.default_rng(0)
+
+    def obs():
+        return {
+            "frames": rng.integers(0, 256, (4, 8, 6), dtype=np.uint8),
+            "player_position": rng.standard_normal(2).astype(np.float32),
+        }
+
+    # an episode terminated at 2 and one truncated at 5, the next observations
+    # of which are not the observations of the following transitions (resets)
+    ends = {2: (True, False), 5: (False, True)}
+    transitions = []
+    current = obs()
+    for i in range(8):
+        next_obs = obs()
+        terminated, truncated = ends.get(i, (False, False))
+        transitions.append((current, i % 10, float(i), next_obs, terminated, truncated))
+        current = obs() if terminated or truncated else next_obs
+
+    columns = decode_batch(encode_batch(make_batch(transitions)))
+    assert columns["next_rows"].tolist() == [2, 5, 7]
+    observations, next_observations = split_batch(columns)
+    for k in ("frames", "player_position"):
+        np.testing.assert_array_equal(
+            observations[k], np.stack([t[0][k] for t in transitions])
+        )
+        np.testing.assert_array_equal(
+            next_observations[k], np.stack([t[3][k] for t in transitions])
+        )
+    assert columns["actions"].tolist() == [i % 10 for i in range(8)]
+    assert columns["dones"].tolist() == [i in ends for i in range(8)]
+    assert columns["timeouts"].tolist() == [i == 5 for i in range(8)]
+
+
+def test_batches_are_added_as_one_by_one():
+    env = make_env()
+    transitions = []
+    obs, _ = env.reset(seed=0)
+    for i in range(40):
+        next_obs, reward, terminated, truncated, _ = env.step(i % 10)
+        # a truncation in the middle of the batch
+        truncated = truncated or i == 20
+        transitions.append((obs, i % 10, reward, next_obs, terminated, truncated))
+        obs = env.reset()[0] if terminated or truncated else next_obs
+    columns = decode_batch(encode_batch(make_batch(transitions)))
+
+    # the plain SB3 buffer is filled one transition at a time
+    expected = make_model(env, buffer_size=32)
+    model = make_model(
+        env,
+        buffer_size=32,
+        replay_buffer_class=PrioritizedDictReplayBuffer,
+        replay_buffer_kwargs=dict(n_steps=3),
+    )
+    for m in (expected, model):
+        assert learner_server._add_batch(m, columns) == 40
+    buffer, expected = model.replay_buffer, expected.replay_buffer
+    assert (buffer.pos, buffer.full) == (expected.pos, expected.full) == (8, True)
+    for k in expected.observations:
+        np.testing.assert_array_equal(buffer.observations[k], expected.observations[k])
+        np.testing.assert_array_equal(
+            buffer.next_observations[k], expected.next_observations[k]
+        )
+    for name in ("actions", "rewards", "dones", "timeouts"):
+        np.testing.assert_array_equal(getattr(buffer, name), getattr(expected, name))
+    assert buffer.timeouts.sum() > 0
+    assert buffer.sum_tree.total == 32
+
+
+def test_loopback_training(monkeypatch):
+    # versions of the weights fetched by the actor
+    versions = []
+    get_weights = learner_server.ActorClient.get_weights
+
+    def recording_get_weights(self):
+        weights = get_weights(self)
+        versions.append(weights[0])
+        return weights
+
+    monkeypatch.setattr(
+        learner_server.ActorClient, "get_weights", recording_get_weights
+    )
+
+    total_timesteps = 160
+    model = make_model(make_env())
+    model.set_logger(configure(None, []))
+    model._setup_learn(total_timesteps)
+    server = LearnerServer(model, "127.0.0.1", 0, max_pending_batches=2)
+    server.start()
+    actor_env = make_env()
+    actor_model = make_model(actor_env, buffer_size=1)
+    stop = threading.Event()
+    actor = threading.Thread(
+        target=run_actor,
+        args=(actor_env, actor_model, f"127.0.0.1:{server.port}", 16, stop),
+        daemon=True,
+    )
+    actor.start()
+    try:
+        run_learner(
+            model,
+            server,
+            total_timesteps=total_timesteps,
+            publish_interval=4,
+            log_interval=1e9,
+        )
+    finally:
+        stop.set()
+        server.close()
+        actor.join(timeout=30)
+        for thread in server._threads:
+            thread.join(timeout=30)
+
+    assert not actor.is_alive()
+    assert model.num_timesteps >= total_timesteps
+    assert model.replay_buffer.size() == model.num_timesteps
+    assert server.version > 1
+    assert versions[0] == 1
+    assert max(versions) > 1
+    assert server.n_actors == 0
+    assert server.raw_bytes > server.compressed_bytes > 0
+
+
+# set when the payload below is unpickled
+unpickled = []
+
+
+class Payload:
+    def __reduce__(self):
+        return unpickled.append, (True,)
+
+
+def test_actor_refuses_weights_other_than_tensors():
+    sock, server_sock = socket.socketpair()
+    client = ActorClient.__new__(ActorClient)
+    client.sock = sock
+    try:
+        buffer = io.BytesIO()
+        th.save({"q_net.weight": th.zeros(2), "payload": Payload()}, buffer)
+        # the answer is already waiting when the actor asks for the weights
+        send_message(
+            server_sock,
+            WEIGHTS,
+            learner_server._WEIGHTS_HEADER.pack(2, 0.1) + buffer.getvalue(),
+        )
+        with pytest.raises(pickle.UnpicklingError):
+            client.get_weights()
+        assert not unpickled
+    finally:
+        client.close()
+        server_sock.close()
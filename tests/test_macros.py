@@ -0,0 +1,101 @@
+import pytest
+
+from environment import macros
+from environment.input_backend import SCANCODES
+from environment.macros import MacroEngine
+from environment.simulated import SimulatedMenus
+
+
+SEEDS = range(20)
+
+
+def run_macro(screen: str, steps: tuple[macros.Step, ...], seed: int):
+    game = SimulatedMenus(screen, seed=seed)
+    engine = MacroEngine(game.read, game.clock, game.sleep, game.input_backend)
+    frames = engine.run("macro", steps)
+    return game, engine, frames
+
+
+def assert_all_released(game: SimulatedMenus) -> None:
+    assert not any(game.input_backend.is_pressed(key) for key in SCANCODES)
+    assert not game.held
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+@pytest.mark.parametrize(
+    "screen, steps",
+    [
+        ("demo", macros.INIT),
+        ("playing", macros.FORCE_RESET),
+        ("end_of_run", macros.RESET_FROM_END_OF_RUN),
+    ],
+    ids=["init", "force_reset", "reset_from_end_of_run"],
+)
+def test_macro_starts_a_run(screen, steps, seed):
+    game, engine, frames = run_macro(screen, steps, seed)
+    assert game.screen == "playing" and game.pending is None
+    assert game.read("game_state") == 2
+    assert game.read("boss_hp") > 0
+    assert frames == game.clock()
+    stats = engine.get_stats()
+    assert set(stats) == {f"macro/{step.name}" for step in steps}
+    assert all(step_stats["timeouts"] == 0 for step_stats in stats.values())
+    assert_all_released(game)
+
+
+@pytest.mark.parametrize(
+    "screen, steps",
+    [
+        ("demo", macros.INIT),
+        ("playing", macros.FORCE_RESET),
+        ("end_of_run", macros.RESET_FROM_END_OF_RUN),
+    ],
+    ids=["init", "force_reset", "reset_from_end_of_run"],
+)
+def test_macro_is_faster_than_the_fixed_waits(screen, steps):
+    # the keys are tapped for 2 frames each
+    fixed = sum(step.timeout + 2 * len(step.keys) for step in steps)
+    frames = [run_macro(screen, steps, seed)[2] for seed in SEEDS]
+    assert max(frames) < fixed
+    assert sum(frames) / len(frames) < 0.8 * fixed
+
+
+def test_restarting_before_the_pause_menu_has_slid_in_fails():
+    # game_state reads as paused before the pause menu takes input
+    eager = (
+        macros.Step(
+            "pause", ("esc",), until=macros.field_is("game_state", 0), timeout=30
+        ),
+        macros.Step("restart", ("r",), until=macros.playing, timeout=330),
+    )
+    for seed in SEEDS:
+        game, engine, _ = run_macro("playing", eager, seed)
+        assert game.screen == "paused"
+        assert engine.get_stats()["macro/restart"]["timeouts"] == 1
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_skip_dialog_holds_ctrl_until_the_dialog_ends(seed):
+    game, _, _ = run_macro("dialog", macros.SKIP_DIALOG, seed)
+    assert game.screen == "playing"
+    assert game.read("in_dialog") != -1
+    batches = [events for _, events in game.input_backend.batches]
+    assert batches == [[("ctrl", True)], [("ctrl", False)]]
+    assert_all_released(game)
+
+
+def test_skip_dialog_raises_when_the_dialog_does_not_end():
+    game = SimulatedMenus("dialog", seed=0)
+    game.dialog_frames = 10**6
+    engine = MacroEngine(game.read, game.clock, game.sleep, game.input_backend)
+    with pytest.raises(RuntimeError, match="skip_dialog/skip timed out"):
+        engine.run("skip_dialog", macros.SKIP_DIALOG)
+    # the held key is released even so
+    assert_all_released(game)
+    assert engine.get_stats()["skip_dialog/skip"]["timeouts"] == 1
+
+
+def test_quit_to_title_from_a_run():
+    game, _, _ = run_macro("playing", macros.quit_to_title(2), seed=0)
+    assert game.screen == "title"
+    assert_all_released(game)
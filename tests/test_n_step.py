@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from models.n_step import NStepDictReplayBuffer, n_step_returns
+from test_augmentation import add_one_by_one, make_buffer, make_transitions
+
+GAMMA = 0.5
+
+
+def returns_of(batch_inds, rewards, dones, pos, n_steps=3):
+    rewards = np.asarray(rewards, dtype=np.float32)[:, None]
+    dones = np.asarray(dones, dtype=np.float32)[:, None]
+    batch_inds = np.asarray(batch_inds)
+    return n_step_returns(
+        rewards, dones, batch_inds, np.zeros_like(batch_inds), pos, n_steps, GAMMA
+    )
+
+
+REWARDS = [1.0, 2.0, 4.0, 8.0, 16.0, 32.0, 64.0, 128.0]
+
+
+def test_rewards_are_summed_with_discounting():
+    returns, last_inds, discounts = returns_of([0, 3], REWARDS, [0] * 8, pos=0)
+    np.testing.assert_allclose(returns, [1 + 1 + 1, 8 + 8 + 8])
+    np.testing.assert_array_equal(last_inds, [2, 5])
+    np.testing.assert_allclose(discounts, [GAMMA**3] * 2)
+
+
+def test_sums_stop_at_the_end_of_an_episode():
+    dones = [0, 1, 0, 0, 0, 0, 0, 0]
+    returns, last_inds, discounts = returns_of([0, 1, 2], REWARDS, dones, pos=0)
+    # the end is included, and the next episode isn't
+    np.testing.assert_allclose(returns, [1 + 1, 2, 4 + 4 + 4])
+    np.testing.assert_array_equal(last_inds, [1, 1, 4])
+    np.testing.assert_allclose(discounts, [GAMMA**2, GAMMA, GAMMA**3])
+
+
+def test_sums_stop_at_the_latest_transition():
+    # transitions 0 to 4 are stored, the next one is written at 5
+    returns, last_inds, discounts = returns_of([3, 4], REWARDS, [0] * 8, pos=5)
+    np.testing.assert_allclose(returns, [8 + 8, 16])
+    np.testing.assert_array_equal(last_inds, [4, 4])
+    np.testing.assert_allclose(discounts, [GAMMA**2, GAMMA])
+
+
+def test_sums_wrap_around_the_buffer():
+    # a full buffer whose oldest transition is at 2
+    returns, last_inds, discounts = returns_of([6, 7], REWARDS, [0] * 8, pos=2)
+    np.testing.assert_allclose(returns, [64 + 64 + 0.25, 128 + 0.5 + 0.5])
+    np.testing.assert_array_equal(last_inds, [0, 1])
+    np.testing.assert_allclose(discounts, [GAMMA**3] * 2)
+
+
+@pytest.mark.parametrize("timeout", [False, True])
+def test_truncations_keep_bootstrapping(timeout):
+    buffer = make_buffer(NStepDictReplayBuffer, n_steps=3, gamma=GAMMA)
+    transitions = make_transitions(buffer, 4)
+    transitions["rewards"][:] = 1.0
+    transitions["dones"][:] = [[False], [True], [False], [False]]
+    transitions["timeouts"][:] = [[False], [timeout], [False], [False]]
+    add_one_by_one(buffer, transitions)
+    samples = buffer._get_samples(np.array([0]))
+    assert samples.rewards.item() == 1.5
+    assert samples.discounts.item() == GAMMA**2
+    # a truncated episode bootstraps from the stored next observation
+    assert samples.dones.item() == (0.0 if timeout else 1.0)
+    for k, obs in samples.next_observations.items():
+        np.testing.assert_array_equal(obs[0].numpy(), buffer.next_observations[k][1, 0])
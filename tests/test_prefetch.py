@@ -0,0 +1,108 @@
+import time
+
+import numpy as np
+import pytest
+import torch as th
+
+from environment.simulated import SimulatedTouhou14Env
+from models.augmentation import AugmentedDictReplayBuffer
+from models.n_step import NStepDictReplayBuffer
+from models.prefetch import PrefetchingReplayBuffer
+from models.prioritized_replay import PrioritizedDictReplayBuffer
+
+
+def fill(buffer, n: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    env = SimulatedTouhou14Env(frame_downsize_ratio=0.125, channels_first=True)
+    for i in range(n):
+        obs = {
+            k: np.asarray(v)[None] for k, v in env.observation_space.sample().items()
+        }
+        next_obs = {
+            k: np.asarray(v)[None] for k, v in env.observation_space.sample().items()
+        }
+        buffer.add(
+            obs,
+            next_obs,
+            np.array([rng.integers(10)]),
+            np.array([float(i)]),
+            np.array([rng.random() < 0.1]),
+            [{}],
+        )
+    return buffer
+
+
+def make_buffer(buffer_class, **kwargs):
+    env = SimulatedTouhou14Env(frame_downsize_ratio=0.125, channels_first=True)
+    return buffer_class(
+        64, env.observation_space, env.action_space, device="cpu", **kwargs
+    )
+
+
+@pytest.mark.parametrize(
+    "buffer_class, kwargs",
+    [
+        (AugmentedDictReplayBuffer, dict(shift_pad=2)),
+        (NStepDictReplayBuffer, dict(n_steps=3)),
+        (PrioritizedDictReplayBuffer, dict(n_steps=3, shift_pad=2)),
+    ],
+)
+def test_split_sampling_is_sample(buffer_class, kwargs):
+    buffer = fill(make_buffer(buffer_class, **kwargs), 40)
+    np.random.seed(0)
+    th.manual_seed(0)
+    expected = buffer.sample(16)
+    np.random.seed(0)
+    th.manual_seed(0)
+    samples = buffer.get_samples(buffer.sample_indices(16))
+    for name, value in zip(expected._fields, expected):
+        other = getattr(samples, name)
+        if isinstance(value, dict):
+            for k in value:
+                assert th.equal(value[k], other[k])
+        elif isinstance(value, th.Tensor):
+            assert th.equal(value, other)
+        elif value is not None:
+            np.testing.assert_array_equal(value, other)
+
+
+def wait_for_batches(buffer: PrefetchingReplayBuffer, n: int) -> None:
+    deadline = time.monotonic() + 10
+    while len(buffer._batches) < n or buffer._in_flight:
+        assert time.monotonic() < deadline, "no minibatch was prefetched"
+        time.sleep(0.01)
+
+
+def test_prefetched_minibatches_are_served():
+    buffer = PrefetchingReplayBuffer(
+        fill(make_buffer(AugmentedDictReplayBuffer, shift_pad=0), 40), n_prefetch=2
+    )
+    try:
+        buffer.expect(4)
+        buffer.sample(8)
+        wait_for_batches(buffer, 2)
+        for _ in range(3):
+            samples = buffer.sample(8)
+            assert samples.rewards.shape == (8, 1)
+            # only the 40 transitions added so far are sampled
+            assert samples.rewards.max() < 40
+        assert buffer.n_hits >= 2
+        assert buffer.n_hits + buffer.n_misses == 4
+    finally:
+        buffer.close()
+
+
+def test_changes_drop_the_prefetched_minibatches():
+    buffer = PrefetchingReplayBuffer(
+        fill(make_buffer(AugmentedDictReplayBuffer, shift_pad=0), 40), n_prefetch=2
+    )
+    try:
+        buffer.expect(3)
+        buffer.sample(8)
+        wait_for_batches(buffer, 2)
+        # which also ends the training call, so nothing is prefetched after
+        fill(buffer, 1)
+        assert len(buffer._batches) == 0
+        assert buffer.size() == 41
+    finally:
+        buffer.close()
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from models.prioritized_replay import PrioritizedDictReplayBuffer, SumTree
+from test_augmentation import add_one_by_one, make_buffer, make_transitions
+
+
+@pytest.mark.parametrize("capacity", [1, 5, 8])
+def test_sum_tree_sums_the_leaves(capacity):
+    tree = SumTree(capacity)
+    priorities = np.arange(1.0, capacity + 1)
+    tree.update(np.arange(capacity), priorities)
+    assert tree.total == priorities.sum()
+    np.testing.assert_array_equal(tree[np.arange(capacity)], priorities)
+    # the last of repeated indices wins
+    tree.update([0, 0], [10.0, 0.5])
+    assert tree[[0]][0] == 0.5
+    assert tree.total == priorities.sum() - 1.0 + 0.5
+
+
+def test_sum_tree_finds_the_prefix_sum_ranges():
+    tree = SumTree(5)
+    tree.update(np.arange(5), [1.0, 0.0, 2.0, 0.5, 0.5])
+    values = [0.0, 0.99, 1.0, 2.99, 3.0, 3.49, 3.5, 3.99]
+    np.testing.assert_array_equal(tree.find(values), [0, 0, 2, 2, 3, 3, 4, 4])
+
+
+def test_sum_tree_never_finds_empty_leaves():
+    tree = SumTree(4)
+    tree.update(np.arange(4), [0.1, 0.2, 0.0, 0.0])
+    # at and past the total, e.g., after floating point drift
+    assert set(tree.find([0.3, 0.30000001, 1.0]).tolist()) <= {0, 1}
+
+
+def test_stratified_sampling_is_proportional_to_the_priorities():
+    np.random.seed(0)
+    tree = SumTree(4)
+    tree.update(np.arange(4), [1.0, 2.0, 3.0, 4.0])
+    # one value in each tenth of the total
+    indices = tree.sample(10)
+    np.testing.assert_array_equal(indices, [0, 1, 1, 2, 2, 2, 3, 3, 3, 3])
+    counts = np.bincount(
+        np.concatenate([tree.sample(100) for _ in range(100)]), minlength=4
+    )
+    np.testing.assert_allclose(counts / counts.sum(), [0.1, 0.2, 0.3, 0.4], atol=0.01)
+
+
+def test_importance_sampling_weights():
+    buffer = make_buffer(PrioritizedDictReplayBuffer, alpha=1.0, beta=0.5)
+    add_one_by_one(buffer, make_transitions(buffer, 4))
+    buffer.update_priorities(np.arange(4), np.array([1.0, 1.0, 2.0, 4.0]))
+    indices, weights = buffer.sample_indices(64)
+    probs = np.array([1.0, 1.0, 2.0, 4.0]) / 8.0
+    expected = (4 * probs[indices]) ** -0.5
+    np.testing.assert_allclose(weights, expected / expected.max(), rtol=1e-5)
+    # the least likely transitions weigh the most
+    assert weights[indices == 0].max() == 1.0
+
+
+def test_new_transitions_get_the_max_priority():
+    buffer = make_buffer(PrioritizedDictReplayBuffer, alpha=1.0)
+    add_one_by_one(buffer, make_transitions(buffer, 2))
+    buffer.update_priorities(np.arange(2), np.array([3.0, -5.0]))
+    add_one_by_one(buffer, make_transitions(buffer, 1, seed=1))
+    assert buffer.sum_tree[[2]][0] == pytest.approx(5.0)
+    buffer.anneal_beta(1.0)
+    assert buffer.beta == 1.0
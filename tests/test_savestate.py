@@ -0,0 +1,128 @@
+import struct
+
+import pytest
+
+from environment.memory import SimulatedMemory
+from environment.savestate import Region, Savestate, resolve
+
+
+# a scene laid out as in the game, see `_SAVESTATE_REGIONS` in the interface
+SCORE = 0xF5830
+TIMERS, TIMER = 0xDB520, 0x191E0
+ENEMY_MANAGER, LIST_HEAD = 0xDB544, 0xD0
+BOSS_HP = 0x11F0 + 0x3F74
+REGIONS = [
+    Region((SCORE,), 0x68),
+    Region((TIMERS, TIMER), 0x20),
+    Region((ENEMY_MANAGER, LIST_HEAD, 0x4, 0x4, 0x0, BOSS_HP), 0x4),
+]
+
+
+def map_boss(memory: SimulatedMemory, address: int, hp: int) -> None:
+    """
+    Map an enemy list at `address` leading to a boss with `hp`.
+    """
+    memory.map(address, 0x20)
+    memory.write_ptr(address + 0x4, address + 0x10)  # head.next
+    memory.write_ptr(address + 0x14, address + 0x1000)  # node.next
+    memory.map(address + 0x1000, 0x20)
+    memory.write_ptr(address + 0x1000, address + 0x2000)  # node.val
+    memory.map(address + 0x2000, BOSS_HP + 0x4)
+    memory.write(address + 0x2000 + BOSS_HP, struct.pack("<i", hp))
+
+
+@pytest.fixture
+def memory():
+    memory = SimulatedMemory()
+    base = memory.base_address
+    memory.map(base, 0x100000)
+    memory.map(0x2000000, TIMER + 0x20)
+    memory.write_ptr(base + TIMERS, 0x2000000)
+    memory.map(0x2100000, 0x100)
+    memory.write_ptr(base + ENEMY_MANAGER, 0x2100000)
+    map_boss(memory, 0x2200000, 1500)
+    memory.write_ptr(0x2100000 + LIST_HEAD, 0x2200000)
+    write_scene(memory, score=100, timer=600, boss_hp=1500)
+    return memory
+
+
+def write_scene(memory, score: int, timer: int, boss_hp: int) -> None:
+    for region, value in zip(REGIONS, (score, timer, boss_hp)):
+        memory.write(resolve(memory, region.path), struct.pack("<i", value))
+
+
+def read_scene(memory) -> tuple[int, ...]:
+    return tuple(
+        struct.unpack("<i", memory.read(resolve(memory, region.path), 4))[0]
+        for region in REGIONS
+    )
+
+
+def test_restore_writes_back_the_captured_scene(memory):
+    savestate = Savestate.capture(memory, REGIONS)
+    assert savestate.nbytes == sum(region.size for region in REGIONS)
+    write_scene(memory, score=5000, timer=2400, boss_hp=200)
+    # a pointer next to the saved fields, which the restore shouldn't touch
+    memory.write_ptr(0x2100000, 0x1234)
+    assert savestate.restore(memory)
+    assert read_scene(memory) == (100, 600, 1500)
+    assert memory.read_ptr(0x2100000) == 0x1234
+
+
+def test_restore_refuses_a_rebuilt_enemy_list(memory):
+    savestate = Savestate.capture(memory, REGIONS)
+    # a new run allocates a new boss
+    map_boss(memory, 0x2400000, 1500)
+    memory.write_ptr(0x2100000 + LIST_HEAD, 0x2400000)
+    write_scene(memory, score=5000, timer=2400, boss_hp=200)
+    assert not savestate.is_valid(memory)
+    assert not savestate.restore(memory)
+    # nothing is written, not even the static fields
+    assert read_scene(memory) == (5000, 2400, 200)
+
+
+def test_restore_refuses_an_unmapped_path(memory):
+    savestate = Savestate.capture(memory, REGIONS)
+    # the list was freed
+    memory.write_ptr(0x2100000 + LIST_HEAD, 0x7000000)
+    score = struct.pack("<i", 5000)
+    memory.write(memory.base_address + SCORE, score)
+    assert not savestate.restore(memory)
+    assert memory.read(memory.base_address + SCORE, 4) == score
+
+
+def test_capture_fails_on_an_unmapped_path(memory):
+    memory.write_ptr(memory.base_address + TIMERS, 0x7000000)
+    with pytest.raises(RuntimeError, match="not mapped"):
+        Savestate.capture(memory, REGIONS)
+
+
+def test_strided_region_restores_only_its_fields():
+    memory = SimulatedMemory()
+    memory.map(memory.base_address, 0x1000)
+    stride, count = 0x40, 8
+    pool = 0x3000000
+    memory.map(pool, stride * count)
+    memory.write_ptr(memory.base_address + 0x100, pool)
+    # a state field at 0x10 and a pointer at 0x20 in each element
+    region = Region((0x100, 0x10), 0x4, stride, count)
+    for i in range(count):
+        memory.write(pool + i * stride + 0x10, struct.pack("<i", i % 3))
+        memory.write_ptr(pool + i * stride + 0x20, 0x5000000 + i)
+    savestate = Savestate.capture(memory, [region])
+    assert savestate.nbytes == 4 * count
+
+    for i in range(count):
+        memory.write(pool + i * stride + 0x10, struct.pack("<i", 7))
+        memory.write_ptr(pool + i * stride + 0x20, 0x6000000 + i)
+    assert savestate.restore(memory)
+    for i in range(count):
+        field = memory.read(pool + i * stride + 0x10, 4)
+        assert struct.unpack("<i", field)[0] == i % 3
+        # the pointers keep their current values
+        assert memory.read_ptr(pool + i * stride + 0x20) == 0x6000000 + i
+
+
+def test_strided_region_should_not_overlap_itself(memory):
+    with pytest.raises(ValueError, match="stride"):
+        Savestate.capture(memory, [Region((SCORE,), 0x8, 0x4, 2)])
@@ -0,0 +1,96 @@
+import struct
+
+import numpy as np
+import pytest
+
+from environment.memory import SimulatedMemory
+from environment.scanner import MemoryScanner, find_pointer_paths
+
+HEAP_A = 0x2000000
+HEAP_B = 0x3000000
+
+
+@pytest.fixture
+def memory():
+    memory = SimulatedMemory()
+    memory.map(memory.base_address, 0x2000)
+    memory.map(HEAP_A, 0x1000)
+    memory.map(HEAP_B, 0x2000)
+    return memory
+
+
+def write_int(memory, address: int, value: int) -> None:
+    memory.write(address, struct.pack("<i", value))
+
+
+def test_exact_scans_narrow_down_the_candidates(memory):
+    lives = HEAP_A + 0x124
+    write_int(memory, lives, 3)
+    write_int(memory, HEAP_B + 0x10, 3)
+    scanner = MemoryScanner(memory, "int32", chunk_size=0x400)
+    assert scanner.exact(3) == 2
+    write_int(memory, lives, 2)
+    assert scanner.exact(2) == 1
+    assert scanner.addresses().tolist() == [lives]
+    assert scanner.values().tolist() == [2]
+
+
+def test_changed_and_unchanged_values_across_snapshots(memory):
+    timer = HEAP_B + 0x1800
+    scanner = MemoryScanner(memory, "int32", chunk_size=0x400)
+    scanner.start()
+    write_int(memory, timer, 60)
+    assert scanner.changed() == 1
+    assert scanner.addresses().tolist() == [timer]
+    assert scanner.unchanged() == 1
+    write_int(memory, timer, 61)
+    assert scanner.unchanged() == 0
+
+
+def test_relative_scan_needs_a_snapshot(memory):
+    with pytest.raises(ValueError, match="start"):
+        MemoryScanner(memory).changed()
+
+
+@pytest.mark.parametrize("value_type", ["int32", "float64"])
+def test_value_straddling_two_chunks_is_found(memory, value_type):
+    scanner = MemoryScanner(memory, value_type, alignment=2, chunk_size=0x10)
+    value = 12345
+    # starting 2 bytes before the end of the first chunk of the region
+    address = HEAP_A + 0x0E
+    packed = np.array([value], dtype=scanner.dtype).tobytes()
+    memory.write(address, packed)
+    assert scanner.exact(value) == 1
+    assert scanner.addresses().tolist() == [address]
+    # each aligned address where a value fits is a candidate exactly once
+    scanner.start()
+    expected = [
+        address
+        for start, size in memory.regions()
+        for address in range(start, start + size - scanner.dtype.itemsize + 1, 2)
+    ]
+    assert scanner.addresses().tolist() == expected
+
+
+def test_multi_level_pointer_path(memory):
+    memory.write_ptr(memory.base_address + 0x1234, HEAP_A)
+    memory.write_ptr(HEAP_A + 0x40, HEAP_B)
+    target = HEAP_B + 0x11F0
+    assert find_pointer_paths(memory, target) == [(0x1234, 0x40, 0x11F0)]
+    assert find_pointer_paths(memory, target, max_depth=1) == []
+    # a static address is its own path
+    assert find_pointer_paths(memory, memory.base_address + 0x10) == [(0x10,)]
+
+
+def test_max_nodes_keeps_the_smallest_offsets(memory):
+    target = HEAP_B + 0x11F0
+    memory.write_ptr(HEAP_A, target - 0x10)
+    memory.write_ptr(HEAP_A + 0x800, target - 0x20)
+    memory.write_ptr(memory.base_address + 0x100, HEAP_A)
+    memory.write_ptr(memory.base_address + 0x200, HEAP_A + 0x800)
+    assert find_pointer_paths(memory, target) == [
+        (0x100, 0x0, 0x10),
+        (0x100, 0x800, 0x20),
+        (0x200, 0x0, 0x20),
+    ]
+    assert find_pointer_paths(memory, target, max_nodes=1) == [(0x100, 0x0, 0x10)]
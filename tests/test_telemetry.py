@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+from environment.simulated import SimulatedTouhou14Env
+from environment.telemetry import TelemetryReader, TelemetryStore, TelemetryWrapper
+
+COLUMNS = {"episode": np.int32, "reward": np.float32, "frozen": np.bool_}
+
+
+def test_rows_are_published_to_an_open_reader(tmp_path):
+    store = TelemetryStore(str(tmp_path), COLUMNS, segment_rows=4)
+    reader = TelemetryReader(str(tmp_path))
+    assert len(reader) == 0
+    assert reader["reward"].shape == (0,)
+    for i in range(10):
+        store.append({"episode": i // 4, "reward": i * 0.5, "frozen": i == 7})
+        # the reader sees every row as soon as it is appended
+        assert len(reader) == i + 1
+        assert reader.read("reward", -1)[0] == i * 0.5
+    np.testing.assert_array_equal(reader["reward"], np.arange(10) * 0.5)
+    assert reader["frozen"].tolist() == [i == 7 for i in range(10)]
+    assert reader["episode"].dtype == np.int32
+    store.close()
+
+
+@pytest.mark.parametrize("start, stop", [(0, 3), (2, 9), (4, 8), (5, None), (-3, -1)])
+def test_rows_are_read_across_segments(tmp_path, start, stop):
+    store = TelemetryStore(str(tmp_path), COLUMNS, segment_rows=4)
+    for i in range(10):
+        store.append({"episode": i})
+    store.close()
+    reader = TelemetryReader(str(tmp_path))
+    np.testing.assert_array_equal(
+        reader.read("episode", start, stop), np.arange(10)[start:stop]
+    )
+    columns = reader.read_all(["episode", "reward"], start, stop)
+    assert len(columns["episode"]) == len(columns["reward"])
+    # the missing columns are 0
+    assert not columns["reward"].any()
+
+
+def test_appending_to_an_existing_store(tmp_path):
+    store = TelemetryStore(str(tmp_path), COLUMNS, segment_rows=4)
+    for i in range(5):
+        store.append({"episode": i})
+    store.close()
+    # the columns of the existing store are kept
+    store = TelemetryStore(str(tmp_path), {"other": np.int8})
+    assert store.count == 5
+    store.append({"episode": 5})
+    store.close()
+    reader = TelemetryReader(str(tmp_path))
+    assert reader.columns == list(COLUMNS)
+    np.testing.assert_array_equal(reader["episode"], np.arange(6))
+    with pytest.raises(ValueError, match="Unknown column"):
+        reader.read("other")
+
+
+def test_store_needs_columns(tmp_path):
+    with pytest.raises(ValueError, match="Columns"):
+        TelemetryStore(str(tmp_path / "store"))
+
+
+def test_wrapper_records_the_episodes(tmp_path):
+    path = str(tmp_path)
+    for _ in range(2):
+        env = TelemetryWrapper(
+            SimulatedTouhou14Env(frame_downsize_ratio=0.125, time_limit=40),
+            path,
+            segment_rows=8,
+        )
+        env.reset(seed=0)
+        length = 0
+        while True:
+            _, _, terminated, truncated, _ = env.step(0)
+            length += 1
+            if terminated or truncated:
+                break
+        env.close()
+    reader = TelemetryReader(path)
+    starts, stops = reader.episode_bounds()
+    # the second run goes on from the episodes of the first
+    assert reader["episode"][starts].tolist() == [0, 1]
+    assert stops.tolist() == [starts[1], len(reader)]
+    steps = reader["step"]
+    assert steps[starts].tolist() == [0, 0]
+    assert (reader["terminated"] | reader["truncated"])[stops - 1].all()
+    # the same seeded episode twice
+    assert len(reader) == 2 * length
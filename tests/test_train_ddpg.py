@@ -0,0 +1,54 @@
+import glob
+import json
+import os
+import subprocess
+import sys
+
+SCRIPTS = os.path.join(os.path.dirname(os.path.dirname(__file__)), "scripts")
+
+
+def run_script(name: str, *args: str, cwd) -> None:
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(SCRIPTS))
+    subprocess.run(
+        [sys.executable, os.path.join(SCRIPTS, name), *args],
+        cwd=cwd,
+        env=env,
+        check=True,
+        capture_output=True,
+    )
+
+
+def test_eval_service_builds_the_env_of_a_ddpg_run(tmp_path):
+    run_script(
+        "train_ddpg.py",
+        "--simulated",
+        "--device=cpu",
+        "--steps=10",
+        "--memory=20",
+        "--extractor=touhou",
+        "--channels_first",
+        "--repeat_choices",
+        "4",
+        "8",
+        cwd=tmp_path,
+    )
+    (save_dir,) = glob.glob(os.path.join(tmp_path, "save", "ddpg_*"))
+    assert os.path.exists(os.path.join(save_dir, "model_final.zip"))
+    with open(os.path.join(save_dir, "metadata.json")) as f:
+        metadata = json.load(f)
+    assert metadata["channels_first"] is True
+    assert metadata["repeat_choices"] == [4, 8]
+
+    # the actions of the model pick a repeat choice, which the env of the
+    # eval service only accepts when built with the same repeat choices
+    run_script(
+        "eval_service.py",
+        "--simulated",
+        "--once",
+        "--algorithm=ddpg",
+        f"--save_dir={save_dir}",
+        cwd=tmp_path,
+    )
+    with open(os.path.join(save_dir, "eval_results.jsonl")) as f:
+        results = [json.loads(line) for line in f]
+    assert {r["checkpoint"] for r in results} >= {"model_final.zip"}